@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import os
+import signal
+
+import grpc
+
+# Import the generated classes
+from generated import user_pb2
+from generated import user_pb2_grpc
+
+from .repository import AsyncUserRepository, DuplicateUser, VersionConflict, get_repository
+from .hashing import HashingBusy, Rehasher, get_hasher
+from .ids import new_user_id
+from .cache import MISSING, get_user_cache
+from .ratelimit import RateLimited, get_login_limiter
+from .bulk import BULK_BATCH_SIZE, BulkRegistration
+from .precheck import get_registration_index
+from .sessions import get_session_store
+from .events import CursorOutOfRange, get_event_feed, get_user_cache_sync
+from .logs import request_log
+from .metrics import REGISTRY, AioMetricsInterceptor
+from .server import (
+    PORT, GRPC_GRACE_PERIOD, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_BATCH_SIZE, MAX_BATCH_GET_IDS,
+    BULK_IMPORT_TOKEN, USER_EVENTS_TOKEN, USER_LOOKUP_TOKEN,
+    authenticate, authenticate_service, user_message, parse_list_request, users_page, batch_get_response,
+    parse_update_request, update_failed, login_response, logout_claims, refresh_failed,
+    parse_search_request, search_page, server_options, user_event_message, parse_watch_request, watch_refused,
+    cursor_out_of_range,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on in-flight RPCs; None lets grpc.aio accept as many as arrive.
+MAX_CONCURRENT_RPCS = os.getenv('GRPC_MAX_CONCURRENT_RPCS')
+
+
+class AsyncUserServiceServicer(user_pb2_grpc.UserServiceServicer):
+    """The UserService for the grpc.aio server.
+
+    Mirrors UserServiceServicer, but every method is a coroutine: database
+    calls run on the AsyncUserRepository threads, bcrypt on the hashing
+    executor and Redis-backed cache and rate limit calls on threads of
+    their own, so the event loop only ever waits on futures.
+    """
+
+    def __init__(self, users=None, hasher=None, cache=None, limiter=None, taken=None, sessions=None,
+                 events=None):
+        self.users = users or AsyncUserRepository(get_repository())
+        self.hasher = hasher or get_hasher()
+        self.cache = cache or get_user_cache()
+        self.limiter = limiter or get_login_limiter()
+        self.taken = taken or get_registration_index()
+        self.sessions = sessions or get_session_store()
+        self.events = events or get_event_feed()
+        self.rehasher = Rehasher(self.hasher, self.users.repository, self.cache)
+
+    @staticmethod
+    async def _run(component, method, *args):
+        """Calls `method` of the cache or limiter, off the loop if it makes a network round trip."""
+        if component.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def _find_user_by_id(self, user_id):
+        user_record = await self._run(self.cache, self.cache.get_by_id, user_id)
+        if user_record is MISSING:
+            user_record = await self.users.get_user_by_id(user_id)
+            await self._run(self.cache, self.cache.put_id, user_id, user_record)
+        return user_record
+
+    async def _find_user_by_email(self, email):
+        user_record = await self._run(self.cache, self.cache.get_by_email, email)
+        if user_record is MISSING:
+            user_record = await self.users.get_user_by_email(email)
+            await self._run(self.cache, self.cache.put_email, email, user_record)
+        return user_record
+
+    async def RegisterUser(self, request, context):
+        request_log.debug("RegisterUser request received")
+        username = request.username
+        email = request.email
+        password = request.password
+
+        if not all([username, email, password]):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("All fields (username, email, password) are required.")
+            return user_pb2.UserResponse()
+
+        # Turn a likely duplicate away before paying for bcrypt.
+        if self.taken.might_be_taken(username, email) and self.taken.confirmed(
+                await self.users.find_taken([username], [email])):
+            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+            context.set_details("User with this username or email already exists.")
+            return user_pb2.UserResponse()
+
+        try:
+            hashed_password = await asyncio.wrap_future(
+                self.hasher.submit_hash(password.encode('utf-8'))
+            )
+        except HashingBusy as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.UserResponse()
+
+        try:
+            user_id = new_user_id()
+            await self.users.insert_user(user_id, username, email, hashed_password)
+            self.taken.add(username, email)
+            # Overwrites any cached "not found" for this email.
+            await self._run(self.cache, self.cache.put_id, user_id, {
+                'id': user_id, 'username': username, 'email': email,
+                'hashed_password': hashed_password, 'version': 1,
+            })
+            request_log.info("User %s created with ID %s", username, user_id)
+
+            user_message = user_pb2.User(id=user_id, username=username, email=email, version=1)
+            return user_pb2.UserResponse(user=user_message)
+        except DuplicateUser:
+            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+            context.set_details("User with this username or email already exists.")
+            return user_pb2.UserResponse()
+
+    async def BulkRegisterUsers(self, request_iterator, context):
+        request_log.debug("BulkRegisterUsers request received")
+        if not authenticate_service(context, BULK_IMPORT_TOKEN, 'BULK_IMPORT_TOKEN'):
+            return user_pb2.BulkRegisterUsersResponse()
+        bulk = BulkRegistration(self.users.repository, self.hasher, self.cache, self.taken)
+        batch = []
+        index = 0
+        async for request in request_iterator:
+            batch.append((index, request))
+            index += 1
+            if len(batch) >= BULK_BATCH_SIZE:
+                # A batch blocks on bcrypt and SQLite, so keep it off the loop.
+                await asyncio.to_thread(bulk.add_batch, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(bulk.add_batch, batch)
+        logger.info("Bulk registration created %d of %d users", bulk.created, len(bulk.results))
+        return bulk.response()
+
+    async def LoginUser(self, request, context):
+        request_log.debug("LoginUser request received")
+        email = request.email
+        password = request.password.encode('utf-8')
+
+        # Throttle before the lookup and the bcrypt check an attacker wants us to pay for.
+        try:
+            await self._run(self.limiter, self.limiter.check, email, context.peer())
+        except RateLimited as e:
+            request_log.info("Login attempt rejected by the %s rate limit", e.scope)
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.LoginUserResponse()
+
+        user_record = await self._find_user_by_email(email)
+
+        try:
+            password_ok = user_record is not None and await asyncio.wrap_future(
+                self.hasher.submit_check(password, user_record['hashed_password'])
+            )
+        except HashingBusy as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.LoginUserResponse()
+
+        if password_ok:
+            request_log.info("User %s logged in successfully.", user_record['username'])
+            self.rehasher.after_login(user_record, password)
+            refresh_token = await self.users.run(self.sessions.issue, user_record['id'])
+            return login_response(user_record, refresh_token)
+
+        request_log.info("Invalid login attempt")
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Invalid email or password")
+        return user_pb2.LoginUserResponse()
+
+    async def RefreshToken(self, request, context):
+        request_log.debug("RefreshToken request received")
+        rotated = None
+        if request.refresh_token:
+            rotated = await self.users.run(self.sessions.rotate, request.refresh_token)
+        if rotated is None:
+            return refresh_failed(context)
+        user_id, refresh_token = rotated
+        user_record = await self._find_user_by_id(user_id)
+        if user_record is None:
+            return refresh_failed(context)
+        return login_response(user_record, refresh_token)
+
+    async def Logout(self, request, context):
+        request_log.debug("Logout request received")
+        await self.users.run(self.sessions.logout, logout_claims(context), request.refresh_token)
+        return user_pb2.LogoutResponse()
+
+    async def GetUser(self, request, context):
+        payload = authenticate(context)
+        if payload is None:
+            return user_pb2.UserResponse()
+        user_id = payload['user_id']
+
+        request_log.debug("GetUser request received for user_id from token: %s", user_id)
+        user_record = await self._find_user_by_id(user_id)
+
+        if user_record:
+            return user_pb2.UserResponse(user=user_message(user_record))
+        else:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details("User not found")
+            return user_pb2.UserResponse()
+
+    async def UpdateUserProfile(self, request, context):
+        claims = authenticate(context)
+        if claims is None:
+            return user_pb2.UserResponse()
+        parsed = parse_update_request(request, claims, context)
+        if parsed is None:
+            return user_pb2.UserResponse()
+        changes, expected_version = parsed
+        user_id = claims['user_id']
+
+        try:
+            user_record = await self.users.update_user(user_id, changes, expected_version)
+        except (DuplicateUser, VersionConflict) as e:
+            return update_failed(e, context)
+        if user_record is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details("User not found")
+            return user_pb2.UserResponse()
+
+        # The fresh record also makes a cached lookup by the old email miss.
+        await self._run(self.cache, self.cache.put_id, user_id, user_record)
+        self.taken.add(user_record['username'], user_record['email'])
+        request_log.info("User %s updated %s", user_id, ', '.join(changes))
+        return user_pb2.UserResponse(user=user_message(user_record))
+
+    async def BatchGetUsers(self, request, context):
+        if not authenticate_service(context, USER_LOOKUP_TOKEN, 'USER_LOOKUP_TOKEN'):
+            return user_pb2.BatchGetUsersResponse()
+        if len(request.user_ids) > MAX_BATCH_GET_IDS:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"At most {MAX_BATCH_GET_IDS} user IDs per request.")
+            return user_pb2.BatchGetUsersResponse()
+
+        records, missing = await self._run(self.cache, self.cache.get_many, dict.fromkeys(request.user_ids))
+        if missing:
+            found = await self.users.get_users_by_ids(missing)
+            await self._run(self.cache, self.cache.put_many, missing, found)
+            records.update(found)
+        return batch_get_response(request.user_ids, records)
+
+    async def ListAllUsers(self, request, context):
+        # Kept for old clients; this is just the first page of ListUsers.
+        return await self.ListUsers(user_pb2.ListUsersRequest(), context)
+
+    async def ListUsers(self, request, context):
+        if authenticate(context) is None:
+            return user_pb2.ListUsersResponse()
+        parsed = parse_list_request(request, context)
+        if parsed is None:
+            return user_pb2.ListUsersResponse()
+        page_size, after = parsed
+        page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+        rows = await self.users.list_users(after, page_size + 1)
+        return users_page(rows, page_size)
+
+    async def SearchUsers(self, request, context):
+        if authenticate(context) is None:
+            return user_pb2.ListUsersResponse()
+        parsed = parse_search_request(request, context)
+        if parsed is None:
+            return user_pb2.ListUsersResponse()
+        query, page_size, offset = parsed
+
+        rows = await self.users.search_users(query, page_size + 1, offset) if page_size else []
+        return search_page(rows, query, page_size, offset)
+
+    async def StreamUsers(self, request, context):
+        if authenticate(context) is None:
+            return
+        parsed = parse_list_request(request, context)
+        if parsed is None:
+            return
+        limit, after = parsed
+
+        # Keyset batches, as in UserServiceServicer.StreamUsers; each yield
+        # waits for flow control, so a slow client can't make us buffer.
+        sent = 0
+        while True:
+            batch_size = STREAM_BATCH_SIZE if not limit else min(STREAM_BATCH_SIZE, limit - sent)
+            rows = await self.users.list_users(after, batch_size)
+            for row in rows:
+                yield user_message(row)
+            sent += len(rows)
+            if len(rows) < batch_size or (limit and sent >= limit):
+                return
+            after = (rows[-1]['username'], rows[-1]['id'])
+
+    async def WatchUserEvents(self, request, context):
+        if not authenticate_service(context, USER_EVENTS_TOKEN, 'USER_EVENTS_TOKEN'):
+            return
+        batch_size = parse_watch_request(request, context)
+        if batch_size is None:
+            return
+        if not self.events.acquire():
+            watch_refused(context)
+            return
+        # A cancelled stream is left suspended rather than closed, as in the
+        # sync server, so the slot is given back when the RPC is done.
+        context.add_done_callback(lambda _: self.events.release())
+        try:
+            after = self.events.start_after(request.after_sequence, request.from_latest,
+                                            await self.users.get_user_event_range())
+        except CursorOutOfRange as e:
+            cursor_out_of_range(e, context)
+            return
+
+        # As in UserServiceServicer.WatchUserEvents: a batch at a time, each
+        # yield waiting for flow control.
+        while not self.events.stopping:
+            rows = await self.users.list_user_events(after, batch_size)
+            for row in rows:
+                yield user_event_message(row)
+            if rows:
+                after = rows[-1]['sequence']
+                self.events.sent(len(rows))
+            if len(rows) < batch_size:
+                await asyncio.sleep(self.events.poll_interval)
+
+
+async def serve_async(reuse_port=False):
+    """Runs the grpc.aio server until SIGTERM or SIGINT, then drains it."""
+    max_rpcs = int(MAX_CONCURRENT_RPCS) if MAX_CONCURRENT_RPCS else None
+    server = grpc.aio.server(interceptors=[AioMetricsInterceptor()],
+                             maximum_concurrent_rpcs=max_rpcs,
+                             options=server_options(reuse_port))
+    servicer = AsyncUserServiceServicer()
+    user_pb2_grpc.add_UserServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"[::]:{PORT}")
+    get_hasher().warm_up()
+    get_hasher().calibrate()
+    REGISTRY.register_collector('rehash', servicer.rehasher.stats)
+
+    draining = []
+
+    def drain():
+        logger.info("Draining: in-flight RPCs get %ss to finish.", GRPC_GRACE_PERIOD)
+        get_event_feed().stop()
+        draining.append(asyncio.ensure_future(server.stop(GRPC_GRACE_PERIOD)))
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, drain)
+    loop.add_signal_handler(signal.SIGINT, drain)
+    await server.start()
+    logger.info("gRPC asyncio server started, listening on port %s.", PORT)
+    try:
+        await server.wait_for_termination()
+    except asyncio.CancelledError:
+        await server.stop(0)
+    finally:
+        servicer.users.close()
+        get_registration_index().stop()
+        get_session_store().stop()
+        get_event_feed().stop()
+        get_user_cache_sync().stop()
+        servicer.rehasher.shutdown()
+        get_hasher().shutdown()
+        get_repository().close()
+        logger.info("gRPC asyncio server stopped.")
@@ -0,0 +1,402 @@
+import argparse
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import jwt
+from dotenv import load_dotenv
+
+from . import metrics
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Always accepted while JWT_SECRET_KEY is set, whatever JWT_ALGORITHM signs with.
+JWT_ALGORITHM = 'HS256'
+# Algorithms for a private key in JWT_PRIVATE_KEY_FILE, by JWK key type.
+ASYMMETRIC_ALGORITHMS = {'RSA': 'RS256', 'OKP': 'EdDSA'}
+# Access tokens are short-lived; clients renew them with a refresh token
+# (backend/sessions.py), which needs no password check.
+ACCESS_TOKEN_LIFETIME = timedelta(seconds=float(os.getenv('ACCESS_TOKEN_TTL', '900')))
+# Where the metrics server publishes the JWKS.
+JWKS_PATH = '/.well-known/jwks.json'
+# Verified tokens kept in memory, and how long one may be trusted without
+# re-checking its signature (never beyond its own `exp`).
+JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', '10000'))
+JWT_CACHE_TTL = float(os.getenv('JWT_CACHE_TTL', '300'))
+
+
+class TokenCache:
+    """A bounded LRU map of verified token -> claims with per-entry expiry."""
+
+    def __init__(self, max_size=JWT_CACHE_SIZE, ttl=JWT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, token):
+        """Returns the cached claims for `token`, or None on a miss.
+
+        Raises jwt.ExpiredSignatureError if the cached token has expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._misses += 1
+                return None
+            claims, expires_at = entry
+            if now >= expires_at:
+                del self._entries[token]
+                self._misses += 1
+                exp = claims.get('exp')
+                if exp is not None and now >= exp:
+                    raise jwt.ExpiredSignatureError("Signature has expired")
+                return None
+            self._entries.move_to_end(token)
+            self._hits += 1
+            return claims
+
+    def put(self, token, claims):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = claims.get('exp')
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token] = (claims, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """Raised for a validly signed token that was revoked at logout."""
+
+
+class RevocationList:
+    """The jtis of access tokens revoked before they expired.
+
+    Lookups are a dict probe. Each jti is dropped once the token it names
+    would have expired anyway, so the list only ever holds the last
+    ACCESS_TOKEN_LIFETIME's worth of logouts.
+    """
+
+    def __init__(self):
+        self._expiry = {}
+        # (expires_at, jti), soonest first, for pruning.
+        self._heap = []
+        self._lock = threading.Lock()
+        self._pruned = 0
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            if jti not in self._expiry:
+                self._expiry[jti] = expires_at
+                heapq.heappush(self._heap, (expires_at, jti))
+            self._prune(time.time())
+
+    def __contains__(self, jti):
+        return jti is not None and jti in self._expiry
+
+    def prune(self):
+        with self._lock:
+            self._prune(time.time())
+
+    def _prune(self, now):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, jti = heapq.heappop(heap)
+            del self._expiry[jti]
+            self._pruned += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'revoked': len(self._expiry),
+                'revocations_pruned': self._pruned,
+            }
+
+
+def load_private_key(path):
+    from cryptography.hazmat.primitives import serialization  # Optional dependency, only needed for RS256/EdDSA.
+
+    with open(path, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+def load_public_key(path):
+    """Reads a PEM public key, or the public half of a PEM private key."""
+    from cryptography.hazmat.primitives import serialization  # Optional dependency, only needed for RS256/EdDSA.
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b'PRIVATE KEY' in data:
+        return serialization.load_pem_private_key(data, password=None).public_key()
+    return serialization.load_pem_public_key(data)
+
+
+def public_jwk(public_key):
+    """Returns the JWK of an RSA or Ed25519 public key, with its `alg` and `kid`.
+
+    The kid is the key's RFC 7638 thumbprint, so it never has to be
+    configured and the same key always gets the same one.
+    """
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa  # Optional dependency, only needed for RS256/EdDSA.
+    from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+    if isinstance(public_key, rsa.RSAPublicKey):
+        jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+    else:
+        raise ValueError("Only RSA and Ed25519 keys can sign tokens.")
+    required = ('e', 'kty', 'n') if jwk['kty'] == 'RSA' else ('crv', 'kty', 'x')
+    canonical = json.dumps({name: jwk[name] for name in required}, separators=(',', ':'), sort_keys=True)
+    kid = base64.urlsafe_b64encode(hashlib.sha256(canonical.encode()).digest()).rstrip(b'=').decode()
+    return {**jwk, 'alg': ASYMMETRIC_ALGORITHMS[jwk['kty']], 'use': 'sig', 'kid': kid}
+
+
+def write_jwks(path, jwks):
+    # Readers may poll the file; never let them see it half-written.
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(jwks, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class TokenService:
+    """Issues and verifies JWTs with keys loaded once rather than per request.
+
+    Tokens are signed with JWT_ALGORITHM: HS256 with JWT_SECRET_KEY, or
+    RS256/EdDSA with the private key in JWT_PRIVATE_KEY_FILE. Asymmetric
+    tokens carry the key's kid, and the public keys are published as a
+    JWKS (jwks(), and the JWT_JWKS_FILE file), so other services can
+    verify tokens without holding any secret.
+
+    `reload()` re-reads the keys (and the .env file) for key rotation.
+    Tokens signed with JWT_PREVIOUS_SECRET_KEY or with a public key listed
+    in JWT_PREVIOUS_PUBLIC_KEY_FILES are still accepted, so users stay
+    logged in while the old key is phased out; HS256 tokens are accepted
+    as long as JWT_SECRET_KEY is set.
+    """
+
+    def __init__(self, cache=None, revoked=None):
+        self.cache = cache or TokenCache()
+        self.revoked = revoked or RevocationList()
+        self._lock = threading.Lock()
+        self._algorithm = JWT_ALGORITHM
+        self._signing_key = None
+        self._headers = None
+        self._verifying_keys = ()
+        self._public_keys = {}
+        self._jwks = {'keys': []}
+        self._load_keys()
+
+    def _load_keys(self):
+        secret_key = os.getenv('JWT_SECRET_KEY')
+        previous_key = os.getenv('JWT_PREVIOUS_SECRET_KEY')
+        algorithm = os.getenv('JWT_ALGORITHM', JWT_ALGORITHM)
+        signing_key, headers = secret_key, None
+        # kid -> (public key, algorithm), current key first.
+        public_keys = {}
+        jwks = []
+        if algorithm != JWT_ALGORITHM:
+            signing_key = load_private_key(os.getenv('JWT_PRIVATE_KEY_FILE'))
+            jwk = public_jwk(signing_key.public_key())
+            if jwk['alg'] != algorithm:
+                raise ValueError(f"JWT_PRIVATE_KEY_FILE holds a {jwk['kty']} key, not one for {algorithm}.")
+            headers = {'kid': jwk['kid']}
+            public_keys[jwk['kid']] = (signing_key.public_key(), algorithm)
+            jwks.append(jwk)
+        for path in filter(None, os.getenv('JWT_PREVIOUS_PUBLIC_KEY_FILES', '').split(',')):
+            public_key = load_public_key(path.strip())
+            jwk = public_jwk(public_key)
+            if jwk['kid'] not in public_keys:
+                public_keys[jwk['kid']] = (public_key, jwk['alg'])
+                jwks.append(jwk)
+
+        with self._lock:
+            self._algorithm = algorithm
+            self._signing_key = signing_key
+            self._headers = headers
+            self._verifying_keys = tuple(k for k in (secret_key, previous_key) if k)
+            self._public_keys = public_keys
+            self._jwks = {'keys': jwks}
+        jwks_file = os.getenv('JWT_JWKS_FILE')
+        if jwks_file:
+            write_jwks(jwks_file, self._jwks)
+
+    def reload(self):
+        # The .env file is the usual place keys are rotated, so let it win here.
+        load_dotenv(override=True)
+        self._load_keys()
+        # Claims verified under a retired key must be checked again.
+        self.cache.clear()
+
+    def create_token(self, user_id, username):
+        payload = {
+            'user_id': user_id,
+            'username': username,
+            'exp': datetime.utcnow() + ACCESS_TOKEN_LIFETIME,
+            'iat': datetime.utcnow(),
+            # Names the token in the revocation list.
+            'jti': secrets.token_urlsafe(12),
+        }
+        with self._lock:
+            signing_key, algorithm, headers = self._signing_key, self._algorithm, self._headers
+        with metrics.span('jwt'):
+            return jwt.encode(payload, signing_key, algorithm=algorithm, headers=headers)
+
+    def decode_token(self, token):
+        with metrics.span('jwt'):
+            claims = self._decode(token)
+        # Checked on every call, cached or not: a verified token may be revoked since.
+        if claims.get('jti') in self.revoked:
+            raise TokenRevoked("Token has been revoked.")
+        return claims
+
+    def _decode(self, token):
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') != JWT_ALGORITHM:
+            entry = self._public_keys.get(header.get('kid'))
+            if entry is None:
+                raise jwt.InvalidSignatureError("Token signed with an unknown key.")
+            public_key, algorithm = entry
+            # Only the algorithm that key was published for: no alg confusion.
+            claims = jwt.decode(token, public_key, algorithms=[algorithm])
+            self.cache.put(token, claims)
+            return claims
+
+        keys = self._verifying_keys
+        if not keys:
+            raise jwt.InvalidTokenError("No JWT verification key is configured.")
+        for key in keys[:-1]:
+            try:
+                claims = jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+                break
+            except jwt.InvalidSignatureError:
+                continue
+        else:
+            claims = jwt.decode(token, keys[-1], algorithms=[JWT_ALGORITHM])
+
+        self.cache.put(token, claims)
+        return claims
+
+    def jwks(self):
+        """Returns the JWKS of every public key tokens are accepted for."""
+        return self._jwks
+
+    def stats(self):
+        return {**self.cache.stats(), **self.revoked.stats()}
+
+
+_token_service = None
+_token_service_lock = threading.Lock()
+
+
+def get_token_service():
+    """Returns the process-wide TokenService, loading the keys on first use."""
+    global _token_service
+    if _token_service is None:
+        with _token_service_lock:
+            if _token_service is None:
+                _token_service = TokenService()
+    return _token_service
+
+
+def reload_keys(*_):
+    """Reloads the JWT keys; also usable directly as a signal handler."""
+    get_token_service().reload()
+    logger.info("JWT keys reloaded.")
+
+
+def create_token(user_id, username):
+    """Issues a signed JWT for a user who has just logged in."""
+    return get_token_service().create_token(user_id, username)
+
+
+def token_from_metadata(metadata):
+    """Returns the bearer token from gRPC invocation metadata, or None."""
+    for key, value in metadata:
+        if key == 'authorization':
+            return value.replace('Bearer ', '') or None
+    return None
+
+
+def decode_token(token):
+    """Verifies `token` and returns its claims, using the verified-token cache.
+
+    Raises jwt.ExpiredSignatureError, TokenRevoked or jwt.InvalidTokenError.
+    """
+    return get_token_service().decode_token(token)
+
+
+def generate_key(path, algorithm):
+    """Writes a new private key for `algorithm` to `path` (mode 0600); returns its kid."""
+    from cryptography.hazmat.primitives import serialization  # Optional dependency, only needed for RS256/EdDSA.
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == 'RS256':
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(pem)
+    return public_jwk(private_key.public_key())['kid']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the keys JWTs are signed with.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate-key', help="write a new private key")
+    generate.add_argument('path', help="PEM file to create")
+    generate.add_argument('--algorithm', choices=sorted(ASYMMETRIC_ALGORITHMS.values()),
+                          default='EdDSA', help="signing algorithm the key is for (default: EdDSA)")
+    commands.add_parser('jwks', help="print the JWKS for the configured keys")
+    args = parser.parse_args()
+
+    if args.command == 'generate-key':
+        kid = generate_key(args.path, args.algorithm)
+        print(f"Wrote {args.algorithm} key {kid} to {args.path}.")
+    else:
+        print(json.dumps(TokenService().jwks(), indent=2))
+
+if __name__ == '__main__':
+    main()
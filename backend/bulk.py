@@ -0,0 +1,101 @@
+import os
+
+# Import the generated classes
+from generated import user_pb2
+
+from .ids import new_user_id
+
+
+# Requests hashed and inserted together; one transaction per batch.
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '500'))
+
+CREATED = user_pb2.BulkRegisterResult.CREATED
+ALREADY_EXISTS = user_pb2.BulkRegisterResult.ALREADY_EXISTS
+INVALID = user_pb2.BulkRegisterResult.INVALID
+
+
+def batches(requests, size=BULK_BATCH_SIZE):
+    """Groups a stream of requests into lists of (index, request)."""
+    batch = []
+    for index, request in enumerate(requests):
+        batch.append((index, request))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkRegistration:
+    """Registers the users of one BulkRegisterUsers call, a batch at a time.
+
+    For each batch, requests that are invalid, repeated within the call or
+    already taken in the database are answered without hashing; only the
+    ones the registration index can't rule out are looked up. The rest are
+    hashed in parallel on the hashing executor and inserted with a single
+    multi-row insert.
+    """
+
+    def __init__(self, users, hasher, cache, taken):
+        self.users = users
+        self.hasher = hasher
+        self.cache = cache
+        self.taken = taken
+        self.results = []
+        self.created = 0
+        self._usernames = set()
+        self._emails = set()
+
+    def add_batch(self, batch):
+        results = {}
+        candidates = []
+        for index, request in batch:
+            if not all([request.username, request.email, request.password]):
+                results[index] = user_pb2.BulkRegisterResult(
+                    index=index, status=INVALID,
+                    error="All fields (username, email, password) are required.")
+            elif request.username in self._usernames or request.email in self._emails:
+                results[index] = user_pb2.BulkRegisterResult(
+                    index=index, status=ALREADY_EXISTS,
+                    error="Username or email appears earlier in this import.")
+            else:
+                self._usernames.add(request.username)
+                self._emails.add(request.email)
+                candidates.append((index, request))
+
+        suspects = [r for _, r in candidates if self.taken.might_be_taken(r.username, r.email)]
+        taken_usernames, taken_emails = self.users.find_taken(
+            [r.username for r in suspects], [r.email for r in suspects])
+        to_create = []
+        for index, request in candidates:
+            if self.taken.confirmed((request.username in taken_usernames,
+                                     request.email in taken_emails)):
+                results[index] = user_pb2.BulkRegisterResult(
+                    index=index, status=ALREADY_EXISTS,
+                    error="User with this username or email already exists.")
+            else:
+                to_create.append((index, request))
+
+        hashes = self.hasher.hash_many([r.password.encode('utf-8') for _, r in to_create])
+        rows = [(new_user_id(), r.username, r.email, hashed_password)
+                for (_, r), hashed_password in zip(to_create, hashes)]
+        inserted = self.users.insert_users(rows)
+
+        for (index, request), row in zip(to_create, rows):
+            if row[0] in inserted:
+                self.taken.add(request.username, request.email)
+                results[index] = user_pb2.BulkRegisterResult(
+                    index=index, status=CREATED, user_id=row[0])
+            else:
+                # Someone registered the same username or email since the check.
+                results[index] = user_pb2.BulkRegisterResult(
+                    index=index, status=ALREADY_EXISTS,
+                    error="User with this username or email already exists.")
+        self.created += len(inserted)
+        # Drop cached "not found" entries for the new emails.
+        self.cache.invalidate(emails=[r.email for _, r in to_create])
+
+        self.results.extend(results[index] for index, _ in batch)
+
+    def response(self):
+        return user_pb2.BulkRegisterUsersResponse(results=self.results, created=self.created)
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# 'local' is an in-process LRU, 'redis' a shared Redis-compatible server and
+# 'none' disables caching.
+USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'local')
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '50000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+# Unknown ids/emails are remembered briefly so repeated misses skip SQLite.
+USER_CACHE_NEGATIVE_TTL = float(os.getenv('USER_CACHE_NEGATIVE_TTL', '5'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Returned by the cache when it knows nothing about a key; a cached None
+# means "looked up and not found".
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a TTL per entry."""
+
+    # Whether calls wait on the network (see AsyncUserServiceServicer._run).
+    blocking = False
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'evictions': self._evictions}
+
+
+class RedisCache:
+    """Cache backend on a Redis-compatible server shared by several processes.
+
+    Values must be JSON-serialisable. Requires the optional `redis` package.
+    """
+
+    blocking = True
+
+    def __init__(self, url=REDIS_URL, prefix='users:'):
+        import redis  # Optional dependency, only needed for this backend.
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        if raw is None:
+            return MISSING
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*(self._prefix + key for key in keys))
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self._prefix + '*'):
+            self._client.delete(key)
+
+    def stats(self):
+        info = self._client.info('stats')
+        return {'size': self._client.dbsize(), 'evictions': info.get('evicted_keys', 0)}
+
+
+class NullCache:
+    """Backend that never stores anything."""
+
+    blocking = False
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'size': 0, 'evictions': 0}
+
+
+def _to_cached(record):
+    # sqlite3.Row -> plain dict; bcrypt hashes are ASCII, so store them as
+    # text so every backend can serialise the record.
+    user = dict(record)
+    hashed_password = user.get('hashed_password')
+    if isinstance(hashed_password, bytes):
+        user['hashed_password'] = hashed_password.decode('ascii')
+    return user
+
+
+def _from_cached(user):
+    user = dict(user)
+    if isinstance(user.get('hashed_password'), str):
+        user['hashed_password'] = user['hashed_password'].encode('ascii')
+    return user
+
+
+class UserCache:
+    """Read-through cache for user records keyed by id, plus an email -> id index.
+
+    Lookups return a user dict, None for a cached "not found", or MISSING
+    when the caller has to go to the database and then call put_id() /
+    put_email() with what it found. Writers call invalidate() (or put_id()
+    with the fresh record) after committing.
+    """
+
+    def __init__(self, backend, ttl=USER_CACHE_TTL, negative_ttl=USER_CACHE_NEGATIVE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+
+    @property
+    def blocking(self):
+        return self.backend.blocking
+
+    def _count(self, value):
+        with self._lock:
+            if value is MISSING:
+                self._misses += 1
+            elif value is None:
+                self._negative_hits += 1
+            else:
+                self._hits += 1
+
+    def _get_id(self, user_id):
+        value = self.backend.get('id:' + user_id)
+        return value if value is MISSING or value is None else _from_cached(value)
+
+    def get_by_id(self, user_id):
+        value = self._get_id(user_id)
+        self._count(value)
+        return value
+
+    def get_by_email(self, email):
+        user_id = self.backend.get('email:' + email)
+        value = user_id if user_id is MISSING or user_id is None else self._get_id(user_id)
+        if isinstance(value, dict) and value['email'].lower() != email.lower():
+            # The index entry outlived an email change; treat it as unknown.
+            value = MISSING
+        self._count(value)
+        return value
+
+    def get_many(self, user_ids):
+        """Looks up several ids; returns ({id: record or None}, [ids not cached])."""
+        records = {}
+        missing = []
+        for user_id in user_ids:
+            value = self.get_by_id(user_id)
+            if value is MISSING:
+                missing.append(user_id)
+            else:
+                records[user_id] = value
+        return records, missing
+
+    def put_many(self, user_ids, found):
+        """Caches a batch lookup of `user_ids`, where `found` maps id -> record."""
+        for user_id in user_ids:
+            self.put_id(user_id, found.get(user_id))
+
+    def put_id(self, user_id, record):
+        """Caches `record` (or a miss when None) under its id and email."""
+        if record is None:
+            self.backend.set('id:' + user_id, None, self.negative_ttl)
+            return
+        self.backend.set('id:' + user_id, _to_cached(record), self.ttl)
+        self.backend.set('email:' + record['email'], user_id, self.ttl)
+
+    def put_email(self, email, record):
+        """Caches the result of a lookup by `email`."""
+        if record is None:
+            self.backend.set('email:' + email, None, self.negative_ttl)
+            return
+        self.put_id(record['id'], record)
+        if record['email'] != email:
+            # Found under a different case; remember this spelling too.
+            self.backend.set('email:' + email, record['id'], self.ttl)
+
+    def invalidate(self, user_id=None, emails=()):
+        keys = ['email:' + email for email in emails if email]
+        if user_id:
+            keys.append('id:' + user_id)
+        self.backend.delete(*keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._negative_hits + self._misses
+            stats = {
+                'backend': type(self.backend).__name__,
+                'hits': self._hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses,
+                'hit_ratio': (self._hits + self._negative_hits) / lookups if lookups else 0.0,
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def make_backend(kind=USER_CACHE_BACKEND):
+    if kind == 'local':
+        return LRUCache()
+    if kind == 'redis':
+        return RedisCache()
+    if kind == 'none':
+        return NullCache()
+    raise ValueError(f"Unknown user cache backend '{kind}'.")
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """Returns the process-wide user cache, creating it on first use."""
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(make_backend())
+    return _user_cache
@@ -1,27 +1,732 @@
+import base64
+import json
+import logging
 import sqlite3
+import threading
+import time
+import uuid
 
-def init_db():
-    """Initializes the database and creates the users table if it doesn't exist."""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
+from .ids import user_id_bytes, user_id_str
+from .migrations import build_indexes_sqlite, migrate_sqlite, optimize_sqlite
+from .pool import ConnectionPool
+from .repository import (
+    MAX_SEARCH_RESULTS, MIN_SUBSTRING_QUERY, UPDATABLE_COLUMNS, USER_CREATED, USER_UPDATED,
+    DuplicateUser, RefreshTokenReused, UserRepository, VersionConflict,
+)
 
-    # SQL command to create a table named 'users'
-    # The "IF NOT EXISTS" clause prevents an error if the table already exists.
-    create_table_query = """
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        username TEXT NOT NULL UNIQUE,
-        email TEXT NOT NULL UNIQUE,
-        hashed_password TEXT NOT NULL
-    );
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = "id, username, email, hashed_password, version"
+USER_EVENT_COLUMNS = "sequence, event_type, user_id, username, email, version, occurred_at"
+# UPDATE ... RETURNING (update_user, rotate_refresh_token) needs 3.35; the
+# users_search index (migration 0004) needs FTS5's trigram tokenizer, in 3.34.
+MIN_SQLITE_VERSION = (3, 35, 0)
+# Users indexed per transaction by backfill_search_index().
+SEARCH_BACKFILL_BATCH_SIZE = 5000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def init_db(pool=None):
+    """Brings the SQLite schema up to date by applying any pending migrations."""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} is too old: profile updates and token refreshes need "
+            f"UPDATE ... RETURNING and the search index the FTS5 trigram tokenizer, in SQLite "
+            f"{'.'.join(map(str, MIN_SQLITE_VERSION))} or newer."
+        )
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        version = migrate_sqlite(conn)
+    logger.info("Database initialized at schema version %d.", version)
+
+
+# --- SQLite queries behind SQLiteUserRepository ---
+
+def append_user_events(conn, events):
+    """Adds (event_type, key, username, email, version) events to the outbox, without committing.
+
+    `key` is users.id in either layout; the outbox always holds the string id.
+    """
+    occurred_at = int(time.time() * 1000)
+    conn.executemany(
+        "INSERT INTO user_events (event_type, user_id, username, email, version, occurred_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(event_type, user_id_str(key) if isinstance(key, bytes) else key, username, email,
+          version, occurred_at)
+         for event_type, key, username, email, version in events]
+    )
+
+
+def insert_user(conn, user_id, username, email, hashed_password):
+    """Inserts a new user. Raises sqlite3.IntegrityError on a duplicate username or email."""
+    conn.execute(
+        "INSERT INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, ?)",
+        (user_id, username, email, hashed_password)
+    )
+    append_user_events(conn, [(USER_CREATED, user_id, username, email, 1)])
+    conn.commit()
+
+
+def get_user_by_email(conn, email, covering=False):
+    # The planner prefers the unique email index, which still needs a second
+    # lookup in the table, so a covering index has to be asked for by name.
+    indexed_by = " INDEXED BY users_email_covering" if covering else ""
+    user = conn.execute(
+        f"SELECT {USER_COLUMNS} FROM users{indexed_by} WHERE email = ?", (email,)
+    ).fetchone()
+    if user is not None:
+        return user
+    # A differently-cased address; uses the users_email_lower index. Two
+    # accounts that differ only in case make it ambiguous, so match neither.
+    users = conn.execute(
+        f"SELECT {USER_COLUMNS} FROM users WHERE lower(email) = lower(?) LIMIT 2", (email,)
+    ).fetchall()
+    return users[0] if len(users) == 1 else None
+
+
+def get_user_by_id(conn, user_id):
+    # The full row, so one cached record serves lookups by id and by email.
+    return conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone()
+
+
+def update_user(conn, user_id, changes, expected_version=None):
+    """Writes `changes` to one user in a single UPDATE and increments its version.
+
+    Returns the updated row, or None if no row matched: either there is no
+    such user or its version isn't `expected_version`. Raises
+    sqlite3.IntegrityError on a duplicate username or email.
+    """
+    assignments = ''.join(f"{column} = ?, " for column in changes)
+    sql = f"UPDATE users SET {assignments}version = version + 1 WHERE id = ?"
+    params = [*changes.values(), user_id]
+    if expected_version is not None:
+        sql += " AND version = ?"
+        params.append(expected_version)
+    # fetchall() finishes the statement, which has to happen before the commit.
+    rows = conn.execute(f"{sql} RETURNING {USER_COLUMNS}", params).fetchall()
+    if rows:
+        row = rows[0]
+        append_user_events(conn, [(USER_UPDATED, row['id'], row['username'], row['email'],
+                                   row['version'])])
+    conn.commit()
+    return rows[0] if rows else None
+
+
+def replace_password_hash(conn, user_id, old_hash, new_hash):
+    cursor = conn.execute(
+        "UPDATE users SET hashed_password = ? WHERE id = ? AND hashed_password = ?",
+        (new_hash, user_id, old_hash)
+    )
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def user_exists(conn, user_id):
+    return conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is not None
+
+
+def get_users_by_ids(conn, user_ids, chunk_size=500):
+    """Returns {id: row} for the users in `user_ids` that exist.
+
+    Ids are looked up in chunks so the IN list stays well under SQLite's
+    bound-parameter limit.
+    """
+    found = {}
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        rows = conn.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        for row in rows:
+            found[row['id']] = row
+    return found
+
+
+def find_taken(conn, usernames, emails, chunk_size=500):
+    """Returns (usernames, emails) from the given lists that already belong to a user.
+
+    Each list is looked up in chunks, as in get_users_by_ids.
     """
-    cursor.execute(create_table_query)
-    print("Database initialized and 'users' table created successfully.")
+    taken = {'username': set(), 'email': set()}
+    for column, values in (('username', list(usernames)), ('email', list(emails))):
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            rows = conn.execute(
+                f"SELECT {column} FROM users WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            taken[column].update(row[0] for row in rows)
+    return taken['username'], taken['email']
 
+
+def insert_users(conn, rows, chunk_size=500):
+    """Inserts (id, username, email, hashed_password) rows in one transaction.
+
+    Rows that clash with an existing username or email are skipped rather
+    than failing the batch; returns the set of ids that were inserted.
+    """
+    if not rows:
+        return set()
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, ?)",
+        rows
+    )
+    ids = [row[0] for row in rows]
+    inserted = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        inserted.update(row['id'] for row in conn.execute(
+            f"SELECT id FROM users WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    append_user_events(conn, [(USER_CREATED, user_id, username, email, 1)
+                              for user_id, username, email, _ in rows if user_id in inserted])
+    conn.commit()
+    return inserted
+
+
+def list_users(conn, after=None, limit=50):
+    """Returns up to `limit` users ordered by (username, id), starting after `after`.
+
+    `after` is the (username, id) of the last user already seen. This is a
+    keyset query on the username index, so every page costs the same no
+    matter how deep into the table it is.
+    """
+    if after is None:
+        return conn.execute(
+            "SELECT id, username, email FROM users ORDER BY username, id LIMIT ?", (limit,)
+        ).fetchall()
+    return conn.execute(
+        "SELECT id, username, email FROM users WHERE (username, id) > (?, ?) "
+        "ORDER BY username, id LIMIT ?",
+        (after[0], after[1], limit)
+    ).fetchall()
+
+
+def count_users(conn):
+    return conn.execute("SELECT count(*) FROM users").fetchone()[0]
+
+
+# Exact matches, then username prefixes, then email prefixes, then the rest.
+SEARCH_TIER = (
+    "CASE WHEN lower(u.username) = lower(:query) OR lower(u.email) = lower(:query) THEN 0 "
+    "WHEN substr(lower(u.username), 1, length(:query)) = lower(:query) THEN 1 "
+    "WHEN substr(lower(u.email), 1, length(:query)) = lower(:query) THEN 2 ELSE 3 END"
+)
+
+
+def search_users(conn, query, limit, offset=0, indexed=True):
+    """See UserRepository.search_users.
+
+    Substring queries go through the users_search trigram index: it
+    picks the MAX_SEARCH_RESULTS best by bm25 (a username hit counts
+    double), which are then ordered by tier. Until `indexed`, when the
+    backfill has finished, they scan the table with LIKE instead. Short
+    queries are two prefix range scans of the lower(username) and
+    lower(email) indexes, ordered by tier as on PostgreSQL.
+    """
+    if len(query) < MIN_SUBSTRING_QUERY:
+        # lower() on both sides, so the ranges match the expression indexes.
+        return conn.execute(
+            "SELECT u.id, u.username, u.email FROM ("
+            " SELECT id, username, email FROM users"
+            " WHERE lower(username) >= lower(:query) AND lower(username) < lower(:query) || :end"
+            " UNION"
+            " SELECT id, username, email FROM users"
+            " WHERE lower(email) >= lower(:query) AND lower(email) < lower(:query) || :end"
+            " ORDER BY username, id LIMIT :candidates"
+            f") AS u ORDER BY {SEARCH_TIER}, length(u.username), u.username, u.id "
+            "LIMIT :limit OFFSET :offset",
+            {'query': query, 'end': '\U0010ffff', 'candidates': MAX_SEARCH_RESULTS,
+             'limit': limit, 'offset': offset}
+        ).fetchall()
+    if not indexed:
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return conn.execute(
+            "SELECT u.id, u.username, u.email FROM users AS u "
+            "WHERE u.username LIKE :pattern ESCAPE '\\' OR u.email LIKE :pattern ESCAPE '\\' "
+            f"ORDER BY {SEARCH_TIER}, instr(lower(u.username), lower(:query)) = 0, "
+            "length(u.username), u.username, u.id LIMIT :limit OFFSET :offset",
+            {'query': query, 'pattern': f'%{escaped}%', 'limit': limit, 'offset': offset}
+        ).fetchall()
+    return conn.execute(
+        "SELECT u.id, u.username, u.email FROM ("
+        " SELECT rowid, bm25(users_search, 2.0, 1.0) AS score FROM users_search"
+        " WHERE users_search MATCH :phrase ORDER BY score LIMIT :candidates"
+        ") AS hits "
+        "JOIN users_search_docs AS d ON d.docid = hits.rowid "
+        "JOIN users AS u ON u.id = d.user_id "
+        f"ORDER BY {SEARCH_TIER}, hits.score, u.username, u.id LIMIT :limit OFFSET :offset",
+        {'query': query, 'phrase': '"' + query.replace('"', '""') + '"',
+         'candidates': MAX_SEARCH_RESULTS, 'limit': limit, 'offset': offset}
+    ).fetchall()
+
+
+def list_user_events(conn, after, limit):
+    return conn.execute(
+        f"SELECT {USER_EVENT_COLUMNS} FROM user_events WHERE sequence > ? ORDER BY sequence LIMIT ?",
+        (after, limit)
+    ).fetchall()
+
+
+def get_user_event_range(conn):
+    row = conn.execute("SELECT min(sequence), max(sequence) FROM user_events").fetchone()
+    return row[0], row[1]
+
+
+def purge_user_events(conn, before):
+    purged = conn.execute(
+        "DELETE FROM user_events WHERE occurred_at < ? "
+        "AND sequence < (SELECT max(sequence) FROM user_events)",
+        (before,)
+    ).rowcount
+    conn.commit()
+    return purged
+
+
+def insert_refresh_token(conn, token_hash, user_id, family_id, expires_at):
+    conn.execute(
+        "INSERT INTO refresh_tokens (token_hash, user_id, family_id, expires_at) VALUES (?, ?, ?, ?)",
+        (token_hash, user_id, family_id, expires_at)
+    )
+    conn.commit()
+
+
+def rotate_refresh_token(conn, old_hash, new_hash, now, expires_at, reuse_interval):
+    """See UserRepository.rotate_refresh_token. Raises RefreshTokenReused."""
+    # The UPDATE takes the write lock first, so two exchanges of one token
+    # are serialised and only one of them finds it unused.
+    rows = conn.execute(
+        "UPDATE refresh_tokens SET used_at = ? "
+        "WHERE token_hash = ? AND used_at IS NULL AND expires_at > ? "
+        "RETURNING user_id, family_id",
+        (now, old_hash, now)
+    ).fetchall()
+    if rows:
+        user_id, family_id = rows[0]
+    else:
+        row = conn.execute(
+            "SELECT user_id, family_id, expires_at, used_at FROM refresh_tokens WHERE token_hash = ?",
+            (old_hash,)
+        ).fetchone()
+        if row is None or row['expires_at'] <= now:
+            conn.commit()
+            return None
+        if now - row['used_at'] > reuse_interval:
+            conn.execute("DELETE FROM refresh_tokens WHERE family_id = ?", (row['family_id'],))
+            conn.commit()
+            raise RefreshTokenReused(f"Refresh token family {row['family_id']} was replayed.")
+        user_id, family_id = row['user_id'], row['family_id']
+    conn.execute(
+        "INSERT INTO refresh_tokens (token_hash, user_id, family_id, expires_at) VALUES (?, ?, ?, ?)",
+        (new_hash, user_id, family_id, expires_at)
+    )
     conn.commit()
-    conn.close()
+    return user_id
+
+
+def delete_refresh_token_family(conn, token_hash):
+    conn.execute(
+        "DELETE FROM refresh_tokens WHERE family_id = "
+        "(SELECT family_id FROM refresh_tokens WHERE token_hash = ?)",
+        (token_hash,)
+    )
+    conn.commit()
+
+
+def revoke_access_token(conn, jti, expires_at):
+    conn.execute("INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+                 (jti, expires_at))
+    conn.commit()
+
+
+def list_revoked_tokens(conn, now):
+    return conn.execute(
+        "SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > ?", (now,)
+    ).fetchall()
+
+
+def purge_expired_tokens(conn, now):
+    purged = conn.execute("DELETE FROM refresh_tokens WHERE expires_at <= ?", (now,)).rowcount
+    purged += conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,)).rowcount
+    conn.commit()
+    return purged
+
+
+# --- Compact id layout ---
+
+# Logins read id, username and hashed_password by email. SQLite has no
+# INCLUDE, so the columns go in the key; the primary key (id) is appended to
+# every index of a WITHOUT ROWID table anyway. It copies every password
+# hash, so it costs about as much space as the table itself.
+EMAIL_COVERING_INDEX = (
+    "CREATE INDEX IF NOT EXISTS users_email_covering "
+    "ON users (email, username, hashed_password, version)"
+)
+
+
+def has_email_covering_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'users_email_covering'"
+    ).fetchone() is not None
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search_docs'"
+    ).fetchone() is not None
+
+
+def has_search_backfill(conn):
+    """True while users from before the users_search migration are still being indexed."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search_backfill'"
+    ).fetchone() is not None
+
+
+def backfill_search_index(conn, batch_size=SEARCH_BACKFILL_BATCH_SIZE):
+    """Adds the users that predate migration 0004 to users_search, a batch per transaction.
+
+    Users written since are indexed by the triggers and skipped here. The
+    cursor is saved with each batch, so an interrupted backfill carries on
+    where it stopped; the cursor table is dropped at the end. Returns how
+    many users were indexed.
+    """
+    indexed = 0
+    while has_search_backfill(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last_id = conn.execute("SELECT last_id FROM users_search_backfill").fetchone()[0]
+            if last_id is None:
+                batch = conn.execute("SELECT id FROM users ORDER BY id LIMIT ?", (batch_size,)).fetchall()
+            else:
+                batch = conn.execute("SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                                     (last_id, batch_size)).fetchall()
+            if not batch:
+                conn.execute("DROP TABLE users_search_backfill")
+            else:
+                # New docids are above the current maximum, so they pick out this batch.
+                max_docid = conn.execute("SELECT coalesce(max(docid), 0) FROM users_search_docs").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO users_search_docs (user_id) SELECT id FROM users "
+                    "WHERE id >= ? AND id <= ? AND id NOT IN (SELECT user_id FROM users_search_docs)",
+                    (batch[0]['id'], batch[-1]['id'])
+                )
+                indexed += conn.execute(
+                    "INSERT INTO users_search (rowid, username, email) "
+                    "SELECT d.docid, u.username, u.email FROM users_search_docs AS d "
+                    "JOIN users AS u ON u.id = d.user_id WHERE d.docid > ?",
+                    (max_docid,)
+                ).rowcount
+                conn.execute("UPDATE users_search_backfill SET last_id = ?", (batch[-1]['id'],))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return indexed
+
+
+def has_compact_ids(conn):
+    """True if `users` keys users by 16-byte ids (see compact_user_ids)."""
+    for column in conn.execute("PRAGMA table_info(users)"):
+        if column['name'] == 'id':
+            return column['type'].upper() == 'BLOB'
+    return False
+
+
+def compact_user_ids(conn, covering_index=True):
+    """Rebuilds `users` as a WITHOUT ROWID table keyed by 16-byte UUIDs.
+
+    The default layout stores each id as 36 characters of text in the
+    table and again in its primary key index, next to a hidden rowid. The
+    compact layout keeps the rows in the primary key b-tree itself and, with
+    `covering_index`, adds users_email_covering. Other columns, constraints,
+    indexes and triggers are carried over, and the search index's ids are
+    converted too. This copies the whole table, so
+    stop the servers first. Returns False if the table was already compact.
+    """
+    if has_compact_ids(conn):
+        return False
+    columns = conn.execute("PRAGMA table_info(users)").fetchall()
+    definitions = []
+    for column in columns:
+        if column['name'] == 'id':
+            definitions.append("id BLOB PRIMARY KEY")
+            continue
+        definition = f"{column['name']} {column['type']}"
+        if column['notnull']:
+            definition += " NOT NULL"
+        if column['dflt_value'] is not None:
+            definition += f" DEFAULT {column['dflt_value']}"
+        definitions.append(definition)
+    for index in conn.execute("PRAGMA index_list(users)").fetchall():
+        if index['origin'] == 'u':
+            names = [row['name'] for row in conn.execute(f"PRAGMA index_info({index['name']})")]
+            definitions.append(f"UNIQUE ({', '.join(names)})")
+    schema = conn.execute(
+        "SELECT sql FROM sqlite_master "
+        "WHERE tbl_name = 'users' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ).fetchall()
+    names = ', '.join(column['name'] for column in columns)
+    values = ', '.join('uuid_bytes(id)' if column['name'] == 'id' else column['name']
+                       for column in columns)
+
+    # Strict, unlike user_id_bytes: an id that isn't a UUID aborts the copy.
+    conn.create_function('uuid_bytes', 1, lambda text: uuid.UUID(text).bytes, deterministic=True)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"CREATE TABLE users_compact ({', '.join(definitions)}) WITHOUT ROWID")
+        # Text UUIDs sort like their bytes, so the new b-tree is filled in order.
+        conn.execute(f"INSERT INTO users_compact ({names}) SELECT {values} FROM users ORDER BY id")
+        conn.execute("DROP TABLE users")
+        conn.execute("ALTER TABLE users_compact RENAME TO users")
+        for row in schema:
+            conn.execute(row['sql'])
+        if has_search_index(conn):
+            conn.execute("UPDATE users_search_docs SET user_id = uuid_bytes(user_id)")
+        if has_search_backfill(conn):
+            # Its cursor was a text id; the skip of indexed users makes a restart safe.
+            conn.execute("UPDATE users_search_backfill SET last_id = NULL")
+        if covering_index:
+            conn.execute(EMAIL_COVERING_INDEX)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    # Hand the old table's pages back to the filesystem.
+    conn.execute("VACUUM")
+    conn.execute("ANALYZE")
+    conn.commit()
+    return True
+
+
+def encode_page_token(user_record):
+    """Builds the opaque cursor pointing just past `user_record`."""
+    raw = json.dumps([user_record['username'], user_record['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def encode_search_token(query, offset):
+    """Builds the opaque cursor for the search results of `query` from `offset` on."""
+    raw = json.dumps([query, offset]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_search_token(page_token, query):
+    """Returns the offset `page_token` points at, 0 if it is empty.
+
+    Raises ValueError for a token this server did not issue for `query`.
+    """
+    if not page_token:
+        return 0
+    try:
+        token_query, offset = json.loads(base64.urlsafe_b64decode(page_token.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid page token.")
+    if token_query != query or not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid page token.")
+    return offset
+
+
+def decode_page_token(page_token):
+    """Returns the (username, id) keyset for `page_token`, or None if it is empty.
+
+    Raises ValueError for a token this server did not issue.
+    """
+    if not page_token:
+        return None
+    try:
+        username, user_id = json.loads(base64.urlsafe_b64decode(page_token.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid page token.")
+    if not isinstance(username, str) or not isinstance(user_id, str):
+        raise ValueError("Invalid page token.")
+    return username, user_id
+
+
+class SQLiteUserRepository(UserRepository):
+    """UserRepository on a pooled SQLite file; the default for a single server.
+
+    Ids are strings to callers whatever the layout; in the compact layout
+    they are converted to and from 16 bytes here.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool()
+        self.size = self.pool.size
+        self._check_layout()
+
+    def _check_layout(self):
+        with self.pool.connection() as conn:
+            self.compact_ids = has_compact_ids(conn)
+            self.email_covering = has_email_covering_index(conn)
+            # Only ever goes from False to True, whichever process ran the backfill.
+            self.search_indexed = not has_search_backfill(conn)
+
+    def _key(self, user_id):
+        return user_id_bytes(user_id) if self.compact_ids else user_id
+
+    def _record(self, row):
+        if row is None or not self.compact_ids:
+            return row
+        user = dict(row)
+        user['id'] = user_id_str(user['id'])
+        return user
+
+    def migrate(self):
+        init_db(self.pool)
+        self._check_layout()
+
+    def compact(self, covering_index=True):
+        """Converts the table to the compact layout; see compact_user_ids."""
+        with self.pool.connection() as conn:
+            converted = compact_user_ids(conn, covering_index)
+        self._check_layout()
+        return converted
+
+    def build_indexes(self):
+        with self.pool.connection() as conn:
+            build_indexes_sqlite(conn)
+            if has_search_backfill(conn):
+                indexed = backfill_search_index(conn)
+                logger.info("Search index backfilled with %d users.", indexed)
+            self.search_indexed = True
+
+    def optimize(self):
+        with self.pool.connection() as conn:
+            optimize_sqlite(conn)
+
+    def insert_user(self, user_id, username, email, hashed_password):
+        try:
+            with self.pool.connection() as conn:
+                insert_user(conn, self._key(user_id), username, email, hashed_password)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateUser(str(e)) from e
+
+    def get_user_by_email(self, email):
+        with self.pool.connection() as conn:
+            return self._record(get_user_by_email(conn, email, self.email_covering))
+
+    def get_user_by_id(self, user_id):
+        with self.pool.connection() as conn:
+            return self._record(get_user_by_id(conn, self._key(user_id)))
+
+    def update_user(self, user_id, changes, expected_version=None):
+        if not changes or set(changes) - set(UPDATABLE_COLUMNS):
+            raise ValueError(f"Can only update {', '.join(UPDATABLE_COLUMNS)}.")
+        key = self._key(user_id)
+        try:
+            with self.pool.connection() as conn:
+                row = update_user(conn, key, changes, expected_version)
+                if row is None and expected_version is not None and user_exists(conn, key):
+                    raise VersionConflict(f"User {user_id} is no longer at version {expected_version}.")
+        except sqlite3.IntegrityError as e:
+            raise DuplicateUser(str(e)) from e
+        return self._record(row)
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        with self.pool.connection() as conn:
+            return replace_password_hash(conn, self._key(user_id), old_hash, new_hash)
+
+    def get_users_by_ids(self, user_ids):
+        if not self.compact_ids:
+            with self.pool.connection() as conn:
+                return get_users_by_ids(conn, user_ids)
+        keys = {user_id_bytes(user_id): user_id for user_id in user_ids}
+        with self.pool.connection() as conn:
+            found = get_users_by_ids(conn, list(keys))
+        return {keys[key]: self._record(row) for key, row in found.items()}
+
+    def find_taken(self, usernames, emails):
+        with self.pool.connection() as conn:
+            return find_taken(conn, usernames, emails)
+
+    def insert_users(self, rows):
+        if not self.compact_ids:
+            with self.pool.connection() as conn:
+                return insert_users(conn, rows)
+        rows = [(user_id_bytes(user_id), *rest) for user_id, *rest in rows]
+        with self.pool.connection() as conn:
+            return {user_id_str(key) for key in insert_users(conn, rows)}
+
+    def list_users(self, after=None, limit=50):
+        if after is not None:
+            after = (after[0], self._key(after[1]))
+        with self.pool.connection() as conn:
+            rows = list_users(conn, after, limit)
+        return [self._record(row) for row in rows] if self.compact_ids else rows
+
+    def count_users(self):
+        with self.pool.connection() as conn:
+            return count_users(conn)
+
+    def search_users(self, query, limit, offset=0):
+        with self.pool.connection() as conn:
+            if not self.search_indexed:
+                self.search_indexed = not has_search_backfill(conn)
+            rows = search_users(conn, query, limit, offset, self.search_indexed)
+        return [self._record(row) for row in rows] if self.compact_ids else rows
+
+    # Events and tokens keep the string user id whatever the users layout.
+
+    def list_user_events(self, after, limit):
+        with self.pool.connection() as conn:
+            return list_user_events(conn, after, limit)
+
+    def get_user_event_range(self):
+        with self.pool.connection() as conn:
+            return get_user_event_range(conn)
+
+    def purge_user_events(self, before):
+        with self.pool.connection() as conn:
+            return purge_user_events(conn, before)
+
+    def insert_refresh_token(self, token_hash, user_id, family_id, expires_at):
+        with self.pool.connection() as conn:
+            insert_refresh_token(conn, token_hash, user_id, family_id, expires_at)
+
+    def rotate_refresh_token(self, old_hash, new_hash, now, expires_at, reuse_interval):
+        with self.pool.connection() as conn:
+            return rotate_refresh_token(conn, old_hash, new_hash, now, expires_at, reuse_interval)
+
+    def delete_refresh_token_family(self, token_hash):
+        with self.pool.connection() as conn:
+            delete_refresh_token_family(conn, token_hash)
+
+    def revoke_access_token(self, jti, expires_at):
+        with self.pool.connection() as conn:
+            revoke_access_token(conn, jti, expires_at)
+
+    def list_revoked_tokens(self, now):
+        with self.pool.connection() as conn:
+            return list_revoked_tokens(conn, now)
+
+    def purge_expired_tokens(self, now):
+        with self.pool.connection() as conn:
+            return purge_expired_tokens(conn, now)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        super().close()
+        # SQLite suggests a last PRAGMA optimize before closing.
+        self.optimize()
+        self.pool.close()
 
 if __name__ == '__main__':
-    # This allows us to run `python backend/database.py` from the terminal
+    # This allows us to run `python -m backend.database` from the terminal
     # to initialize the database manually.
-    init_db()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    init_db()
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds events stay in the outbox for consumers to resume from. A consumer
+# that falls further behind gets OUT_OF_RANGE and has to resynchronise.
+USER_EVENT_RETENTION = float(os.getenv('USER_EVENT_RETENTION', str(7 * 24 * 3600)))
+# Seconds between reads of the outbox while a watcher is caught up.
+USER_EVENT_POLL_INTERVAL = float(os.getenv('USER_EVENT_POLL_INTERVAL', '0.5'))
+# WatchUserEvents streams open at once in one process. Each one holds a
+# worker thread of the sync server for as long as it stays open.
+MAX_EVENT_WATCHERS = int(os.getenv('MAX_EVENT_WATCHERS', '4'))
+# Seconds between reads of the outbox for users that other processes changed,
+# to drop them from this process's local user cache; 0 disables it.
+USER_CACHE_SYNC_INTERVAL = float(os.getenv('USER_CACHE_SYNC_INTERVAL', '1'))
+
+# Seconds between deletions of events older than USER_EVENT_RETENTION.
+USER_EVENT_PURGE_INTERVAL = 3600
+# Events read per query by UserCacheSync.
+CACHE_SYNC_BATCH_SIZE = 500
+
+
+class CursorOutOfRange(Exception):
+    """Raised when a watcher's cursor is not in the outbox any more, or never was."""
+
+
+class EventFeed:
+    """Bookkeeping for WatchUserEvents streams over the user_events outbox.
+
+    The streams themselves read the outbox in batches from their own
+    cursor (see UserServiceServicer.WatchUserEvents); this caps how many
+    are open, ends them when the server drains, and deletes old events
+    from a background thread.
+    """
+
+    def __init__(self, users, retention=USER_EVENT_RETENTION, poll_interval=USER_EVENT_POLL_INTERVAL,
+                 max_watchers=MAX_EVENT_WATCHERS):
+        self.users = users
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.max_watchers = max_watchers
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._watchers = 0
+        self._refused = 0
+        self._sent = 0
+        self._purged = 0
+
+    def start(self):
+        """Deletes expired events now and then every USER_EVENT_PURGE_INTERVAL seconds."""
+        self._thread = threading.Thread(target=self._run, name='user-events', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                purged = self.users.purge_user_events(int((time.time() - self.retention) * 1000))
+                with self._lock:
+                    self._purged += purged
+            except Exception:
+                logger.exception("Purging old user events failed.")
+            self._stopping.wait(USER_EVENT_PURGE_INTERVAL)
+
+    def stop(self):
+        """Stops the purge thread and tells open streams to end, so a drain isn't held up."""
+        self._stopping.set()
+
+    @property
+    def stopping(self):
+        return self._stopping.is_set()
+
+    def wait(self):
+        """Sleeps for one poll interval; returns True if the feed is stopping."""
+        return self._stopping.wait(self.poll_interval)
+
+    def acquire(self):
+        """Takes a watcher slot; returns False if all MAX_EVENT_WATCHERS are in use."""
+        with self._lock:
+            if self._watchers >= self.max_watchers:
+                self._refused += 1
+                return False
+            self._watchers += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._watchers -= 1
+
+    def sent(self, count):
+        with self._lock:
+            self._sent += count
+
+    def start_after(self, after_sequence, from_latest, event_range):
+        """Returns the sequence a new stream reads on from.
+
+        `event_range` is the repository's get_user_event_range(), read by
+        the caller so the async server can read it off the event loop.
+        0 starts at the oldest event kept. Raises CursorOutOfRange if events
+        after `after_sequence` were purged, or if it is past the last event
+        (a different or restored database).
+        """
+        first, last = event_range
+        if from_latest:
+            return last or 0
+        if not after_sequence:
+            return 0
+        if last is None or after_sequence > last:
+            raise CursorOutOfRange(f"Sequence {after_sequence} is past the last event.")
+        if after_sequence < first - 1:
+            raise CursorOutOfRange(
+                f"Events after sequence {after_sequence} were purged; resynchronise and "
+                "watch from_latest."
+            )
+        return after_sequence
+
+    def stats(self):
+        with self._lock:
+            return {
+                'watchers': self._watchers,
+                'watchers_refused': self._refused,
+                'events_sent': self._sent,
+                'events_purged': self._purged,
+            }
+
+
+class UserCacheSync:
+    """Drops users that other processes changed from this process's user cache.
+
+    With the in-process cache every pre-fork worker (and every replica)
+    keeps its own copy of a user, and an update only refreshes the copy in
+    the process that made it. This follows the user_events outbox from a
+    background thread and invalidates each user it names, so the others
+    serve an old profile or email for about USER_CACHE_SYNC_INTERVAL
+    instead of USER_CACHE_TTL. Shared (Redis) and disabled caches don't
+    need it.
+    """
+
+    def __init__(self, users, cache, interval=USER_CACHE_SYNC_INTERVAL):
+        self.users = users
+        self.cache = cache
+        self.interval = interval
+        self._after = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._invalidated = 0
+
+    def start(self):
+        """Notes where the outbox ends, then follows it from a background thread."""
+        from .cache import LRUCache
+
+        if self.interval <= 0 or not isinstance(self.cache.backend, LRUCache):
+            return
+        try:
+            self.sync()
+        except Exception:
+            logger.exception("Reading user events for the user cache failed.")
+        self._thread = threading.Thread(target=self._run, name='user-cache-sync', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sync()
+            except Exception:
+                # Entries still expire after USER_CACHE_TTL; the next pass catches up.
+                logger.exception("Reading user events for the user cache failed.")
+
+    def stop(self):
+        self._stopping.set()
+
+    def sync(self):
+        """Invalidates the users named by events since the last call."""
+        if self._after is None:
+            # The cache is empty at startup, so earlier events don't matter.
+            self._after = self.users.get_user_event_range()[1] or 0
+            return
+        while True:
+            rows = self.users.list_user_events(self._after, CACHE_SYNC_BATCH_SIZE)
+            for row in rows:
+                # The new email too, in case it is cached as "not found".
+                self.cache.invalidate(row['user_id'], [row['email']])
+            if rows:
+                self._after = rows[-1]['sequence']
+                with self._lock:
+                    self._invalidated += len(rows)
+            if len(rows) < CACHE_SYNC_BATCH_SIZE:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': int(self._thread is not None), 'invalidated': self._invalidated}
+
+
+_event_feed = None
+_event_feed_lock = threading.Lock()
+_user_cache_sync = None
+_user_cache_sync_lock = threading.Lock()
+
+
+def get_event_feed():
+    """Returns the process-wide EventFeed."""
+    global _event_feed
+    if _event_feed is None:
+        with _event_feed_lock:
+            if _event_feed is None:
+                from .repository import get_repository
+                _event_feed = EventFeed(get_repository())
+    return _event_feed
+
+
+def get_user_cache_sync():
+    """Returns the process-wide UserCacheSync for the shared user cache."""
+    global _user_cache_sync
+    if _user_cache_sync is None:
+        with _user_cache_sync_lock:
+            if _user_cache_sync is None:
+                from .cache import get_user_cache
+                from .repository import get_repository
+                _user_cache_sync = UserCacheSync(get_repository(), get_user_cache())
+    return _user_cache_sync
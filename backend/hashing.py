@@ -0,0 +1,347 @@
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent import futures
+
+import bcrypt
+from dotenv import load_dotenv
+
+from . import metrics
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'process' runs bcrypt in worker processes, 'thread' in a thread pool
+# (bcrypt releases the GIL, but the workers still share this process).
+HASH_EXECUTOR = os.getenv('HASH_EXECUTOR', 'process')
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', str(os.cpu_count() or 1)))
+# Jobs allowed to be running or waiting before new ones are rejected.
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', str(HASH_WORKERS * 4)))
+# Time one bcrypt hash should take. The cost (rounds) is calibrated to it at
+# startup on this machine; each round doubles the work.
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', '250'))
+# A fixed cost skips the calibration.
+BCRYPT_ROUNDS = os.getenv('BCRYPT_ROUNDS')
+# Bounds for the calibrated cost, whatever the hardware.
+BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', '10'))
+BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', '16'))
+# 'login' re-hashes a password at the current cost after a successful login
+# when its stored cost is off-target; 'off' leaves stored hashes alone.
+BCRYPT_REHASH = os.getenv('BCRYPT_REHASH', 'login')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full and a job is rejected."""
+
+
+def _timed(fn, *args):
+    # Runs inside the worker so the measured time excludes queueing.
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password, hashed_password):
+    if isinstance(hashed_password, str):
+        # Stored as text, e.g. by other tools writing to the original TEXT column.
+        hashed_password = hashed_password.encode('ascii')
+    return bcrypt.checkpw(password, hashed_password)
+
+
+def _noop():
+    return None
+
+
+def calibrate_rounds(target_seconds, min_rounds=BCRYPT_MIN_ROUNDS, max_rounds=BCRYPT_MAX_ROUNDS):
+    """Returns (rounds, seconds): the cost closest to `target_seconds` here, and its time.
+
+    Times a cheap cost and extrapolates, then times the chosen cost once.
+    Needs an otherwise idle CPU to be accurate.
+    """
+    probe_rounds = 8
+    probe = min(_timed(_hash_password, b'calibration', probe_rounds)[1] for _ in range(3))
+    rounds = probe_rounds + round(math.log2(target_seconds / probe))
+    rounds = max(min_rounds, min(max_rounds, rounds))
+    return rounds, _timed(_hash_password, b'calibration', rounds)[1]
+
+
+def hash_rounds(hashed_password):
+    """Returns the cost recorded in a bcrypt hash ($2b$<rounds>$...), or None."""
+    try:
+        return int(hashed_password[4:6])
+    except (TypeError, ValueError):
+        return None
+
+
+def _init_worker():
+    # Ctrl+C is handled by the server process, which shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class HashingExecutor:
+    """Runs bcrypt off the gRPC worker threads with bounded admission.
+
+    At most `max_pending` jobs may be queued or running at once; anything
+    beyond that fails immediately with HashingBusy instead of tying up the
+    calling thread, so cheap RPCs keep their workers during login storms.
+    """
+
+    def __init__(self, kind=HASH_EXECUTOR, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 rounds=BCRYPT_ROUNDS, target_ms=BCRYPT_TARGET_MS):
+        if kind not in ('process', 'thread'):
+            raise ValueError(f"Unknown hashing executor '{kind}'.")
+        self.kind = kind
+        # bcrypt's own default until calibrate() has run.
+        self.rounds = int(rounds) if rounds else 12
+        self.calibrated = bool(rounds)
+        self.target_ms = target_ms
+        self._calibrated_seconds = 0.0
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+
+        if kind == 'process':
+            # 'spawn' avoids forking a process that already runs gRPC threads.
+            self._executor = futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        else:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='bcrypt'
+            )
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._hash_seconds = 0.0
+        self._hash_seconds_max = 0.0
+        self._total_seconds = 0.0
+
+    def warm_up(self):
+        """Start every worker now rather than on the first login."""
+        jobs = [self._executor.submit(_noop) for _ in range(self.workers)]
+        futures.wait(jobs)
+
+    def calibrate(self):
+        """Sets the cost to whatever takes closest to `target_ms` on a worker.
+
+        Runs at startup, before there is load to skew the timing; does
+        nothing when the cost was fixed with BCRYPT_ROUNDS.
+        """
+        if self.calibrated:
+            return self.rounds
+        rounds, seconds = self.submit(calibrate_rounds, self.target_ms / 1000, block=True).result()
+        self.rounds = rounds
+        self.calibrated = True
+        self._calibrated_seconds = seconds
+        logger.info("bcrypt cost %d takes %.0f ms here (target %.0f ms).",
+                    rounds, seconds * 1000, self.target_ms)
+        return rounds
+
+    def needs_rehash(self, hashed_password):
+        """Returns whether a stored hash's cost is off-target.
+
+        A cheaper hash is always upgraded. A dearer one only once it's two
+        rounds over (4x the target time), so timing noise that moves the
+        calibration by one round doesn't re-hash everyone at each restart.
+        """
+        rounds = hash_rounds(hashed_password)
+        return rounds is not None and (rounds < self.rounds or rounds > self.rounds + 1)
+
+    def submit(self, fn, *args, block=False):
+        """Queue `fn(*args)` and return a future resolving to its result.
+
+        With block=True, wait for a free slot instead of raising HashingBusy.
+        """
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy("Too many password operations in progress. Try again later.")
+
+        submitted_at = time.perf_counter()
+        # Callbacks run on the executor's thread, so capture the RPC's spans here.
+        spans = metrics.current_spans()
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+        try:
+            inner = self._executor.submit(_timed, fn, *args)
+        except BaseException:
+            self._finish(None, submitted_at)
+            raise
+
+        outer = futures.Future()
+
+        def _done(job):
+            hash_seconds = None
+            # Recorded before the waiter wakes up, so the RPC sees its own time.
+            metrics.add_span(spans, 'bcrypt', time.perf_counter() - submitted_at)
+            try:
+                result, hash_seconds = job.result()
+            except BaseException as e:
+                outer.set_exception(e)
+            else:
+                outer.set_result(result)
+            finally:
+                self._finish(hash_seconds, submitted_at)
+
+        inner.add_done_callback(_done)
+        return outer
+
+    def _finish(self, hash_seconds, submitted_at):
+        total = time.perf_counter() - submitted_at
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            self._total_seconds += total
+            if hash_seconds is not None:
+                self._hash_seconds += hash_seconds
+                if hash_seconds > self._hash_seconds_max:
+                    self._hash_seconds_max = hash_seconds
+        self._slots.release()
+
+    def submit_hash(self, password):
+        """Queue a hash of `password` (bytes) and return its future."""
+        return self.submit(_hash_password, password, self.rounds)
+
+    def submit_check(self, password, hashed_password):
+        """Queue a check of `password` (bytes) against `hashed_password`."""
+        return self.submit(_check_password, password, hashed_password)
+
+    def hash_password(self, password):
+        """Hash `password` (bytes) with a fresh salt, blocking until done."""
+        return self.submit_hash(password).result()
+
+    def hash_many(self, passwords):
+        """Hash a batch of passwords in parallel and return the hashes in order.
+
+        At most `workers` jobs from the batch are in flight at once, so bulk
+        work waits its turn rather than filling the queue that interactive
+        logins depend on.
+        """
+        window = []
+        hashes = []
+        for password in passwords:
+            if len(window) >= self.workers:
+                hashes.append(window.pop(0).result())
+            window.append(self.submit(_hash_password, password, self.rounds, block=True))
+        hashes.extend(job.result() for job in window)
+        return hashes
+
+    def check_password(self, password, hashed_password):
+        """Return True if `password` (bytes) matches `hashed_password`."""
+        return self.submit_check(password, hashed_password).result()
+
+    def stats(self):
+        """Return a snapshot of queue depth and latency counters for monitoring."""
+        with self._lock:
+            return {
+                'executor': self.kind,
+                'rounds': self.rounds,
+                'calibrated_ms': self._calibrated_seconds * 1000,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'hash_seconds_total': self._hash_seconds,
+                'hash_seconds_max': self._hash_seconds_max,
+                'total_seconds_total': self._total_seconds,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class Rehasher:
+    """Re-hashes passwords at the current cost after a successful login.
+
+    The login has already answered by the time the new hash is computed,
+    and the job is dropped if the hashing queue is full (HashingBusy), to
+    be retried at the next login, rather than queue behind a login storm.
+    The new hash is written only if the stored one is unchanged; the
+    user's cache entries are then dropped rather than refilled from the
+    login's copy, which a concurrent profile update may have outdated.
+    """
+
+    def __init__(self, hasher, users, cache, mode=BCRYPT_REHASH):
+        self.hasher = hasher
+        self.users = users
+        self.cache = cache
+        self.enabled = mode == 'login'
+        # One job per user at a time, and never more than the hashing queue holds.
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+        self._rehashed = 0
+        self._skipped = 0
+
+    def after_login(self, user_record, password):
+        """Queues a re-hash of `password` (bytes) if the user's stored cost is off-target."""
+        if not self.enabled or not self.hasher.needs_rehash(user_record['hashed_password']):
+            return
+        user_id = user_record['id']
+        with self._lock:
+            if user_id in self._in_flight or len(self._in_flight) >= self.hasher.max_pending:
+                self._skipped += 1
+                return
+            self._in_flight.add(user_id)
+        self._executor.submit(self._rehash, dict(user_record), password)
+
+    def _rehash(self, user_record, password):
+        user_id = user_record['id']
+        try:
+            new_hash = self.hasher.submit_hash(password).result()
+            if self.users.replace_password_hash(user_id, user_record['hashed_password'], new_hash):
+                self.cache.invalidate(user_id, [user_record['email']])
+                with self._lock:
+                    self._rehashed += 1
+                logger.debug("Re-hashed the password of user %s at cost %d.",
+                             user_id, self.hasher.rounds)
+        except HashingBusy:
+            with self._lock:
+                self._skipped += 1
+        except Exception:
+            logger.exception("Re-hashing the password of user %s failed.", user_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._in_flight),
+                'rehashed': self._rehashed,
+                'skipped': self._skipped,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """Returns the process-wide hashing executor, creating it on first use."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = HashingExecutor()
+    return _hasher
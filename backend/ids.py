@@ -0,0 +1,46 @@
+import os
+import time
+import uuid
+
+
+def uuid7():
+    """Returns a time-ordered UUID (RFC 9562 version 7).
+
+    The first 48 bits are the Unix time in milliseconds and the rest is
+    random, so ids minted one after the other sort next to each other and
+    new rows land at the right-hand edge of the primary key index.
+    """
+    millis = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = ((millis & (1 << 48) - 1) << 80
+             | 0x7 << 76                       # version
+             | (rand >> 62 & 0xfff) << 64      # rand_a
+             | 0b10 << 62                      # variant
+             | rand & (1 << 62) - 1)           # rand_b
+    return uuid.UUID(int=value)
+
+
+def new_user_id():
+    """Returns the id for a new user, as the canonical UUID string."""
+    return str(uuid7())
+
+
+def user_id_bytes(user_id):
+    """Returns the 16-byte form of a canonical UUID string.
+
+    Anything else is returned unchanged: it can't be the key of any user,
+    so a lookup with it simply finds nothing. (Cheaper than uuid.UUID, and
+    this runs on every lookup by id.)
+    """
+    if len(user_id) == 36 and user_id[8] == user_id[13] == user_id[18] == user_id[23] == '-':
+        try:
+            return bytes.fromhex(user_id.replace('-', ''))
+        except ValueError:
+            pass
+    return user_id
+
+
+def user_id_str(raw):
+    """Returns the canonical string form of a 16-byte user id."""
+    h = raw.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
@@ -0,0 +1,86 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+
+import grpc
+from dotenv import load_dotenv
+
+# Import the generated classes
+from generated import user_pb2
+from generated import user_pb2_grpc
+
+
+load_dotenv()
+
+
+def read_users(path, fmt):
+    """Yields one dict per user from a CSV (with a header row) or JSONL file."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def to_request(user):
+    return user_pb2.RegisterUserRequest(
+        username=user.get('username') or '',
+        email=user.get('email') or '',
+        password=user.get('password') or ''
+    )
+
+
+def import_users(stub, users, chunk_size, token):
+    """Streams `users` to BulkRegisterUsers, one RPC per `chunk_size` users.
+
+    `token` is the server's BULK_IMPORT_TOKEN. Returns (created, failed)
+    and prints every rejected row to stderr.
+    """
+    created = failed = 0
+    offset = 0
+    users = iter(users)
+    while True:
+        chunk = list(itertools.islice(users, chunk_size))
+        if not chunk:
+            break
+        response = stub.BulkRegisterUsers((to_request(user) for user in chunk),
+                                          metadata=[('authorization', f'Bearer {token}')])
+        for result in response.results:
+            if result.status != user_pb2.BulkRegisterResult.CREATED:
+                failed += 1
+                status = user_pb2.BulkRegisterResult.Status.Name(result.status)
+                print(f"Row {offset + result.index + 1}: {status}: {result.error}", file=sys.stderr)
+        created += response.created
+        offset += len(chunk)
+        print(f"{offset} rows sent, {created} users created")
+    return created, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import users from a CSV or JSONL file.")
+    parser.add_argument('path', help="file with username, email and password for each user")
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help="file format (default: from the file extension)")
+    parser.add_argument('--target', default='localhost:50051', help="UserService address")
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help="users sent per BulkRegisterUsers call")
+    parser.add_argument('--token', default=os.getenv('BULK_IMPORT_TOKEN'),
+                        help="the server's BULK_IMPORT_TOKEN (default: from the environment)")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("a service token is required: pass --token or set BULK_IMPORT_TOKEN")
+
+    fmt = args.format or ('jsonl' if args.path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with grpc.insecure_channel(args.target) as channel:
+        stub = user_pb2_grpc.UserServiceStub(channel)
+        created, failed = import_users(stub, read_users(args.path, fmt), args.chunk_size, args.token)
+    print(f"Done: {created} created, {failed} rejected.")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Fraction of per-request INFO/DEBUG messages that are kept; warnings and
+# errors are always logged.
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', '0.1'))
+
+# Per-request messages go through this logger so they can be sampled
+# without losing server lifecycle messages.
+request_log = logging.getLogger('backend.requests')
+
+
+class SamplingFilter(logging.Filter):
+    """Passes a random `rate` fraction of records below WARNING."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, sample_rate=REQUEST_LOG_SAMPLE_RATE):
+    """Routes backend logging through a queue so RPC threads never block on stderr."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'))
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    backend_log = logging.getLogger('backend')
+    backend_log.setLevel(level)
+    backend_log.addHandler(logging.handlers.QueueHandler(log_queue))
+    backend_log.propagate = False
+    request_log.addFilter(SamplingFilter(sample_rate))
@@ -0,0 +1,345 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Port for the Prometheus /metrics endpoint; 0 disables it.
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Where a request's time can go, besides protobuf and Python overhead.
+PHASES = ('db', 'bcrypt', 'jwt')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {series[-1]}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Holds the metrics and stats collectors exposed on /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix, stats_fn):
+        """Exposes every numeric value of `stats_fn()` as a gauge named `<prefix>_<key>`."""
+        with self._lock:
+            self._collectors.append((prefix, stats_fn))
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        for prefix, stats_fn in collectors:
+            for key, value in stats_fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'user_service_{prefix}_{key}'
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+RPC_REQUESTS = REGISTRY.add(Counter(
+    'user_service_rpc_requests_total', 'RPCs handled, by method and status code.',
+    labels=('method', 'code')))
+RPC_LATENCY = REGISTRY.add(Histogram(
+    'user_service_rpc_latency_seconds', 'RPC handling time, by method and status code.',
+    labels=('method', 'code')))
+RPC_PHASE = REGISTRY.add(Histogram(
+    'user_service_rpc_phase_seconds', 'Time each RPC spent in database, bcrypt and JWT work.',
+    labels=('method', 'phase')))
+
+
+# --- Per-request timing spans ---
+
+# The phase totals of the RPC running in the current thread or task.
+_current_spans = contextvars.ContextVar('current_spans', default=None)
+
+
+def current_spans():
+    """Returns the phase totals of the current RPC, or None outside one."""
+    return _current_spans.get()
+
+
+def add_span(spans, phase, seconds):
+    """Adds `seconds` to `phase` in `spans` (as returned by current_spans())."""
+    if spans is not None:
+        spans[phase] = spans.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def span(phase):
+    """Times the enclosed block as part of `phase` of the current RPC."""
+    spans = _current_spans.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(spans, phase, time.perf_counter() - started)
+
+
+def _finish(method, code, started, spans):
+    elapsed = time.perf_counter() - started
+    code_name = code.name if code is not None else 'OK'
+    RPC_REQUESTS.inc(method, code_name)
+    RPC_LATENCY.observe(elapsed, method, code_name)
+    for phase in PHASES:
+        RPC_PHASE.observe(spans.get(phase, 0.0), method, phase)
+
+
+def _status(context, error=None):
+    # context.code() is whatever the handler set; an escaped exception
+    # without a code means the client sees UNKNOWN.
+    code = context.code() if hasattr(context, 'code') else None
+    if code is None and error is not None:
+        if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+            return grpc.StatusCode.CANCELLED
+        return grpc.StatusCode.UNKNOWN
+    return code
+
+
+def _wrap_handler(handler, wrap_unary, wrap_stream):
+    if handler is None:
+        return None
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(
+            wrap_unary(handler.unary_unary),
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(
+            wrap_stream(handler.unary_stream),
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler(
+            wrap_unary(handler.stream_unary),
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+    return grpc.stream_stream_rpc_method_handler(
+        wrap_stream(handler.stream_stream),
+        request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Records count, latency and phase timings for every RPC on the sync server."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+
+        def wrap_unary(behavior):
+            def timed(request, context):
+                spans = {}
+                token = _current_spans.set(spans)
+                started = time.perf_counter()
+                error = None
+                try:
+                    return behavior(request, context)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _current_spans.reset(token)
+                    _finish(method, _status(context, error), started, spans)
+            return timed
+
+        def wrap_stream(behavior):
+            def timed(request, context):
+                spans = {}
+                started = time.perf_counter()
+                error = None
+                try:
+                    # Generator frames may resume on different threads, so set
+                    # the context around each step rather than once.
+                    responses = iter(behavior(request, context))
+                    while True:
+                        token = _current_spans.set(spans)
+                        try:
+                            response = next(responses)
+                        except StopIteration:
+                            return
+                        finally:
+                            _current_spans.reset(token)
+                        yield response
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _finish(method, _status(context, error), started, spans)
+            return timed
+
+        return _wrap_handler(continuation(handler_call_details), wrap_unary, wrap_stream)
+
+
+class AioMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """The grpc.aio counterpart of MetricsInterceptor."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+
+        def wrap_unary(behavior):
+            async def timed(request, context):
+                spans = {}
+                token = _current_spans.set(spans)
+                started = time.perf_counter()
+                error = None
+                try:
+                    return await behavior(request, context)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _current_spans.reset(token)
+                    _finish(method, _status(context, error), started, spans)
+            return timed
+
+        def wrap_stream(behavior):
+            async def timed(request, context):
+                spans = {}
+                token = _current_spans.set(spans)
+                started = time.perf_counter()
+                error = None
+                try:
+                    async for response in behavior(request, context):
+                        yield response
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    try:
+                        _current_spans.reset(token)
+                    except ValueError:
+                        # A stream the client cancelled is left suspended and
+                        # closed later by the event loop, from another context.
+                        pass
+                    _finish(method, _status(context, error), started, spans)
+            return timed
+
+        return _wrap_handler(await continuation(handler_call_details), wrap_unary, wrap_stream)
+
+
+# --- /metrics endpoint ---
+
+# Path -> (content type, function returning the body), served next to /metrics.
+_routes = {
+    '/metrics': ('text/plain; version=0.0.4; charset=utf-8', REGISTRY.expose),
+}
+
+
+def add_route(path, content_type, render):
+    """Serves `render()` at `path` on the metrics server, e.g. documents other services poll."""
+    _routes[path] = (content_type, render)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = _routes.get(self.path.split('?', 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, render = route
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent; keep them out of the server log.
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves /metrics from a daemon thread; returns the HTTP server, or None if disabled."""
+    if not port:
+        return None
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics', daemon=True).start()
+    return httpd
@@ -0,0 +1,229 @@
+import argparse
+import logging
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Versioned scripts live in schema/<dialect>/NNNN_description.sql and are
+# applied at startup. Scripts in schema/<dialect>/online/ only add indexes,
+# must be idempotent (IF NOT EXISTS) and are built in the background while
+# the server is already serving, since they can take minutes on a big table.
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema')
+# Arbitrary key for the advisory lock that serialises Postgres migrations.
+MIGRATION_LOCK_ID = 7245001
+ONLINE_LOCK_ID = 7245002
+
+# 'background' builds online indexes after startup; 'off' leaves them to
+# `python -m backend.migrations --online`.
+DB_ONLINE_MIGRATIONS = os.getenv('DB_ONLINE_MIGRATIONS', 'background')
+# Seconds between `PRAGMA optimize` runs on SQLite; 0 disables them.
+DB_OPTIMIZE_INTERVAL = float(os.getenv('DB_OPTIMIZE_INTERVAL', '3600'))
+
+_SCRIPT_NAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations(dialect, online=False):
+    """Returns [(version, name, sql)] for `dialect`, in version order."""
+    directory = os.path.join(SCHEMA_DIR, dialect, 'online') if online else os.path.join(SCHEMA_DIR, dialect)
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _SCRIPT_NAME.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}.")
+    return migrations
+
+
+def split_statements(sql):
+    """Splits a script of simple DDL statements (no literal semicolons) into statements."""
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def migrate_sqlite(conn, migrations=None):
+    """Applies pending migrations to a SQLite connection; returns the schema version.
+
+    The version is kept in `PRAGMA user_version`, and each script runs in
+    its own transaction together with the version bump.
+    """
+    if migrations is None:
+        migrations = load_migrations('sqlite')
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, name, sql in migrations:
+        if target <= version:
+            continue
+        try:
+            conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {target};\nCOMMIT;")
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        logger.info("Applied migration %04d_%s.", target, name)
+        version = target
+    return version
+
+
+def build_indexes_sqlite(conn, migrations=None):
+    """Runs the online index scripts on a SQLite connection, then refreshes statistics.
+
+    SQLite builds an index in one write transaction: readers carry on (in
+    WAL mode) but writers wait, so keep busy_timeout in mind on big tables.
+    """
+    if migrations is None:
+        migrations = load_migrations('sqlite', online=True)
+    for version, name, sql in migrations:
+        for statement in split_statements(sql):
+            conn.execute(statement)
+        conn.commit()
+        logger.info("Online migration %04d_%s is in place.", version, name)
+    # A bounded ANALYZE samples rather than reads every row of a big table.
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def optimize_sqlite(conn):
+    """Lets SQLite refresh the statistics that have drifted since the last run."""
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("PRAGMA optimize")
+
+
+def migrate_postgres(conn, migrations=None):
+    """Applies pending migrations to a psycopg connection; returns the schema version.
+
+    Applied versions are recorded in `schema_migrations`. An advisory lock
+    makes replicas that start together apply each script exactly once.
+    """
+    if migrations is None:
+        migrations = load_migrations('postgres')
+    with conn.transaction():
+        conn.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        applied = {row['version'] for row in conn.execute("SELECT version FROM schema_migrations")}
+        for target, name, sql in migrations:
+            if target in applied:
+                continue
+            # Scripts may hold several statements, which can't be prepared.
+            conn.execute(sql, prepare=False)
+            conn.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                         (target, name))
+            logger.info("Applied migration %04d_%s.", target, name)
+            applied.add(target)
+    return max(applied, default=0)
+
+
+def build_indexes_postgres(conn, migrations=None):
+    """Runs the online index scripts on a psycopg connection, then analyzes `users`.
+
+    The scripts use CREATE INDEX CONCURRENTLY, which doesn't block writes
+    but can't run inside a transaction, so the connection is switched to
+    autocommit for the duration.
+    """
+    if migrations is None:
+        migrations = load_migrations('postgres', online=True)
+    conn.autocommit = True
+    locked = False
+    try:
+        # One replica builds at a time; the others leave it to that one.
+        locked = conn.execute("SELECT pg_try_advisory_lock(%s) AS locked",
+                              (ONLINE_LOCK_ID,)).fetchone()['locked']
+        if not locked:
+            logger.info("Another server is building the online indexes.")
+            return
+        # With the lock held, an invalid index is one whose concurrent build
+        # died half-way; IF NOT EXISTS would skip it, so drop it first.
+        invalid = conn.execute(
+            "SELECT indexrelid::regclass::text AS name FROM pg_index "
+            "WHERE indrelid = 'users'::regclass AND NOT indisvalid"
+        ).fetchall()
+        for row in invalid:
+            conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {row["name"]}', prepare=False)
+        for version, name, sql in migrations:
+            for statement in split_statements(sql):
+                conn.execute(statement, prepare=False)
+            logger.info("Online migration %04d_%s is in place.", version, name)
+        # Expression indexes only get statistics once the table is analyzed.
+        conn.execute("ANALYZE users", prepare=False)
+    finally:
+        if locked:
+            # Session locks outlive the call, and this connection goes back to the pool.
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ONLINE_LOCK_ID,))
+        conn.autocommit = False
+
+
+class Maintenance(threading.Thread):
+    """Builds a repository's online indexes after startup, then optimizes it periodically."""
+
+    def __init__(self, repository, online=DB_ONLINE_MIGRATIONS, interval=DB_OPTIMIZE_INTERVAL):
+        super().__init__(name='db-maintenance', daemon=True)
+        self.repository = repository
+        self.online = online
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        if self.online == 'background':
+            try:
+                self.repository.build_indexes()
+            except Exception:
+                # Only performance depends on these; retried on the next start.
+                logger.exception("Building online indexes failed.")
+        if not self.interval:
+            return
+        while not self._stopping.wait(self.interval):
+            try:
+                self.repository.optimize()
+            except Exception:
+                logger.exception("Database optimization failed.")
+
+    def stop(self):
+        self._stopping.set()
+
+
+def main():
+    from .repository import get_repository
+
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--online', action='store_true',
+                        help="also build the online indexes now and wait for them")
+    parser.add_argument('--compact-ids', action='store_true',
+                        help="convert a SQLite users table to 16-byte ids (stop the servers first)")
+    parser.add_argument('--no-covering-index', action='store_true',
+                        help="with --compact-ids, skip users_email_covering to save space")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    repository = get_repository()
+    try:
+        repository.migrate()
+        if args.compact_ids:
+            if not hasattr(repository, 'compact'):
+                parser.error("--compact-ids only applies to the SQLite backend.")
+            if repository.compact(covering_index=not args.no_covering_index):
+                logger.info("Converted users to the compact id layout.")
+            else:
+                logger.info("users already uses the compact id layout.")
+        if args.online:
+            repository.build_indexes()
+    finally:
+        repository.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from . import metrics
+
+
+load_dotenv()
+
+# Defaults can be overridden from the environment (or the .env file).
+DB_PATH = os.getenv('USER_DB_PATH', 'users.db')
+# One connection per gRPC worker thread so a request never waits on the pool.
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', os.getenv('GRPC_MAX_WORKERS', '10')))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5.0'))
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+# Negative values are KiB, positive values are pages (see the SQLite docs).
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-16000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections shared by the gRPC worker threads.
+
+    Connections are opened lazily up to `size`, configured once with the
+    journal and cache pragmas, and then handed out with `connection()`.
+    A connection is only ever used by one thread at a time.
+    """
+
+    def __init__(self, database=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 journal_mode=SQLITE_JOURNAL_MODE, synchronous=SQLITE_SYNCHRONOUS,
+                 cache_size=SQLITE_CACHE_SIZE, mmap_size=SQLITE_MMAP_SIZE,
+                 busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = {
+            'journal_mode': journal_mode,
+            'synchronous': synchronous,
+            'cache_size': cache_size,
+            'mmap_size': mmap_size,
+            'busy_timeout': busy_timeout_ms,
+        }
+
+        # LIFO keeps the most recently used (and cache-warm) connections busy.
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._all = []
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+        self._checkout_seconds = 0.0
+        self._max_checkout_seconds = 0.0
+
+    def _connect(self):
+        # check_same_thread is off because a connection may be returned by one
+        # worker thread and checked out by another; the pool serialises access.
+        conn = sqlite3.connect(self.database, timeout=self.pragmas['busy_timeout'] / 1000,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise PoolTimeout("Connection pool is closed.")
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+            self._waits += 1
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s.")
+        with self._lock:
+            self._wait_seconds += time.perf_counter() - started
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            # Never hand the next caller a connection with a half-finished transaction.
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a `with` block."""
+        requested = time.perf_counter()
+        conn = self._acquire()
+        started = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            held = time.perf_counter() - started
+            metrics.add_span(metrics.current_spans(), 'db', held + (started - requested))
+            with self._lock:
+                self._checkouts += 1
+                self._checkout_seconds += held
+                if held > self._max_checkout_seconds:
+                    self._max_checkout_seconds = held
+            self._release(conn)
+
+    def stats(self):
+        """Return a snapshot of pool counters for monitoring."""
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                'size': self.size,
+                'open': len(self._all),
+                'idle': idle,
+                'in_use': len(self._all) - idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_seconds_total': self._wait_seconds,
+                'checkout_seconds_total': self._checkout_seconds,
+                'checkout_seconds_max': self._max_checkout_seconds,
+            }
+
+    def close(self):
+        """Close idle connections now and busy ones as they are returned."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
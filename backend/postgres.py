@@ -0,0 +1,317 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from . import metrics
+from .migrations import build_indexes_postgres, migrate_postgres
+from .pool import POOL_SIZE, POOL_TIMEOUT
+from .repository import (
+    MIN_SUBSTRING_QUERY, UPDATABLE_COLUMNS, USER_CREATED, USER_UPDATED, DuplicateUser,
+    RefreshTokenReused, UserRepository, VersionConflict,
+)
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'postgresql://localhost/users')
+# Connections opened at startup; the pool grows to DB_POOL_SIZE on demand.
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+
+USER_COLUMNS = "id, username, email, hashed_password, version"
+USER_EVENT_COLUMNS = "sequence, event_type, user_id, username, email, version, occurred_at"
+# Advisory lock held from appending to user_events until the commit (next
+# to the ones in migrations.py).
+OUTBOX_LOCK_ID = 7245003
+
+
+class PostgresUserRepository(UserRepository):
+    """UserRepository on PostgreSQL, so any number of backend replicas can share one database.
+
+    Connections come from a psycopg_pool pool. With prepare_threshold=0
+    every query becomes a server-side prepared statement the first time a
+    connection runs it. Requires the optional `psycopg` and `psycopg_pool`
+    packages.
+    """
+
+    def __init__(self, conninfo=DATABASE_URL, size=POOL_SIZE, min_size=DB_POOL_MIN_SIZE,
+                 timeout=POOL_TIMEOUT):
+        import psycopg  # Optional dependencies, only needed for this backend.
+        from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
+
+        self._unique_violation = psycopg.errors.UniqueViolation
+        self.size = size
+        self.pool = ConnectionPool(
+            conninfo, min_size=min(min_size, size), max_size=size, timeout=timeout,
+            kwargs={'row_factory': dict_row, 'prepare_threshold': 0},
+            name='users', open=True
+        )
+
+    @contextmanager
+    def _connection(self):
+        # Commits when the block succeeds and rolls back if it raises.
+        with metrics.span('db'), self.pool.connection() as conn:
+            yield conn
+
+    def migrate(self):
+        with self.pool.connection() as conn:
+            version = migrate_postgres(conn)
+        logger.info("Database initialized at schema version %d.", version)
+
+    def build_indexes(self):
+        with self.pool.connection() as conn:
+            build_indexes_postgres(conn)
+
+    # optimize() is left to autovacuum, which analyzes tables as they change.
+
+    def _append_user_events(self, conn, events):
+        """Adds (event_type, user_id, username, email, version) events in `conn`'s transaction."""
+        # Identity values are handed out before commit, so two writers could
+        # commit sequence 11 before 10 and a reader past 11 would never see
+        # 10. Appending under a lock held until commit keeps them in order.
+        # Callers take it after their users write, so nobody holding it can
+        # be waiting on a row lock held by someone queued for it.
+        conn.execute("SELECT pg_advisory_xact_lock(%s)", (OUTBOX_LOCK_ID,))
+        event_types, user_ids, usernames, emails, versions = (list(column) for column in zip(*events))
+        conn.execute(
+            "INSERT INTO user_events (event_type, user_id, username, email, version, occurred_at) "
+            "SELECT *, %s::bigint "
+            "FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::bigint[])",
+            (int(time.time() * 1000), event_types, user_ids, usernames, emails, versions)
+        )
+
+    def insert_user(self, user_id, username, email, hashed_password):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (id, username, email, hashed_password) VALUES (%s, %s, %s, %s)",
+                    (user_id, username, email, hashed_password)
+                )
+                self._append_user_events(conn, [(USER_CREATED, user_id, username, email, 1)])
+        except self._unique_violation as e:
+            raise DuplicateUser(str(e)) from e
+
+    def get_user_by_email(self, email):
+        with self._connection() as conn:
+            user = conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE email = %s", (email,)
+            ).fetchone()
+            if user is not None:
+                return user
+            # A differently-cased address; uses the users_email_lower index.
+            users = conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE lower(email) = lower(%s) LIMIT 2", (email,)
+            ).fetchall()
+        return users[0] if len(users) == 1 else None
+
+    def get_user_by_id(self, user_id):
+        with self._connection() as conn:
+            return conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,)
+            ).fetchone()
+
+    def get_users_by_ids(self, user_ids):
+        # One array parameter, so the statement is the same for any batch size.
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE id = ANY(%s)", (list(user_ids),)
+            ).fetchall()
+        return {row['id']: row for row in rows}
+
+    def update_user(self, user_id, changes, expected_version=None):
+        if not changes or set(changes) - set(UPDATABLE_COLUMNS):
+            raise ValueError(f"Can only update {', '.join(UPDATABLE_COLUMNS)}.")
+        # Takes only the row lock; a concurrent update of the same row makes
+        # this one re-check its WHERE clause against the committed version.
+        assignments = ''.join(f"{column} = %s, " for column in changes)
+        sql = f"UPDATE users SET {assignments}version = version + 1 WHERE id = %s"
+        params = [*changes.values(), user_id]
+        if expected_version is not None:
+            sql += " AND version = %s"
+            params.append(expected_version)
+        try:
+            with self._connection() as conn:
+                user = conn.execute(f"{sql} RETURNING {USER_COLUMNS}", params).fetchone()
+                if user is not None:
+                    self._append_user_events(conn, [(USER_UPDATED, user['id'], user['username'],
+                                                     user['email'], user['version'])])
+                elif expected_version is not None and conn.execute(
+                        "SELECT 1 FROM users WHERE id = %s", (user_id,)).fetchone():
+                    raise VersionConflict(f"User {user_id} is no longer at version {expected_version}.")
+        except self._unique_violation as e:
+            raise DuplicateUser(str(e)) from e
+        return user
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET hashed_password = %s WHERE id = %s AND hashed_password = %s",
+                (new_hash, user_id, old_hash)
+            )
+        return cursor.rowcount == 1
+
+    def find_taken(self, usernames, emails):
+        if not usernames and not emails:
+            return set(), set()
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT username, email FROM users WHERE username = ANY(%s) OR email = ANY(%s)",
+                (list(usernames), list(emails))
+            ).fetchall()
+        taken_usernames = set(usernames).intersection(row['username'] for row in rows)
+        taken_emails = set(emails).intersection(row['email'] for row in rows)
+        return taken_usernames, taken_emails
+
+    def insert_users(self, rows):
+        if not rows:
+            return set()
+        ids, usernames, emails, hashes = (list(column) for column in zip(*rows))
+        with self._connection() as conn:
+            inserted = conn.execute(
+                "INSERT INTO users (id, username, email, hashed_password) "
+                "SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::bytea[]) "
+                "ON CONFLICT DO NOTHING RETURNING id, username, email",
+                (ids, usernames, emails, hashes)
+            ).fetchall()
+            if inserted:
+                self._append_user_events(conn, [
+                    (USER_CREATED, row['id'], row['username'], row['email'], 1) for row in inserted
+                ])
+        return {row['id'] for row in inserted}
+
+    def list_users(self, after=None, limit=50):
+        with self._connection() as conn:
+            if after is None:
+                return conn.execute(
+                    "SELECT id, username, email FROM users ORDER BY username, id LIMIT %s",
+                    (limit,)
+                ).fetchall()
+            return conn.execute(
+                "SELECT id, username, email FROM users WHERE (username, id) > (%s, %s) "
+                "ORDER BY username, id LIMIT %s",
+                (after[0], after[1], limit)
+            ).fetchall()
+
+    def count_users(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT count(*) AS n FROM users").fetchone()['n']
+
+    def search_users(self, query, limit, offset=0):
+        # ILIKE uses the pg_trgm indexes when they exist (online script 0004);
+        # the ranking sticks to built-in functions, so it works without them.
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = f'%{escaped}%' if len(query) >= MIN_SUBSTRING_QUERY else f'{escaped}%'
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT id, username, email FROM users "
+                "WHERE username ILIKE %(pattern)s OR email ILIKE %(pattern)s "
+                "ORDER BY CASE WHEN lower(username) = lower(%(query)s) OR lower(email) = lower(%(query)s) THEN 0 "
+                "WHEN left(lower(username), length(%(query)s)) = lower(%(query)s) THEN 1 "
+                "WHEN left(lower(email), length(%(query)s)) = lower(%(query)s) THEN 2 ELSE 3 END, "
+                "strpos(lower(username), lower(%(query)s)) = 0, length(username), username, id "
+                "LIMIT %(limit)s OFFSET %(offset)s",
+                {'query': query, 'pattern': pattern, 'limit': limit, 'offset': offset}
+            ).fetchall()
+
+    def list_user_events(self, after, limit):
+        with self._connection() as conn:
+            return conn.execute(
+                f"SELECT {USER_EVENT_COLUMNS} FROM user_events WHERE sequence > %s "
+                "ORDER BY sequence LIMIT %s",
+                (after, limit)
+            ).fetchall()
+
+    def get_user_event_range(self):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT min(sequence) AS first, max(sequence) AS last FROM user_events"
+            ).fetchone()
+        return row['first'], row['last']
+
+    def purge_user_events(self, before):
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM user_events WHERE occurred_at < %s "
+                "AND sequence < (SELECT max(sequence) FROM user_events)",
+                (before,)
+            ).rowcount
+
+    def insert_refresh_token(self, token_hash, user_id, family_id, expires_at):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO refresh_tokens (token_hash, user_id, family_id, expires_at) "
+                "VALUES (%s, %s, %s, %s)",
+                (token_hash, user_id, family_id, expires_at)
+            )
+
+    def rotate_refresh_token(self, old_hash, new_hash, now, expires_at, reuse_interval):
+        reused = False
+        with self._connection() as conn:
+            # A concurrent exchange of the same token waits on the row lock,
+            # then finds it used and falls through to the check below.
+            row = conn.execute(
+                "UPDATE refresh_tokens SET used_at = %s "
+                "WHERE token_hash = %s AND used_at IS NULL AND expires_at > %s "
+                "RETURNING user_id, family_id",
+                (now, old_hash, now)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT user_id, family_id, expires_at, used_at FROM refresh_tokens "
+                    "WHERE token_hash = %s",
+                    (old_hash,)
+                ).fetchone()
+                if row is None or row['expires_at'] <= now:
+                    return None
+                reused = now - row['used_at'] > reuse_interval
+            if reused:
+                conn.execute("DELETE FROM refresh_tokens WHERE family_id = %s", (row['family_id'],))
+            else:
+                conn.execute(
+                    "INSERT INTO refresh_tokens (token_hash, user_id, family_id, expires_at) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (new_hash, row['user_id'], row['family_id'], expires_at)
+                )
+        # Raised outside the block so the family's deletion is committed.
+        if reused:
+            raise RefreshTokenReused(f"Refresh token family {row['family_id']} was replayed.")
+        return row['user_id']
+
+    def delete_refresh_token_family(self, token_hash):
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM refresh_tokens WHERE family_id = "
+                "(SELECT family_id FROM refresh_tokens WHERE token_hash = %s)",
+                (token_hash,)
+            )
+
+    def revoke_access_token(self, jti, expires_at):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO revoked_tokens (jti, expires_at) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (jti, expires_at)
+            )
+
+    def list_revoked_tokens(self, now):
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > %s", (now,)
+            ).fetchall()
+
+    def purge_expired_tokens(self, now):
+        with self._connection() as conn:
+            purged = conn.execute("DELETE FROM refresh_tokens WHERE expires_at <= %s", (now,)).rowcount
+            purged += conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= %s", (now,)).rowcount
+        return purged
+
+    def stats(self):
+        return self.pool.get_stats()
+
+    def close(self):
+        super().close()
+        self.pool.close()
@@ -0,0 +1,265 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'bloom' keeps a Bloom filter of every username and email so registrations
+# that are certainly new skip the duplicate lookup, and likely duplicates
+# are turned away before bcrypt runs; 'off' hashes first, as before.
+REGISTRATION_PRECHECK = os.getenv('REGISTRATION_PRECHECK', 'bloom')
+# False positive rate the filter is sized for; each one costs an indexed lookup.
+REGISTRATION_BLOOM_FP_RATE = float(os.getenv('REGISTRATION_BLOOM_FP_RATE', '0.01'))
+# Smallest number of keys (two per user) the filter is sized for.
+REGISTRATION_BLOOM_MIN_CAPACITY = int(os.getenv('REGISTRATION_BLOOM_MIN_CAPACITY', '100000'))
+# Seconds between rebuilds from the database; 0 rebuilds only when the filter
+# fills up. Set it when other replicas register users in the same database.
+REGISTRATION_INDEX_REBUILD_INTERVAL = float(os.getenv('REGISTRATION_INDEX_REBUILD_INTERVAL', '0'))
+
+# Rows read per query while the filter is built.
+SCAN_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """A fixed-size set of strings that answers "maybe" or "certainly not".
+
+    `capacity` keys fit at roughly `fp_rate` false positives; past that the
+    rate climbs, so the owner rebuilds it bigger. Keys can't be removed.
+    """
+
+    def __init__(self, capacity, fp_rate=REGISTRATION_BLOOM_FP_RATE):
+        self.capacity = max(1, capacity)
+        self.bits = max(64, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing on the two halves of hash(key). It is salted per
+        # process, which is fine: the filter never leaves the process.
+        h = hash(key)
+        step = h >> 32 | 1
+        position = h & 0xffffffff
+        bits = self.bits
+        for _ in range(self.hashes):
+            position = (position + step) % bits
+            yield position
+
+    def add(self, key):
+        array = self._array
+        for position in self._positions(key):
+            array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        array = self._array
+        for position in self._positions(key):
+            if not array[position >> 3] & 1 << (position & 7):
+                return False
+        return True
+
+    @property
+    def nbytes(self):
+        return len(self._array)
+
+    def fp_rate(self):
+        """The false positive rate expected at the current fill."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+class RegistrationIndex:
+    """Remembers which usernames and emails are taken, approximately, to spare bcrypt.
+
+    Built from the users table in a background thread at startup, then kept
+    current by add() after every write. might_be_taken() is a filter lookup:
+    False means the username and email are certainly free, True that one of
+    them may be taken and the caller should confirm with find_taken() before
+    hashing. Until the first build finishes everything "may be taken", so
+    every registration is checked against the database.
+
+    The unique indexes stay the authority: a user registered by another
+    replica, or between the check and the INSERT, is still rejected there.
+    """
+
+    def __init__(self, users, fp_rate=REGISTRATION_BLOOM_FP_RATE,
+                 min_capacity=REGISTRATION_BLOOM_MIN_CAPACITY,
+                 interval=REGISTRATION_INDEX_REBUILD_INTERVAL):
+        self.users = users
+        self.fp_rate = fp_rate
+        self.min_capacity = min_capacity
+        self.interval = interval
+        self._filter = None
+        # Keys added while a rebuild scans the table, replayed into the new filter.
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._rebuilds = 0
+        self._rebuild_seconds = 0.0
+        self._rows_scanned = 0
+        self._checks = 0
+        self._maybe_taken = 0
+        self._confirmed = 0
+
+    def start(self):
+        """Builds the filter in the background, then rebuilds it as configured."""
+        self._thread = threading.Thread(target=self._run, name='registration-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                self.rebuild()
+            except Exception:
+                # Registrations keep working, just with a lookup for every one.
+                logger.exception("Building the registration index failed.")
+            self._wake.wait(self.interval or None)
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def rebuild(self):
+        """Reads every username and email into a new filter and swaps it in."""
+        started = time.perf_counter()
+        with self._lock:
+            self._pending = []
+        try:
+            # Room for the table to double before the filter fills up.
+            bloom = BloomFilter(max(self.min_capacity, 4 * self.users.count_users()), self.fp_rate)
+            rows = 0
+            after = None
+            while True:
+                page = self.users.list_users(after, SCAN_BATCH_SIZE)
+                for row in page:
+                    bloom.add('u:' + row['username'])
+                    bloom.add('e:' + row['email'])
+                rows += len(page)
+                if len(page) < SCAN_BATCH_SIZE:
+                    break
+                after = (page[-1]['username'], page[-1]['id'])
+            with self._lock:
+                for key in self._pending:
+                    bloom.add(key)
+                self._filter = bloom
+        finally:
+            with self._lock:
+                self._pending = None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._rebuilds += 1
+            self._rebuild_seconds = elapsed
+            self._rows_scanned = rows
+        logger.info("Registration index built from %d users in %.2fs (%d KiB).",
+                    rows, elapsed, bloom.nbytes // 1024)
+
+    def might_be_taken(self, username, email):
+        bloom = self._filter
+        maybe = bloom is None or 'u:' + username in bloom or 'e:' + email in bloom
+        with self._lock:
+            self._checks += 1
+            self._maybe_taken += maybe
+        return maybe
+
+    def confirmed(self, taken):
+        """Returns whether find_taken()'s result `taken` names anything, and counts it."""
+        found = any(taken)
+        if found:
+            with self._lock:
+                self._confirmed += 1
+        return found
+
+    def add(self, username, email):
+        """Records a username and email that were just written."""
+        keys = ('u:' + username, 'e:' + email)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(keys)
+            bloom = self._filter
+            if bloom is None:
+                return
+            for key in keys:
+                bloom.add(key)
+            # A rebuild in progress is already making a bigger one.
+            full = bloom.count > bloom.capacity and self._pending is None
+        if full:
+            self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            bloom = self._filter
+            stats = {
+                'ready': int(bloom is not None),
+                'rebuilds': self._rebuilds,
+                'rebuild_seconds': self._rebuild_seconds,
+                'rows_scanned': self._rows_scanned,
+                'checks': self._checks,
+                'maybe_taken': self._maybe_taken,
+                'confirmed_taken': self._confirmed,
+                # Lookups that found nothing: the filter's false positives,
+                # plus every registration checked before the first build.
+                'false_positives': self._maybe_taken - self._confirmed,
+            }
+            if bloom is not None:
+                stats.update({
+                    'keys': bloom.count,
+                    'capacity': bloom.capacity,
+                    'memory_bytes': bloom.nbytes,
+                    'hashes': bloom.hashes,
+                    'expected_fp_rate': bloom.fp_rate(),
+                })
+        return stats
+
+
+class NullRegistrationIndex:
+    """Stands in when the pre-check is off: never suggests a lookup."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def might_be_taken(self, username, email):
+        return False
+
+    def confirmed(self, taken):
+        return any(taken)
+
+    def add(self, username, email):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def make_registration_index(users, kind=REGISTRATION_PRECHECK):
+    if kind == 'bloom':
+        return RegistrationIndex(users)
+    if kind == 'off':
+        return NullRegistrationIndex()
+    raise ValueError(f"Unknown registration pre-check '{kind}'.")
+
+
+_registration_index = None
+_registration_index_lock = threading.Lock()
+
+
+def get_registration_index():
+    """Returns the process-wide registration index, creating it on first use."""
+    global _registration_index
+    if _registration_index is None:
+        with _registration_index_lock:
+            if _registration_index is None:
+                from .repository import get_repository
+                _registration_index = make_registration_index(get_repository())
+    return _registration_index
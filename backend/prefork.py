@@ -0,0 +1,131 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+
+from .hashing import BCRYPT_ROUNDS, BCRYPT_TARGET_MS, calibrate_rounds
+from .logs import configure_logging
+from .metrics import METRICS_PORT
+from .server import GRPC_GRACE_PERIOD
+
+
+logger = logging.getLogger(__name__)
+
+# A worker that exits sooner than this after starting counts as crashing on
+# startup; each time in a row doubles the wait before it is started again.
+MIN_UPTIME = 10.0
+MAX_RESTART_DELAY = 60.0
+# Extra seconds a draining worker gets to close its pools before it is killed.
+SHUTDOWN_MARGIN = 5.0
+
+
+def run_worker(index, mode):
+    """Entry point of worker `index`: a complete server bound with SO_REUSEPORT."""
+    from .server import run_process
+
+    configure_logging()
+    # Each worker has its own registry, so each gets its own /metrics port.
+    metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+    run_process(mode, reuse_port=True, metrics_port=metrics_port)
+
+
+class Supervisor:
+    """Runs `processes` copies of the server on one port and keeps them running.
+
+    Workers are spawned rather than forked, so none inherits this process's
+    threads or connections; each opens its own database pool, caches and
+    hashing pool, and the kernel spreads new connections across them. The
+    supervisor does the shared work (migrations ran before it started, the
+    maintenance thread keeps running here), restarts a worker that dies,
+    passes SIGHUP on, and on SIGTERM or SIGINT drains every worker.
+    """
+
+    def __init__(self, processes, mode, grace=GRPC_GRACE_PERIOD):
+        self.processes = processes
+        self.mode = mode
+        self.grace = grace
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = {}
+        self._started_at = {}
+        self._crashes = {}
+        self._restart_at = {}
+        self._stopping = False
+        # Split the hashing workers between the processes unless told otherwise.
+        os.environ.setdefault('HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // processes)))
+
+    def _start(self, index):
+        process = self._context.Process(target=run_worker, args=(index, self.mode),
+                                        name=f'worker-{index}')
+        process.start()
+        self._workers[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info("Started worker %d (pid %d).", index, process.pid)
+
+    def _forward(self, signum):
+        for process in self._workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _reap(self):
+        now = time.monotonic()
+        for index, process in list(self._workers.items()):
+            if process.exitcode is None:
+                continue
+            del self._workers[index]
+            if now - self._started_at[index] < MIN_UPTIME:
+                self._crashes[index] = self._crashes.get(index, 0) + 1
+            else:
+                self._crashes[index] = 0
+            delay = min(MAX_RESTART_DELAY, 2 ** self._crashes[index] - 1)
+            logger.warning("Worker %d (pid %d) exited with code %s; restarting in %ds.",
+                           index, process.pid, process.exitcode, delay)
+            self._restart_at[index] = now + delay
+
+    def run(self):
+        """Starts the workers and supervises them until SIGTERM or SIGINT."""
+        if not BCRYPT_ROUNDS:
+            # Once, here: workers calibrating side by side would slow each
+            # other down, pick different costs and keep re-hashing each
+            # other's users.
+            rounds, seconds = calibrate_rounds(BCRYPT_TARGET_MS / 1000)
+            os.environ['BCRYPT_ROUNDS'] = str(rounds)
+            logger.info("bcrypt cost %d takes %.0f ms here (target %.0f ms).",
+                        rounds, seconds * 1000, BCRYPT_TARGET_MS)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._forward(signum))
+
+        for index in range(self.processes):
+            self._start(index)
+        while not self._stopping:
+            # Wakes when a worker exits, and at least once a second to check for signals.
+            wait([process.sentinel for process in self._workers.values()], timeout=1.0)
+            if self._stopping:
+                break
+            self._reap()
+            now = time.monotonic()
+            for index, restart_at in list(self._restart_at.items()):
+                if now >= restart_at:
+                    del self._restart_at[index]
+                    self._start(index)
+        self.drain()
+
+    def drain(self):
+        """Asks every worker to drain, then waits; anything still running after the grace period is killed."""
+        logger.info("Stopping %d workers.", len(self._workers))
+        self._forward(signal.SIGTERM)
+        deadline = time.monotonic() + self.grace + SHUTDOWN_MARGIN
+        for index, process in self._workers.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.exitcode is None:
+                logger.warning("Worker %d (pid %d) did not stop in time; killing it.",
+                               index, process.pid)
+                process.kill()
+                process.join()
+        logger.info("All workers stopped.")
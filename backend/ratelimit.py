@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# 'local' keeps buckets in this process, 'redis' shares them between
+# servers through a Redis-compatible server and 'none' disables limiting.
+LOGIN_RATE_LIMIT_BACKEND = os.getenv('LOGIN_RATE_LIMIT_BACKEND', 'local')
+# Limits are "<attempts>/<seconds>": a bucket of <attempts> tokens that
+# refills completely over <seconds>. "0" disables a limit.
+LOGIN_LIMIT_PER_EMAIL = os.getenv('LOGIN_LIMIT_PER_EMAIL', '10/60')
+LOGIN_LIMIT_PER_PEER = os.getenv('LOGIN_LIMIT_PER_PEER', '60/60')
+LOGIN_LIMIT_GLOBAL = os.getenv('LOGIN_LIMIT_GLOBAL', '500/1')
+# Buckets kept by the local backend before idle ones are swept early.
+LOGIN_RATE_LIMIT_MAX_KEYS = int(os.getenv('LOGIN_RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+SWEEP_INTERVAL = 30.0
+
+
+class RateLimited(Exception):
+    """Raised when a login attempt is over one of the limits."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Too many login attempts. Try again in {max(1, round(retry_after))}s.")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def parse_limit(text):
+    """Parses "<attempts>/<seconds>" into (capacity, tokens per second), or None if disabled."""
+    text = (text or '').strip()
+    if text in ('', '0'):
+        return None
+    try:
+        attempts, _, seconds = text.partition('/')
+        capacity = float(attempts)
+        rate = capacity / float(seconds or '1')
+    except ValueError:
+        raise ValueError(f"Invalid rate limit '{text}'; expected '<attempts>/<seconds>'.") from None
+    if capacity <= 0 or rate <= 0:
+        return None
+    return capacity, rate
+
+
+def peer_address(peer):
+    """Strips the port from a gRPC peer string such as 'ipv4:10.0.0.1:53412'."""
+    address, sep, port = peer.rpartition(':')
+    return address if sep and port.isdigit() else peer
+
+
+class LocalBuckets:
+    """Token buckets for many keys in one dict of (tokens, updated_at) tuples.
+
+    A bucket that has been idle long enough to refill completely is the same
+    as no bucket, so sweeping simply drops those entries.
+    """
+
+    # Whether calls wait on the network (see AsyncUserServiceServicer._run).
+    blocking = False
+
+    def __init__(self, max_keys=LOGIN_RATE_LIMIT_MAX_KEYS, sweep_interval=SWEEP_INTERVAL):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        # Longest full-refill time of any bucket; idle longer than this is full.
+        self._refill_seconds = 0.0
+        self._swept = 0
+
+    def acquire(self, key, capacity, rate):
+        """Takes a token from `key`'s bucket; returns 0 on success or seconds until one is free."""
+        now = time.monotonic()
+        with self._lock:
+            self._refill_seconds = max(self._refill_seconds, capacity / rate)
+            if now >= self._next_sweep or len(self._buckets) >= self.max_keys:
+                self._sweep(now)
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def _sweep(self, now):
+        cutoff = now - self._refill_seconds
+        stale = [key for key, (_, updated_at) in self._buckets.items() if updated_at <= cutoff]
+        for key in stale:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            # Still full: forget the least recently touched half.
+            oldest = sorted(self._buckets, key=lambda k: self._buckets[k][1])
+            for key in oldest[:len(oldest) // 2]:
+                del self._buckets[key]
+                stale.append(key)
+        self._swept += len(stale)
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'max_keys': self.max_keys, 'swept': self._swept}
+
+
+# Refill and take a token in one round trip; returns 0 or the seconds to wait.
+_REDIS_ACQUIRE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets on a Redis-compatible server, shared by several servers.
+
+    Keys expire once their bucket would be full again, so Redis does the
+    sweeping. Requires the optional `redis` package.
+    """
+
+    blocking = True
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL, prefix='login-limit:'):
+        import redis  # Optional dependency, only needed for this backend.
+        self._client = redis.Redis.from_url(url)
+        self._acquire = self._client.register_script(_REDIS_ACQUIRE)
+        self._prefix = prefix
+
+    def acquire(self, key, capacity, rate):
+        return float(self._acquire(keys=[self._prefix + key], args=[capacity, rate, time.time()]))
+
+    def stats(self):
+        return {}
+
+
+class NullBuckets:
+    """Backend that allows everything."""
+
+    blocking = False
+
+    def acquire(self, key, capacity, rate):
+        return 0.0
+
+    def stats(self):
+        return {}
+
+
+class LoginRateLimiter:
+    """Per-email, per-peer and global token buckets for LoginUser.
+
+    `check(email, peer)` raises RateLimited when any bucket is empty, before
+    the caller spends a query or a bcrypt check on the attempt. The global
+    bucket is checked last so attempts rejected per email or peer don't use
+    up everyone else's share.
+    """
+
+    def __init__(self, buckets, per_email=LOGIN_LIMIT_PER_EMAIL, per_peer=LOGIN_LIMIT_PER_PEER,
+                 global_limit=LOGIN_LIMIT_GLOBAL):
+        self.buckets = buckets
+        self.limits = [
+            ('email', parse_limit(per_email)),
+            ('peer', parse_limit(per_peer)),
+            ('global', parse_limit(global_limit)),
+        ]
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._rejected = {scope: 0 for scope, _ in self.limits}
+
+    @property
+    def blocking(self):
+        return self.buckets.blocking
+
+    def check(self, email, peer):
+        keys = {'email': email.strip().lower(), 'peer': peer_address(peer or ''), 'global': ''}
+        for scope, limit in self.limits:
+            if limit is None:
+                continue
+            retry_after = self.buckets.acquire(f'{scope}:{keys[scope]}', *limit)
+            if retry_after:
+                with self._lock:
+                    self._rejected[scope] += 1
+                raise RateLimited(scope, retry_after)
+        with self._lock:
+            self._allowed += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {'allowed': self._allowed}
+            stats.update((f'rejected_{scope}', count) for scope, count in self._rejected.items())
+        stats.update(self.buckets.stats())
+        return stats
+
+
+def make_buckets(kind=LOGIN_RATE_LIMIT_BACKEND):
+    if kind == 'local':
+        return LocalBuckets()
+    if kind == 'redis':
+        return RedisBuckets()
+    if kind == 'none':
+        return NullBuckets()
+    raise ValueError(f"Unknown login rate limit backend '{kind}'.")
+
+
+_login_limiter = None
+_login_limiter_lock = threading.Lock()
+
+
+def get_login_limiter():
+    """Returns the process-wide login rate limiter, creating it on first use."""
+    global _login_limiter
+    if _login_limiter is None:
+        with _login_limiter_lock:
+            if _login_limiter is None:
+                _login_limiter = LoginRateLimiter(make_buckets())
+    return _login_limiter
@@ -0,0 +1,264 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent import futures
+
+from dotenv import load_dotenv
+
+from .migrations import Maintenance
+
+
+load_dotenv()
+
+# 'sqlite' stores users in one local file (USER_DB_PATH); 'postgres' in a
+# PostgreSQL database (DATABASE_URL) that several backend replicas can share.
+USER_DB_BACKEND = os.getenv('USER_DB_BACKEND', 'sqlite')
+
+
+class DuplicateUser(Exception):
+    """Raised when a username or email already belongs to another user."""
+
+
+class VersionConflict(Exception):
+    """Raised when a user changed since the version an update was based on."""
+
+
+class RefreshTokenReused(Exception):
+    """Raised when a refresh token that was already exchanged is presented again."""
+
+# Columns update_user() may change.
+UPDATABLE_COLUMNS = ('username', 'email')
+# search_users() ranks at most this many matches; pages past them are empty.
+MAX_SEARCH_RESULTS = 1000
+# Shorter queries only match the start of a username or email.
+MIN_SUBSTRING_QUERY = 3
+# event_type of the rows in the user_events outbox.
+USER_CREATED = 'created'
+USER_UPDATED = 'updated'
+
+
+class UserRepository:
+    """Storage interface for user records.
+
+    Records are mappings with 'id', 'username', 'email', 'hashed_password'
+    (bytes) and 'version'. Implementations are thread-safe and manage their own
+    connections; `size` is how many calls they can serve concurrently.
+    """
+
+    size = 1
+    _maintenance = None
+
+    def migrate(self):
+        """Brings the schema up to date."""
+        raise NotImplementedError
+
+    def build_indexes(self):
+        """Builds the online indexes and refreshes statistics; may take minutes on a big table."""
+        raise NotImplementedError
+
+    def optimize(self):
+        """Refreshes query planner statistics that have drifted."""
+
+    def start_maintenance(self):
+        """Builds the online indexes in the background and schedules optimize()."""
+        self._maintenance = Maintenance(self)
+        self._maintenance.start()
+
+    def insert_user(self, user_id, username, email, hashed_password):
+        """Inserts a new user and its USER_CREATED event, in one transaction.
+
+        Raises DuplicateUser if the username or email is taken.
+        """
+        raise NotImplementedError
+
+    def get_user_by_email(self, email):
+        """Returns the user with `email`, or None.
+
+        An exact match wins; otherwise the email is matched ignoring case,
+        as long as that finds exactly one user.
+        """
+        raise NotImplementedError
+
+    def get_user_by_id(self, user_id):
+        """Returns the user with `user_id`, or None."""
+        raise NotImplementedError
+
+    def get_users_by_ids(self, user_ids):
+        """Returns {id: record} for the users in `user_ids` that exist."""
+        raise NotImplementedError
+
+    def find_taken(self, usernames, emails):
+        """Returns (usernames, emails) from the given lists that already belong to a user."""
+        raise NotImplementedError
+
+    def update_user(self, user_id, changes, expected_version=None):
+        """Writes `changes` ({column: value}) to one user and increments its version.
+
+        Only the given columns are written, in one UPDATE that also checks
+        `expected_version` when it is given. Returns the updated record, or
+        None if there is no such user. Raises VersionConflict if the version
+        has moved on and DuplicateUser if the new username or email is taken.
+        A USER_UPDATED event is appended in the same transaction.
+        """
+        raise NotImplementedError
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        """Swaps a user's password hash for a re-hash of the same password.
+
+        Only writes if the stored hash is still `old_hash`, so a password
+        change in the meantime wins; returns whether it wrote. The version
+        is left alone, since the profile a client read hasn't changed, and
+        no event is appended.
+        """
+        raise NotImplementedError
+
+    def insert_users(self, rows):
+        """Inserts (id, username, email, hashed_password) rows in one transaction.
+
+        Rows that clash with an existing user are skipped; returns the set
+        of ids that were inserted. Each inserted user gets a USER_CREATED
+        event in the same transaction.
+        """
+        raise NotImplementedError
+
+    def list_users(self, after=None, limit=50):
+        """Returns up to `limit` users (id, username, email) ordered by (username, id).
+
+        `after` is the (username, id) of the last user already seen.
+        """
+        raise NotImplementedError
+
+    def count_users(self):
+        """Returns how many users there are."""
+        raise NotImplementedError
+
+    def search_users(self, query, limit, offset=0):
+        """Returns up to `limit` users (id, username, email) matching `query`, best first.
+
+        A query of MIN_SUBSTRING_QUERY characters or more matches anywhere in
+        the username or email, ignoring case; a shorter one matches the start
+        of either. Exact matches rank first, then username prefixes, then
+        email prefixes, then the rest. Only the first MAX_SEARCH_RESULTS
+        matches are ranked; `offset` skips into them.
+        """
+        raise NotImplementedError
+
+    def list_user_events(self, after, limit):
+        """Returns up to `limit` events with a sequence above `after`, in sequence order.
+
+        Events are mappings with 'sequence', 'event_type', 'user_id',
+        'username', 'email', 'version' and 'occurred_at' (Unix ms). Sequence
+        numbers increase in commit order, so reading on from the last one
+        seen never misses an event.
+        """
+        raise NotImplementedError
+
+    def get_user_event_range(self):
+        """Returns the (first, last) sequence numbers still stored, or (None, None)."""
+        raise NotImplementedError
+
+    def purge_user_events(self, before):
+        """Deletes events that occurred before `before` (Unix ms); returns how many went.
+
+        The latest event is always kept, so get_user_event_range() still
+        tells a consumer whether its cursor was purged.
+        """
+        raise NotImplementedError
+
+    def insert_refresh_token(self, token_hash, user_id, family_id, expires_at):
+        """Stores a new refresh token (by its digest), the first of `family_id` or the next."""
+        raise NotImplementedError
+
+    def rotate_refresh_token(self, old_hash, new_hash, now, expires_at, reuse_interval):
+        """Exchanges a refresh token for the next one in its family, in one transaction.
+
+        Returns the user id, or None if `old_hash` is unknown or expired.
+        A token already exchanged up to `reuse_interval` seconds ago is
+        exchanged again (two requests refreshing at once); later than that
+        it was copied, so its family is deleted and RefreshTokenReused raised.
+        Times are Unix seconds.
+        """
+        raise NotImplementedError
+
+    def delete_refresh_token_family(self, token_hash):
+        """Deletes the refresh token with `token_hash` and every other one of its family."""
+        raise NotImplementedError
+
+    def revoke_access_token(self, jti, expires_at):
+        """Records that the access token `jti` is revoked until `expires_at`."""
+        raise NotImplementedError
+
+    def list_revoked_tokens(self, now):
+        """Returns (jti, expires_at) rows for the revoked access tokens not yet expired."""
+        raise NotImplementedError
+
+    def purge_expired_tokens(self, now):
+        """Deletes expired refresh tokens and revocations; returns how many rows went."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns a snapshot of connection pool counters for monitoring."""
+        return {}
+
+    def close(self):
+        if self._maintenance is not None:
+            self._maintenance.stop()
+
+
+class AsyncUserRepository:
+    """Runs a UserRepository's blocking calls on a dedicated thread pool for asyncio callers.
+
+    `await users.get_user_by_id(user_id)` calls the wrapped repository's
+    method on one of the DB threads, so the event loop never blocks on the
+    database.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=repository.size, thread_name_prefix='db'
+        )
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context over so its DB time is attributed to the RPC.
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await loop.run_in_executor(self._executor, call)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self.repository, name)
+
+        async def call(*args):
+            return await self.run(method, *args)
+        return call
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def make_repository(kind=USER_DB_BACKEND):
+    if kind == 'sqlite':
+        from .database import SQLiteUserRepository
+        return SQLiteUserRepository()
+    if kind == 'postgres':
+        from .postgres import PostgresUserRepository
+        return PostgresUserRepository()
+    raise ValueError(f"Unknown user database backend '{kind}'.")
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """Returns the process-wide user repository, creating it on first use."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = make_repository()
+    return _repository
@@ -0,0 +1,4 @@
+-- Row version for optimistic concurrency: UpdateUserProfile only writes if
+-- the version is still the one the client read, then increments it. A
+-- constant default is stored in the catalog, so the table isn't rewritten.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
@@ -0,0 +1,21 @@
+-- Refresh tokens, kept only as SHA-256 digests: they are random, so a fast
+-- hash is enough, and a copy of the table can't be used to log in. Each
+-- login starts a family; a refresh marks its token used and adds the next
+-- one, and a used token presented again revokes the whole family.
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    token_hash BYTEA PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    family_id TEXT NOT NULL,
+    expires_at BIGINT NOT NULL,
+    used_at BIGINT
+);
+CREATE INDEX IF NOT EXISTS refresh_tokens_family ON refresh_tokens (family_id);
+CREATE INDEX IF NOT EXISTS refresh_tokens_expires_at ON refresh_tokens (expires_at);
+
+-- Access tokens revoked at logout, until they would have expired anyway.
+-- Every server keeps the live ones in memory.
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revoked_tokens_expires_at ON revoked_tokens (expires_at);
@@ -0,0 +1,15 @@
+-- Transactional outbox: every registration and profile change appends an
+-- event here in the same transaction as the write, and WatchUserEvents
+-- streams them in sequence order. Writers take an advisory lock before
+-- appending (see postgres.py), so events commit in sequence order and a
+-- reader never sees a later event before an earlier one.
+CREATE TABLE IF NOT EXISTS user_events (
+    sequence BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL,
+    version BIGINT NOT NULL,
+    occurred_at BIGINT NOT NULL -- Unix milliseconds.
+);
+CREATE INDEX IF NOT EXISTS user_events_occurred_at ON user_events (occurred_at);
@@ -0,0 +1,2 @@
+-- Serves LoginUser's case-insensitive fallback: WHERE lower(email) = lower(%s).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_email_lower ON users (lower(email));
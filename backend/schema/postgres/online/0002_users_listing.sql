@@ -0,0 +1,3 @@
+-- Lets the admin listing's keyset scan (ORDER BY username, id) run as an
+-- index-only scan.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_listing ON users (username, id) INCLUDE (email);
@@ -0,0 +1,3 @@
+-- Lets LoginUser's lookup by email run as an index-only scan instead of
+-- also visiting the heap for the rest of the record.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_covering ON users (email) INCLUDE (id, username, hashed_password, version);
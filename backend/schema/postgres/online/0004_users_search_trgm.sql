@@ -0,0 +1,6 @@
+-- Trigram indexes for SearchUsers' ILIKE '%...%' matches; pg_trgm ships
+-- with PostgreSQL's contrib modules. Without them searches still work, by
+-- scanning the table.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_username_trgm ON users USING gin (username gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_email_trgm ON users USING gin (email gin_trgm_ops);
@@ -0,0 +1,8 @@
+-- The original users table. IF NOT EXISTS lets databases created before
+-- migrations existed adopt version 1 as they are.
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL
+);
@@ -0,0 +1,4 @@
+-- Row version for optimistic concurrency: UpdateUserProfile only writes if
+-- the version is still the one the client read, then increments it. A
+-- constant default only changes the schema, so existing rows aren't rewritten.
+ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,35 @@
+-- Full-text index for SearchUsers. The trigram tokenizer matches any
+-- substring of at least three characters, ignoring case. The index is
+-- contentless (it stores no copy of the text), and each user gets an
+-- integer docid here, because users can be a WITHOUT ROWID table.
+CREATE TABLE users_search_docs (
+    docid INTEGER PRIMARY KEY,
+    user_id NOT NULL UNIQUE -- Untyped, like users.id: text, or 16 bytes in the compact layout.
+);
+CREATE VIRTUAL TABLE users_search USING fts5(username, email, content='', tokenize='trigram');
+
+-- Users that are already there are indexed in the background, a batch at
+-- a time, by backfill_search_index() in database.py, so a big table doesn't
+-- hold up startup. This row is its cursor (the last users.id done), and
+-- until the table is dropped SearchUsers scans users instead.
+CREATE TABLE users_search_backfill (last_id);
+INSERT INTO users_search_backfill (last_id) VALUES (NULL);
+
+-- A contentless index can only drop a row given the text it indexed,
+-- which is why the old values are passed to 'delete'.
+CREATE TRIGGER users_search_insert AFTER INSERT ON users BEGIN
+    INSERT INTO users_search_docs (user_id) VALUES (new.id);
+    INSERT INTO users_search (rowid, username, email)
+        SELECT docid, new.username, new.email FROM users_search_docs WHERE user_id = new.id;
+END;
+CREATE TRIGGER users_search_update AFTER UPDATE OF username, email ON users BEGIN
+    INSERT INTO users_search (users_search, rowid, username, email)
+        SELECT 'delete', docid, old.username, old.email FROM users_search_docs WHERE user_id = old.id;
+    INSERT INTO users_search (rowid, username, email)
+        SELECT docid, new.username, new.email FROM users_search_docs WHERE user_id = new.id;
+END;
+CREATE TRIGGER users_search_delete AFTER DELETE ON users BEGIN
+    INSERT INTO users_search (users_search, rowid, username, email)
+        SELECT 'delete', docid, old.username, old.email FROM users_search_docs WHERE user_id = old.id;
+    DELETE FROM users_search_docs WHERE user_id = old.id;
+END;
@@ -0,0 +1,15 @@
+-- Transactional outbox: every registration and profile change appends an
+-- event here in the same transaction as the write, and WatchUserEvents
+-- streams them in sequence order. AUTOINCREMENT keeps sequence numbers
+-- from being reused once old events are purged, so a consumer's cursor
+-- stays meaningful. user_id is the string id in either users layout.
+CREATE TABLE user_events (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    occurred_at INTEGER NOT NULL -- Unix milliseconds.
+);
+CREATE INDEX user_events_occurred_at ON user_events (occurred_at);
@@ -0,0 +1,3 @@
+-- Covers the admin listing's keyset scan (ORDER BY username, id) so pages
+-- are read from the index alone.
+CREATE INDEX IF NOT EXISTS users_listing ON users (username, id, email);
@@ -0,0 +1,3 @@
+-- Serves SearchUsers' case-insensitive prefix ranges for short queries, with
+-- users_email_lower: WHERE lower(username) >= lower(?) AND ...
+CREATE INDEX IF NOT EXISTS users_username_lower ON users (lower(username));
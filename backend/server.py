@@ -1,31 +1,345 @@
 import grpc
 from concurrent import futures
-import time
-import uuid
-import bcrypt
-import sqlite3
+import argparse
+import asyncio
+import hmac
+import json
+import logging
 import jwt
 import os
+import signal
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
 
 # Import the generated classes
 from generated import user_pb2
 from generated import user_pb2_grpc
 
-# Import our database initialization function
-from .database import init_db
+# Import the user repository, the hashing executor and JWT helpers
+from .database import encode_page_token, decode_page_token, encode_search_token, decode_search_token
+from .repository import (
+    MAX_SEARCH_RESULTS, UPDATABLE_COLUMNS, USER_CREATED, USER_UPDATED, DuplicateUser, VersionConflict,
+    get_repository,
+)
+from .hashing import HashingBusy, Rehasher, get_hasher
+from .ids import new_user_id
+from .cache import MISSING, get_user_cache
+from .ratelimit import RateLimited, get_login_limiter
+from .bulk import BulkRegistration, batches
+from .precheck import get_registration_index
+from .sessions import get_session_store
+from .events import CursorOutOfRange, get_event_feed, get_user_cache_sync
+from .auth import (
+    ACCESS_TOKEN_LIFETIME, JWKS_PATH, TokenRevoked, create_token, token_from_metadata, decode_token,
+    get_token_service, reload_keys,
+)
+from .logs import configure_logging, request_log
+from .metrics import REGISTRY, METRICS_HOST, METRICS_PORT, MetricsInterceptor, add_route, start_metrics_server
 
 
 load_dotenv()
 
+# Not __name__: this module usually runs as __main__.
+logger = logging.getLogger('backend.server')
+
+PORT = os.getenv('GRPC_PORT', '50051')
+# The database connection pool defaults to the same size (see backend/pool.py).
+MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', '10'))
+# 'sync' runs the thread-pool server below, 'async' the grpc.aio server.
+SERVER_MODE = os.getenv('GRPC_SERVER_MODE', 'sync')
+# Processes serving the port; more than one pre-forks workers (backend/prefork.py).
+GRPC_PROCESSES = int(os.getenv('GRPC_PROCESSES', '1'))
+# Seconds in-flight RPCs get to finish after SIGTERM before they're cancelled.
+GRPC_GRACE_PERIOD = float(os.getenv('GRPC_GRACE_PERIOD', '10'))
+# Bearer token that BulkRegisterUsers callers (backend/import_users.py) must
+# present; bulk registration is refused while it is unset.
+BULK_IMPORT_TOKEN = os.getenv('BULK_IMPORT_TOKEN')
+# Bearer token for WatchUserEvents, the change feed of every user for
+# downstream systems; end users' JWTs are not accepted there.
+USER_EVENTS_TOKEN = os.getenv('USER_EVENTS_TOKEN')
+# Bearer token for BatchGetUsers, which resolves any ids for services fanning
+# out over many users; end users' JWTs are not accepted there.
+USER_LOOKUP_TOKEN = os.getenv('USER_LOOKUP_TOKEN')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# Rows read per query while streaming; the connection is released in between.
+STREAM_BATCH_SIZE = 500
+MAX_BATCH_GET_IDS = 1000
+MAX_SEARCH_QUERY_LENGTH = 100
+
+# Accept the keepalive pings frontend/client.py sends every 30s, idle
+# connections included; with gRPC's defaults (one ping per 5 minutes, none
+# without calls) the server would answer them with GOAWAY too_many_pings.
+KEEPALIVE_OPTIONS = [
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_ping_interval_without_data_ms', 10000),
+    ('grpc.http2.max_ping_strikes', 5),
+]
+
+
+def server_options(reuse_port):
+    # gRPC turns SO_REUSEPORT on by default; only pre-fork workers should share the port.
+    return [('grpc.so_reuseport', int(reuse_port)), *KEEPALIVE_OPTIONS]
+
+
+def authenticate(context):
+    """Returns the caller's JWT claims, or None after setting UNAUTHENTICATED on `context`."""
+    token = token_from_metadata(context.invocation_metadata())
+
+    if not token:
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Missing authentication token")
+        return None
+
+    try:
+        return decode_token(token)
+    except jwt.ExpiredSignatureError:
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Token has expired. Please log in again.")
+    except TokenRevoked:
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Token has been revoked. Please log in again.")
+    except jwt.InvalidTokenError:
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Invalid token. Please log in again.")
+    return None
+
+
+def authenticate_service(context, expected, setting):
+    """Returns True if the caller presented the service token `expected`, else sets an error on `context`.
+
+    `setting` names the variable the token comes from; while it is unset
+    the RPC is refused.
+    """
+    if not expected:
+        context.set_code(grpc.StatusCode.PERMISSION_DENIED)
+        context.set_details(f"Disabled on this server; set {setting} to enable it.")
+        return False
+    token = token_from_metadata(context.invocation_metadata())
+    if not token or not hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+        context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+        context.set_details("Missing or invalid service token")
+        return False
+    return True
+
+
+def login_response(user_record, refresh_token):
+    """Builds a LoginUserResponse with a new access token for `user_record`."""
+    return user_pb2.LoginUserResponse(
+        token=create_token(user_record['id'], user_record['username']),
+        refresh_token=refresh_token,
+        expires_in=int(ACCESS_TOKEN_LIFETIME.total_seconds())
+    )
+
+
+def logout_claims(context):
+    """Returns the claims of the access token to revoke at logout, or None."""
+    token = token_from_metadata(context.invocation_metadata())
+    if not token:
+        return None
+    try:
+        return decode_token(token)
+    except jwt.InvalidTokenError:
+        # Expired, already revoked or not ours: nothing left to revoke.
+        return None
+
+
+def refresh_failed(context):
+    context.set_code(grpc.StatusCode.UNAUTHENTICATED)
+    context.set_details("Invalid or expired refresh token. Please log in again.")
+    return user_pb2.LoginUserResponse()
+
+
+def user_message(user_record):
+    user = user_pb2.User(
+        id=user_record['id'],
+        username=user_record['username'],
+        email=user_record['email']
+    )
+    # Listings don't read the version.
+    if 'version' in user_record.keys():
+        user.version = user_record['version']
+    return user
+
+
+def parse_update_request(request, claims, context):
+    """Validates an UpdateUserProfileRequest from the user in `claims`.
+
+    Returns (changes, expected_version) or None after setting an error code.
+    """
+    if request.user_id and request.user_id != claims['user_id']:
+        context.set_code(grpc.StatusCode.PERMISSION_DENIED)
+        context.set_details("You can only update your own profile.")
+        return None
+    paths = list(request.update_mask.paths) or [
+        field for field in UPDATABLE_COLUMNS if getattr(request, field)
+    ]
+    unknown = sorted(set(paths) - set(UPDATABLE_COLUMNS))
+    if unknown:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(f"Cannot update: {', '.join(unknown)}.")
+        return None
+    changes = {field: getattr(request, field) for field in paths}
+    if not changes or not all(changes.values()):
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details("Nothing to update; username and email can't be empty.")
+        return None
+    return changes, request.version or None
+
+
+def update_failed(error, context):
+    """Sets the status for an update that raised DuplicateUser or VersionConflict."""
+    if isinstance(error, DuplicateUser):
+        context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+        context.set_details("User with this username or email already exists.")
+    else:
+        context.set_code(grpc.StatusCode.ABORTED)
+        context.set_details("The profile was changed by another request. Reload it and try again.")
+    return user_pb2.UserResponse()
+
+
+def parse_list_request(request, context):
+    """Validates a ListUsersRequest.
+
+    Returns (page_size, after) or None after setting INVALID_ARGUMENT.
+    """
+    if request.page_size < 0:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details("page_size must not be negative.")
+        return None
+    try:
+        after = decode_page_token(request.page_token)
+    except ValueError as e:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(str(e))
+        return None
+    return request.page_size, after
+
+
+def parse_search_request(request, context):
+    """Validates a SearchUsersRequest.
+
+    Returns (query, page_size, offset) or None after setting INVALID_ARGUMENT.
+    """
+    query = request.query.strip()
+    if not query or len(query) > MAX_SEARCH_QUERY_LENGTH:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(f"query must be 1 to {MAX_SEARCH_QUERY_LENGTH} characters.")
+        return None
+    if request.page_size < 0:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details("page_size must not be negative.")
+        return None
+    try:
+        offset = decode_search_token(request.page_token, query)
+    except ValueError as e:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(str(e))
+        return None
+    page_size = min(request.page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    # Only the first MAX_SEARCH_RESULTS matches are ranked.
+    return query, max(0, min(page_size, MAX_SEARCH_RESULTS - offset)), offset
+
+
+def search_page(rows, query, page_size, offset):
+    """Builds a ListUsersResponse from up to page_size + 1 search results."""
+    has_more = len(rows) > page_size and offset + page_size < MAX_SEARCH_RESULTS
+    return user_pb2.ListUsersResponse(
+        users=[user_message(row) for row in rows[:page_size]],
+        next_page_token=encode_search_token(query, offset + page_size) if has_more else ''
+    )
+
+
+EVENT_TYPES = {
+    USER_CREATED: user_pb2.UserEvent.CREATED,
+    USER_UPDATED: user_pb2.UserEvent.UPDATED,
+}
+
+
+def user_event_message(event):
+    return user_pb2.UserEvent(
+        sequence=event['sequence'],
+        type=EVENT_TYPES[event['event_type']],
+        user=user_pb2.User(id=event['user_id'], username=event['username'], email=event['email'],
+                           version=event['version']),
+        occurred_at=event['occurred_at']
+    )
+
+
+def parse_watch_request(request, context):
+    """Validates a WatchUserEventsRequest; returns the batch size, or None after INVALID_ARGUMENT."""
+    if request.after_sequence < 0 or request.batch_size < 0:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details("after_sequence and batch_size must not be negative.")
+        return None
+    return min(request.batch_size or STREAM_BATCH_SIZE, MAX_PAGE_SIZE)
+
+
+def watch_refused(context):
+    context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    context.set_details("Too many event streams are open; retry later.")
+
+
+def cursor_out_of_range(error, context):
+    context.set_code(grpc.StatusCode.OUT_OF_RANGE)
+    context.set_details(str(error))
+
+
+def batch_get_response(user_ids, records):
+    """Builds a BatchGetUsersResponse in request order from {id: record or None}."""
+    results = []
+    for user_id in user_ids:
+        user_record = records.get(user_id)
+        if user_record:
+            results.append(user_pb2.UserLookup(user_id=user_id, found=True,
+                                               user=user_message(user_record)))
+        else:
+            results.append(user_pb2.UserLookup(user_id=user_id, found=False))
+    return user_pb2.BatchGetUsersResponse(results=results)
+
+
+def users_page(rows, page_size):
+    """Builds a ListUsersResponse from up to page_size + 1 rows."""
+    # The extra row only tells us whether another page exists.
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return user_pb2.ListUsersResponse(
+        users=[user_message(row) for row in rows],
+        next_page_token=encode_page_token(rows[-1]) if has_more else ''
+    )
+
 
 # Create a class to define the server functions, derived from
 # user_pb2_grpc.UserServiceServicer
 class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
 
+    def __init__(self, users=None, hasher=None, cache=None, limiter=None, taken=None, sessions=None,
+                 events=None):
+        self.users = users or get_repository()
+        self.hasher = hasher or get_hasher()
+        self.cache = cache or get_user_cache()
+        self.limiter = limiter or get_login_limiter()
+        self.taken = taken or get_registration_index()
+        self.sessions = sessions or get_session_store()
+        self.events = events or get_event_feed()
+        self.rehasher = Rehasher(self.hasher, self.users, self.cache)
+
+    def _find_user_by_id(self, user_id):
+        user_record = self.cache.get_by_id(user_id)
+        if user_record is MISSING:
+            user_record = self.users.get_user_by_id(user_id)
+            self.cache.put_id(user_id, user_record)
+        return user_record
+
+    def _find_user_by_email(self, email):
+        user_record = self.cache.get_by_email(email)
+        if user_record is MISSING:
+            user_record = self.users.get_user_by_email(email)
+            self.cache.put_email(email, user_record)
+        return user_record
+
     def RegisterUser(self, request, context):
-        print("RegisterUser request received")
+        request_log.debug("RegisterUser request received")
         username = request.username
         email = request.email
         password = request.password
@@ -35,131 +349,324 @@ class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
             context.set_details("All fields (username, email, password) are required.")
             return user_pb2.UserResponse()
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        # Turn a likely duplicate away before paying for bcrypt.
+        if self.taken.might_be_taken(username, email) and self.taken.confirmed(
+                self.users.find_taken([username], [email])):
+            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+            context.set_details("User with this username or email already exists.")
+            return user_pb2.UserResponse()
+
+        try:
+            hashed_password = self.hasher.hash_password(password.encode('utf-8'))
+        except HashingBusy as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.UserResponse()
 
         try:
-            user_id = str(uuid.uuid4())
-            cursor.execute(
-                "INSERT INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, ?)",
-                (user_id, username, email, hashed_password)
-            )
-            conn.commit()
-            print(f"User {username} created with ID {user_id}")
+            user_id = new_user_id()
+            self.users.insert_user(user_id, username, email, hashed_password)
+            self.taken.add(username, email)
+            # Overwrites any cached "not found" for this email.
+            self.cache.put_id(user_id, {'id': user_id, 'username': username, 'email': email,
+                                        'hashed_password': hashed_password, 'version': 1})
+            request_log.info("User %s created with ID %s", username, user_id)
 
-            user_message = user_pb2.User(id=user_id, username=username, email=email)
+            user_message = user_pb2.User(id=user_id, username=username, email=email, version=1)
             return user_pb2.UserResponse(user=user_message)
-        except sqlite3.IntegrityError:
+        except DuplicateUser:
             context.set_code(grpc.StatusCode.ALREADY_EXISTS)
             context.set_details("User with this username or email already exists.")
             return user_pb2.UserResponse()
-        finally:
-            conn.close()
+
+    def BulkRegisterUsers(self, request_iterator, context):
+        request_log.debug("BulkRegisterUsers request received")
+        if not authenticate_service(context, BULK_IMPORT_TOKEN, 'BULK_IMPORT_TOKEN'):
+            return user_pb2.BulkRegisterUsersResponse()
+        bulk = BulkRegistration(self.users, self.hasher, self.cache, self.taken)
+        for batch in batches(request_iterator):
+            bulk.add_batch(batch)
+        logger.info("Bulk registration created %d of %d users", bulk.created, len(bulk.results))
+        return bulk.response()
 
     def LoginUser(self, request, context):
-        print("LoginUser request received")
+        request_log.debug("LoginUser request received")
         email = request.email
         password = request.password.encode('utf-8')
 
-        conn = sqlite3.connect('users.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user_record = cursor.fetchone()
-        conn.close()
-
-        if user_record and bcrypt.checkpw(password, user_record['hashed_password']):
-            print(f"User {user_record['username']} logged in successfully.")
-            
-            payload = {
-                'user_id': user_record['id'],
-                'username': user_record['username'],
-                'exp': datetime.utcnow() + timedelta(hours=24),
-                'iat': datetime.utcnow()
-            }
-            
-            secret_key = os.getenv('JWT_SECRET_KEY')
-            encoded_token = jwt.encode(payload, secret_key, algorithm='HS256')
-            
-            return user_pb2.LoginUserResponse(token=encoded_token)
-
-        print("Invalid login attempt")
+        # Throttle before the lookup and the bcrypt check an attacker wants us to pay for.
+        try:
+            self.limiter.check(email, context.peer())
+        except RateLimited as e:
+            request_log.info("Login attempt rejected by the %s rate limit", e.scope)
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.LoginUserResponse()
+
+        user_record = self._find_user_by_email(email)
+
+        try:
+            password_ok = user_record is not None and self.hasher.check_password(
+                password, user_record['hashed_password']
+            )
+        except HashingBusy as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return user_pb2.LoginUserResponse()
+
+        if password_ok:
+            request_log.info("User %s logged in successfully.", user_record['username'])
+            self.rehasher.after_login(user_record, password)
+            return login_response(user_record, self.sessions.issue(user_record['id']))
+
+        request_log.info("Invalid login attempt")
         context.set_code(grpc.StatusCode.UNAUTHENTICATED)
         context.set_details("Invalid email or password")
         return user_pb2.LoginUserResponse()
 
-    def GetUser(self, request, context):
-        metadata = dict(context.invocation_metadata())
-        auth_header = metadata.get('authorization', None)
+    def RefreshToken(self, request, context):
+        request_log.debug("RefreshToken request received")
+        # No password and no bcrypt: the refresh token is the credential.
+        rotated = self.sessions.rotate(request.refresh_token) if request.refresh_token else None
+        if rotated is None:
+            return refresh_failed(context)
+        user_id, refresh_token = rotated
+        user_record = self._find_user_by_id(user_id)
+        if user_record is None:
+            return refresh_failed(context)
+        return login_response(user_record, refresh_token)
 
-        if not auth_header:
-            context.set_code(grpc.StatusCode.UNAUTHENTICATED)
-            context.set_details("Missing authentication token")
-            return user_pb2.UserResponse()
+    def Logout(self, request, context):
+        request_log.debug("Logout request received")
+        self.sessions.logout(logout_claims(context), request.refresh_token)
+        return user_pb2.LogoutResponse()
 
-        token = auth_header.replace('Bearer ', '')
-        
-        try:
-            secret_key = os.getenv('JWT_SECRET_KEY')
-            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            user_id = payload['user_id']
-        except jwt.ExpiredSignatureError:
-            context.set_code(grpc.StatusCode.UNAUTHENTICATED)
-            context.set_details("Token has expired. Please log in again.")
-            return user_pb2.UserResponse()
-        except jwt.InvalidTokenError:
-            context.set_code(grpc.StatusCode.UNAUTHENTICATED)
-            context.set_details("Invalid token. Please log in again.")
+    def GetUser(self, request, context):
+        payload = authenticate(context)
+        if payload is None:
             return user_pb2.UserResponse()
+        user_id = payload['user_id']
 
-        print(f"GetUser request received for user_id from token: {user_id}")
-        conn = sqlite3.connect('users.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id, username, email FROM users WHERE id = ?", (user_id,))
-        user_record = cursor.fetchone()
-        conn.close()
+        request_log.debug("GetUser request received for user_id from token: %s", user_id)
+        user_record = self._find_user_by_id(user_id)
 
         if user_record:
-            user_message = user_pb2.User(
-                id=user_record['id'],
-                username=user_record['username'],
-                email=user_record['email']
-            )
-            return user_pb2.UserResponse(user=user_message)
+            return user_pb2.UserResponse(user=user_message(user_record))
         else:
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details("User not found")
             return user_pb2.UserResponse()
 
     def UpdateUserProfile(self, request, context):
-        # Placeholder for future implementation
-        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details('Method not implemented!')
-        raise NotImplementedError('Method not implemented!')
+        claims = authenticate(context)
+        if claims is None:
+            return user_pb2.UserResponse()
+        parsed = parse_update_request(request, claims, context)
+        if parsed is None:
+            return user_pb2.UserResponse()
+        changes, expected_version = parsed
+        user_id = claims['user_id']
+
+        # No read first: the UPDATE checks the version, and the unique
+        # indexes reject a taken username or email.
+        try:
+            user_record = self.users.update_user(user_id, changes, expected_version)
+        except (DuplicateUser, VersionConflict) as e:
+            return update_failed(e, context)
+        if user_record is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details("User not found")
+            return user_pb2.UserResponse()
+
+        # The fresh record also makes a cached lookup by the old email miss.
+        self.cache.put_id(user_id, user_record)
+        self.taken.add(user_record['username'], user_record['email'])
+        request_log.info("User %s updated %s", user_id, ', '.join(changes))
+        return user_pb2.UserResponse(user=user_message(user_record))
+
+    def BatchGetUsers(self, request, context):
+        if not authenticate_service(context, USER_LOOKUP_TOKEN, 'USER_LOOKUP_TOKEN'):
+            return user_pb2.BatchGetUsersResponse()
+        if len(request.user_ids) > MAX_BATCH_GET_IDS:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"At most {MAX_BATCH_GET_IDS} user IDs per request.")
+            return user_pb2.BatchGetUsersResponse()
+
+        # Serve what we can from the cache, then fetch the rest in one go.
+        records, missing = self.cache.get_many(dict.fromkeys(request.user_ids))
+        if missing:
+            found = self.users.get_users_by_ids(missing)
+            self.cache.put_many(missing, found)
+            records.update(found)
+        return batch_get_response(request.user_ids, records)
 
     def ListAllUsers(self, request, context):
-        # Placeholder for future implementation
-        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details('Method not implemented!')
-        raise NotImplementedError('Method not implemented!')
-
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    user_pb2_grpc.add_UserServiceServicer_to_server(UserServiceServicer(), server)
-    port = "50051"
-    server.add_insecure_port(f"[::]:{port}")
+        # Kept for old clients; returning the whole table in one message
+        # doesn't scale, so this is just the first page of ListUsers.
+        return self.ListUsers(user_pb2.ListUsersRequest(), context)
+
+    def ListUsers(self, request, context):
+        if authenticate(context) is None:
+            return user_pb2.ListUsersResponse()
+        parsed = parse_list_request(request, context)
+        if parsed is None:
+            return user_pb2.ListUsersResponse()
+        page_size, after = parsed
+        page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+        rows = self.users.list_users(after, page_size + 1)
+        return users_page(rows, page_size)
+
+    def SearchUsers(self, request, context):
+        if authenticate(context) is None:
+            return user_pb2.ListUsersResponse()
+        parsed = parse_search_request(request, context)
+        if parsed is None:
+            return user_pb2.ListUsersResponse()
+        query, page_size, offset = parsed
+
+        rows = self.users.search_users(query, page_size + 1, offset) if page_size else []
+        return search_page(rows, query, page_size, offset)
+
+    def StreamUsers(self, request, context):
+        if authenticate(context) is None:
+            return
+        parsed = parse_list_request(request, context)
+        if parsed is None:
+            return
+        limit, after = parsed
+
+        # Read in keyset batches so memory stays bounded and no connection
+        # (or read snapshot) is held while a slow client drains the stream.
+        sent = 0
+        while context.is_active():
+            batch_size = STREAM_BATCH_SIZE if not limit else min(STREAM_BATCH_SIZE, limit - sent)
+            rows = self.users.list_users(after, batch_size)
+            for row in rows:
+                yield user_message(row)
+            sent += len(rows)
+            if len(rows) < batch_size or (limit and sent >= limit):
+                return
+            after = (rows[-1]['username'], rows[-1]['id'])
+
+    def WatchUserEvents(self, request, context):
+        if not authenticate_service(context, USER_EVENTS_TOKEN, 'USER_EVENTS_TOKEN'):
+            return
+        batch_size = parse_watch_request(request, context)
+        if batch_size is None:
+            return
+        if not self.events.acquire():
+            watch_refused(context)
+            return
+        # Not a finally: once the client cancels, gRPC stops resuming this
+        # generator, but the callback still runs when the RPC ends.
+        context.add_callback(self.events.release)
+        try:
+            after = self.events.start_after(request.after_sequence, request.from_latest,
+                                            self.users.get_user_event_range())
+        except CursorOutOfRange as e:
+            cursor_out_of_range(e, context)
+            return
+
+        # The next batch is only read once gRPC has sent the last one, and a
+        # yield blocks while the client's flow-control window is full, so a
+        # slow consumer slows down its own reads instead of events piling up
+        # in memory here.
+        while context.is_active() and not self.events.stopping:
+            rows = self.users.list_user_events(after, batch_size)
+            for row in rows:
+                yield user_event_message(row)
+            if rows:
+                after = rows[-1]['sequence']
+                self.events.sent(len(rows))
+            if len(rows) < batch_size and self.events.wait():
+                return
+
+def serve(reuse_port=False):
+    """Runs the thread-pool server until SIGTERM or SIGINT, then drains it."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_WORKERS),
+                         interceptors=[MetricsInterceptor()],
+                         options=server_options(reuse_port))
+    servicer = UserServiceServicer()
+    user_pb2_grpc.add_UserServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"[::]:{PORT}")
+    get_hasher().warm_up()
+    get_hasher().calibrate()
+    REGISTRY.register_collector('rehash', servicer.rehasher.stats)
+
+    def drain(signum, frame):
+        logger.info("Draining: in-flight RPCs get %ss to finish.", GRPC_GRACE_PERIOD)
+        # Event streams never finish on their own; end them so clients resume elsewhere.
+        get_event_feed().stop()
+        # New RPCs are refused from here on; wait_for_termination() returns once they're done.
+        server.stop(GRPC_GRACE_PERIOD)
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
     server.start()
-    print(f"gRPC server started, listening on port {port}.")
-    try:
-        while True:
-            time.sleep(86400)
-    except KeyboardInterrupt:
-        server.stop(0)
+    logger.info("gRPC server started, listening on port %s.", PORT)
+    server.wait_for_termination()
+    get_registration_index().stop()
+    get_session_store().stop()
+    get_event_feed().stop()
+    get_user_cache_sync().stop()
+    servicer.rehasher.shutdown()
+    get_hasher().shutdown()
+    get_repository().close()
+    logger.info("gRPC server stopped.")
+
+def run_process(mode, reuse_port=False, metrics_port=METRICS_PORT):
+    """Serves from this process until it is told to stop: everything below the shared setup."""
+    # Reads every username and email; registrations are checked in the database until it's done.
+    get_registration_index().start()
+    # Load the JWT keys once up front; `kill -HUP` reloads them after a rotation.
+    get_token_service()
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_keys)
+    # Loads the logouts other processes made, then keeps up with them.
+    get_session_store().start()
+    # Deletes outbox events past their retention.
+    get_event_feed().start()
+    # Drops users other workers and replicas changed from the local user cache.
+    get_user_cache_sync().start()
+
+    REGISTRY.register_collector('db_pool', get_repository().stats)
+    REGISTRY.register_collector('hashing', get_hasher().stats)
+    REGISTRY.register_collector('user_cache', get_user_cache().stats)
+    REGISTRY.register_collector('jwt_cache', get_token_service().stats)
+    REGISTRY.register_collector('login_rate_limit', get_login_limiter().stats)
+    REGISTRY.register_collector('registration_index', get_registration_index().stats)
+    REGISTRY.register_collector('sessions', get_session_store().stats)
+    REGISTRY.register_collector('user_events', get_event_feed().stats)
+    REGISTRY.register_collector('user_cache_sync', get_user_cache_sync().stats)
+    # Public keys for services verifying RS256/EdDSA tokens themselves.
+    add_route(JWKS_PATH, 'application/json', lambda: json.dumps(get_token_service().jwks()))
+    if start_metrics_server(port=metrics_port):
+        logger.info("Metrics available on http://%s:%s/metrics.", METRICS_HOST, metrics_port)
+    if mode == 'async':
+        from .aio_server import serve_async
+        asyncio.run(serve_async(reuse_port))
+    else:
+        serve(reuse_port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the UserService gRPC server.")
+    parser.add_argument('--mode', choices=('sync', 'async'), default=SERVER_MODE,
+                        help="thread-pool server or grpc.aio server (default: $GRPC_SERVER_MODE or sync)")
+    parser.add_argument('--processes', type=int, default=GRPC_PROCESSES,
+                        help="worker processes sharing the port (default: $GRPC_PROCESSES or 1)")
+    args = parser.parse_args()
+
+    configure_logging()
+    get_repository().migrate()
+    # Index builds run once the server is up; they can take a while on a big table.
+    get_repository().start_maintenance()
+    if args.processes > 1:
+        from .prefork import Supervisor
+        Supervisor(args.processes, args.mode).run()
+        get_repository().close()
+    else:
+        run_process(args.mode)
 
 if __name__ == '__main__':
-    init_db()
-    serve()
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from .repository import RefreshTokenReused
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds a refresh token stays valid; each refresh starts the clock again,
+# so this is how long a user may be idle before logging in again.
+REFRESH_TOKEN_TTL = float(os.getenv('REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+# Seconds an exchanged refresh token may still be exchanged again, for two
+# requests that refreshed at once. Past that, a replay revokes the family.
+REFRESH_TOKEN_REUSE_INTERVAL = float(os.getenv('REFRESH_TOKEN_REUSE_INTERVAL', '10'))
+# Seconds between reads of the revocations other processes and replicas made.
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', '5'))
+
+# Seconds between deletions of expired refresh tokens and revocations.
+TOKEN_PURGE_INTERVAL = 3600
+
+
+def hash_refresh_token(refresh_token):
+    return hashlib.sha256(refresh_token.encode('utf-8')).digest()
+
+
+class SessionStore:
+    """Refresh tokens and logouts, kept in the database every server shares.
+
+    issue() starts a family of refresh tokens at login and rotate() swaps
+    one for the next, so renewing an access token costs two small writes
+    instead of a bcrypt check. logout() deletes the family and revokes the
+    access token: in `revoked` (the TokenService's list) at once, and in
+    the database, which a background thread reads every
+    REVOCATION_SYNC_INTERVAL seconds so the other processes catch up.
+    """
+
+    def __init__(self, users, revoked, ttl=REFRESH_TOKEN_TTL,
+                 reuse_interval=REFRESH_TOKEN_REUSE_INTERVAL, interval=REVOCATION_SYNC_INTERVAL):
+        self.users = users
+        self.revoked = revoked
+        self.ttl = ttl
+        self.reuse_interval = reuse_interval
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._issued = 0
+        self._rotated = 0
+        self._rejected = 0
+        self._replays = 0
+        self._logouts = 0
+        self._syncs = 0
+        self._purged = 0
+
+    def start(self):
+        """Reads the revocations now, then keeps them current from a background thread."""
+        self._thread = threading.Thread(target=self._run, name='revocations', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        purge_at = 0.0
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+                if time.monotonic() >= purge_at:
+                    purged = self.users.purge_expired_tokens(int(time.time()))
+                    purge_at = time.monotonic() + TOKEN_PURGE_INTERVAL
+                    with self._lock:
+                        self._purged += purged
+            except Exception:
+                # Logouts made here still apply; others arrive on a later pass.
+                logger.exception("Reading revoked tokens failed.")
+            self._stopping.wait(self.interval)
+
+    def stop(self):
+        self._stopping.set()
+
+    def sync(self):
+        """Adds the unexpired revocations in the database to the in-memory list."""
+        for row in self.users.list_revoked_tokens(int(time.time())):
+            self.revoked.add(row['jti'], row['expires_at'])
+        self.revoked.prune()
+        with self._lock:
+            self._syncs += 1
+
+    def issue(self, user_id):
+        """Returns a new refresh token for `user_id`, the first of a new family."""
+        refresh_token = secrets.token_urlsafe(32)
+        self.users.insert_refresh_token(hash_refresh_token(refresh_token), user_id,
+                                        uuid.uuid4().hex, int(time.time() + self.ttl))
+        with self._lock:
+            self._issued += 1
+        return refresh_token
+
+    def rotate(self, refresh_token):
+        """Exchanges `refresh_token` for the next one.
+
+        Returns (user_id, new refresh token), or None if the token is
+        unknown, expired, or a replay (which also logs the family out).
+        """
+        new_token = secrets.token_urlsafe(32)
+        now = time.time()
+        try:
+            user_id = self.users.rotate_refresh_token(
+                hash_refresh_token(refresh_token), hash_refresh_token(new_token),
+                int(now), int(now + self.ttl), self.reuse_interval
+            )
+        except RefreshTokenReused as e:
+            logger.warning("%s Its sessions were logged out.", e)
+            with self._lock:
+                self._replays += 1
+            return None
+        with self._lock:
+            if user_id is None:
+                self._rejected += 1
+            else:
+                self._rotated += 1
+        return (user_id, new_token) if user_id is not None else None
+
+    def logout(self, claims=None, refresh_token=None):
+        """Revokes the access token with `claims` and the family of `refresh_token`, either optional."""
+        if claims is not None and claims.get('jti'):
+            self.revoked.add(claims['jti'], claims['exp'])
+            self.users.revoke_access_token(claims['jti'], claims['exp'])
+        if refresh_token:
+            self.users.delete_refresh_token_family(hash_refresh_token(refresh_token))
+        with self._lock:
+            self._logouts += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'refresh_tokens_issued': self._issued,
+                'refresh_tokens_rotated': self._rotated,
+                'refresh_tokens_rejected': self._rejected,
+                'refresh_token_replays': self._replays,
+                'logouts': self._logouts,
+                'revocation_syncs': self._syncs,
+                'tokens_purged': self._purged,
+            }
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Returns the process-wide SessionStore, sharing the TokenService's revocation list."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                from .auth import get_token_service
+                from .repository import get_repository
+                _session_store = SessionStore(get_repository(), get_token_service().revoked)
+    return _session_store
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import bcrypt
+
+from backend.database import SQLiteUserRepository, init_db
+from backend.ids import new_user_id
+from backend.migrations import build_indexes_sqlite
+from backend.pool import ConnectionPool
+
+from benchmarks.loadtest import SEED_PASSWORD, parse_rows, percentile
+
+
+# Layout name -> covering_index argument for compact(); None is the default text layout.
+LAYOUTS = {'text': None, 'compact': False, 'compact_covering': True}
+
+
+def seed(pool, rows, batch_size=10000):
+    """Inserts `rows` users with time-ordered ids; returns their (id, email) pairs."""
+    hashed_password = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt())
+    users = []
+    with pool.connection() as conn:
+        for start in range(0, rows, batch_size):
+            batch = [(new_user_id(), f'seed{i}', f'seed{i}@example.com', hashed_password)
+                     for i in range(start, min(rows, start + batch_size))]
+            conn.executemany(
+                "INSERT INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, ?)", batch)
+            conn.commit()
+            users.extend((user_id, email) for user_id, _, email, _ in batch)
+        build_indexes_sqlite(conn)
+        conn.execute("VACUUM")
+    return users
+
+
+def file_size(db_path):
+    return sum(os.path.getsize(db_path + suffix)
+               for suffix in ('', '-wal') if os.path.exists(db_path + suffix))
+
+
+def table_sizes(pool):
+    """Returns {table or index: bytes}, or None if SQLite was built without dbstat."""
+    with pool.connection() as conn:
+        try:
+            rows = conn.execute(
+                "SELECT name, SUM(pgsize) AS size FROM dbstat GROUP BY name ORDER BY name"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return None
+    return {row['name']: row['size'] for row in rows}
+
+
+def time_calls(fn, args):
+    latencies = []
+    for arg in args:
+        started = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        'count': len(latencies),
+        'mean_us': 1e6 * sum(latencies) / len(latencies),
+        'p50_us': 1e6 * percentile(latencies, 50),
+        'p99_us': 1e6 * percentile(latencies, 99),
+    }
+
+
+def measure(db_path, users, lookups, inserts):
+    pool = ConnectionPool(database=db_path, size=1)
+    repository = SQLiteUserRepository(pool)
+    try:
+        result = {
+            'compact_ids': repository.compact_ids,
+            'email_covering': repository.email_covering,
+            'db_bytes': file_size(db_path),
+            'objects': table_sizes(pool),
+        }
+        rng = random.Random(len(users))
+        sample = [rng.choice(users) for _ in range(lookups)]
+        result['get_user_by_email'] = time_calls(repository.get_user_by_email,
+                                                 [email for _, email in sample])
+        result['get_user_by_id'] = time_calls(repository.get_user_by_id,
+                                              [user_id for user_id, _ in sample])
+        hashed_password = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt(4))
+        result['insert_user'] = time_calls(
+            lambda i: repository.insert_user(new_user_id(), f'new{i}', f'new{i}@example.com',
+                                             hashed_password),
+            range(inserts))
+    finally:
+        pool.close()
+    return result
+
+
+def run_size(args, rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {name: os.path.join(tmp, f'{name}.db') for name in LAYOUTS}
+        pool = ConnectionPool(database=paths['text'], size=1)
+        init_db(pool)
+        users = seed(pool, rows)
+        pool.close()
+
+        result = {'rows': rows}
+        for name, covering_index in LAYOUTS.items():
+            if covering_index is None:
+                continue
+            shutil.copyfile(paths['text'], paths[name])
+            pool = ConnectionPool(database=paths[name], size=1)
+            started = time.perf_counter()
+            SQLiteUserRepository(pool).compact(covering_index)
+            result[f'{name}_convert_seconds'] = time.perf_counter() - started
+            pool.close()
+        for name, path in paths.items():
+            result[name] = measure(path, users, args.lookups, args.inserts)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare database size and lookup latency of the text and compact id layouts.")
+    parser.add_argument('--rows', type=parse_rows, default=[100000],
+                        help="comma-separated table sizes to seed, e.g. 10000,100000,1000000")
+    parser.add_argument('--lookups', type=int, default=20000, help="lookups timed per query")
+    parser.add_argument('--inserts', type=int, default=2000, help="single-row inserts timed")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'config': {'lookups': args.lookups, 'inserts': args.inserts},
+        'results': [run_size(args, rows) for rows in args.rows],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent import futures
+from datetime import datetime, timezone
+
+import bcrypt
+import grpc
+
+# Tokens are minted locally, so any key works as long as the server uses it too.
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-not-for-production-use')
+
+# Import the generated classes
+from generated import user_pb2
+from generated import user_pb2_grpc
+
+from backend.auth import create_token, get_token_service
+from backend.cache import UserCache, make_backend
+from backend.database import SQLiteUserRepository, init_db
+from backend.events import EventFeed
+from backend.hashing import HashingExecutor
+from backend.pool import ConnectionPool
+from backend.precheck import RegistrationIndex
+from backend.ratelimit import LoginRateLimiter, NullBuckets
+from backend.sessions import SessionStore
+
+
+SEED_PASSWORD = 'benchmark-password'
+METHODS = ('RegisterUser', 'LoginUser', 'GetUser')
+# Every simulated login comes from one peer, so login throttling would
+# measure the limiter rather than the server.
+NO_LIMITS = LoginRateLimiter(NullBuckets())
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in METHODS:
+            raise argparse.ArgumentTypeError(f"Unknown method '{name}' in --mix.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_rows(text):
+    return [int(value) for value in text.split(',')]
+
+
+def seed(pool, rows, batch_size=10000):
+    """Inserts `rows` users sharing one bcrypt hash; returns their (id, username, email) tuples."""
+    hashed_password = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt())
+    users = []
+    with pool.connection() as conn:
+        for start in range(0, rows, batch_size):
+            batch = [(str(uuid.uuid4()), f'seed{i}', f'seed{i}@example.com', hashed_password)
+                     for i in range(start, min(rows, start + batch_size))]
+            conn.executemany(
+                "INSERT INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, ?)", batch)
+            conn.commit()
+            users.extend((user_id, username, email) for user_id, username, email, _ in batch)
+    return users
+
+
+def start_server(mode, pool, hasher, cache, workers):
+    """Starts the sync or grpc.aio server on a free port; returns (port, stop)."""
+    users = SQLiteUserRepository(pool)
+    taken = RegistrationIndex(users)
+    taken.rebuild()
+    sessions = SessionStore(users, get_token_service().revoked)
+    events = EventFeed(users)
+    if mode == 'sync':
+        from backend.server import UserServiceServicer
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        servicer = UserServiceServicer(users=users, hasher=hasher, cache=cache,
+                                       limiter=NO_LIMITS, taken=taken, sessions=sessions,
+                                       events=events)
+        user_pb2_grpc.add_UserServiceServicer_to_server(servicer, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        server.start()
+
+        def stop():
+            server.stop(0).wait()
+            # Re-hashes queued by logins finish while the hashing pool is still up.
+            servicer.rehasher.shutdown()
+        return port, stop
+
+    from backend.aio_server import AsyncUserServiceServicer
+    from backend.repository import AsyncUserRepository
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def run():
+        server = grpc.aio.server()
+        state['servicer'] = AsyncUserServiceServicer(
+            users=AsyncUserRepository(users), hasher=hasher, cache=cache, limiter=NO_LIMITS,
+            taken=taken, sessions=sessions, events=events)
+        user_pb2_grpc.add_UserServiceServicer_to_server(state['servicer'], server)
+        state['port'] = server.add_insecure_port('127.0.0.1:0')
+        state['stopping'] = asyncio.Event()
+        await server.start()
+        ready.set()
+        # Stop from inside the loop; awaiting server.stop() from another
+        # thread can hang.
+        await state['stopping'].wait()
+        await server.stop(0)
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(state['stopping'].set)
+        thread.join()
+        state['servicer'].rehasher.shutdown()
+    return state['port'], stop
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    by_method = {}
+    for method, latency, code in samples:
+        by_method.setdefault(method, []).append((latency, code))
+
+    report = {}
+    for method, entries in sorted(by_method.items()):
+        latencies = sorted(latency for latency, _ in entries)
+        codes = {}
+        for _, code in entries:
+            codes[code] = codes.get(code, 0) + 1
+        report[method] = {
+            'count': len(entries),
+            'throughput_rps': len(entries) / elapsed,
+            'mean_ms': 1000 * sum(latencies) / len(latencies),
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p95_ms': 1000 * percentile(latencies, 95),
+            'p99_ms': 1000 * percentile(latencies, 99),
+            'status_codes': codes,
+        }
+    return report
+
+
+def client(port, mix, hot_users, duration, samples, seed_value):
+    rng = random.Random(seed_value)
+    methods, weights = zip(*mix.items())
+    local = []
+    with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+        stub = user_pb2_grpc.UserServiceStub(channel)
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            method = rng.choices(methods, weights)[0]
+            user_id, email, token = rng.choice(hot_users)
+            if method == 'RegisterUser':
+                name = uuid.uuid4().hex
+                call = lambda: stub.RegisterUser(user_pb2.RegisterUserRequest(
+                    username=name, email=f'{name}@example.com', password=SEED_PASSWORD))
+            elif method == 'LoginUser':
+                call = lambda: stub.LoginUser(user_pb2.LoginUserRequest(
+                    email=email, password=SEED_PASSWORD))
+            else:
+                call = lambda: stub.GetUser(user_pb2.EmptyRequest(),
+                                            metadata=[('authorization', f'Bearer {token}')])
+            started = time.perf_counter()
+            try:
+                call()
+                code = 'OK'
+            except grpc.RpcError as e:
+                code = e.code().name
+            local.append((method, time.perf_counter() - started, code))
+    samples.extend(local)
+
+
+def run_phase(port, mix, hot_users, clients, duration):
+    samples = []
+    threads = [threading.Thread(target=client, args=(port, mix, hot_users, duration, samples, i))
+               for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    methods = summarize(samples, elapsed)
+    return {
+        'elapsed_s': elapsed,
+        'requests': len(samples),
+        'throughput_rps': len(samples) / elapsed,
+        'methods': methods,
+    }
+
+
+def warm_up(port, hot_users):
+    with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+        stub = user_pb2_grpc.UserServiceStub(channel)
+        for _, _, token in hot_users:
+            stub.GetUser(user_pb2.EmptyRequest(), metadata=[('authorization', f'Bearer {token}')])
+
+
+def run_size(args, rows, hasher):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'users.db')
+        pool = ConnectionPool(database=db_path, size=args.workers)
+        init_db(pool)
+        started = time.perf_counter()
+        users = seed(pool, rows)
+        seed_seconds = time.perf_counter() - started
+
+        rng = random.Random(rows)
+        hot = rng.sample(users, min(args.hot_users, len(users)))
+        hot_users = [(user_id, email, create_token(user_id, username)) for user_id, username, email in hot]
+
+        result = {'rows': rows, 'seed_seconds': seed_seconds, 'scenarios': {}}
+        cache = UserCache(make_backend(args.cache))
+        port, stop = start_server(args.mode, pool, hasher, cache, args.workers)
+        try:
+            result['scenarios']['cold'] = run_phase(port, args.mix, hot_users, args.clients, args.duration)
+            warm_up(port, hot_users)
+            result['scenarios']['warm'] = run_phase(port, args.mix, hot_users, args.clients, args.duration)
+        finally:
+            stop()
+            result['pool'] = pool.stats()
+            result['cache'] = cache.stats()
+            result['db_bytes'] = sum(os.path.getsize(db_path + suffix)
+                                     for suffix in ('', '-wal') if os.path.exists(db_path + suffix))
+            pool.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the UserService RPCs.")
+    parser.add_argument('--rows', type=parse_rows, default=[10000],
+                        help="comma-separated table sizes to seed, e.g. 10000,100000,1000000")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent client threads")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('GetUser=8,LoginUser=1,RegisterUser=1'),
+                        help="weighted RPC mix, e.g. GetUser=8,LoginUser=1,RegisterUser=1")
+    parser.add_argument('--hot-users', type=int, default=1000,
+                        help="users the clients log in as and read")
+    parser.add_argument('--mode', choices=('sync', 'async'), default='sync', help="server to run")
+    parser.add_argument('--workers', type=int, default=10, help="gRPC workers and DB connections")
+    parser.add_argument('--cache', choices=('local', 'redis', 'none'), default='local',
+                        help="user cache backend")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    hasher = HashingExecutor()
+    hasher.warm_up()
+    try:
+        sizes = [run_size(args, rows, hasher) for rows in args.rows]
+    finally:
+        hasher.shutdown()
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'sqlite': sqlite3.sqlite_version,
+            'grpc': grpc.__version__,
+        },
+        'config': {
+            'clients': args.clients,
+            'duration_s': args.duration,
+            'mix': args.mix,
+            'hot_users': args.hot_users,
+            'mode': args.mode,
+            'workers': args.workers,
+            'cache': args.cache,
+            'hashing': hasher.stats(),
+        },
+        'results': sizes,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()
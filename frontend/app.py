@@ -1,9 +1,13 @@
+import itertools
+import time
 import grpc
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import jwt
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, session
 
 # Import our generated gRPC classes
 from generated import user_pb2
-from generated import user_pb2_grpc
+from frontend.client import UserServiceClient
+from frontend.sessions import PROFILE_REFRESH_MARGIN, ProfileLoader, token_claims
 
 # --- Flask App Setup ---
 app = Flask(__name__)
@@ -11,10 +15,43 @@ app = Flask(__name__)
 app.secret_key = 'your_super_secret_key' 
 
 # --- gRPC Client Setup ---
-# Create a connection (channel) to the gRPC server
-channel = grpc.insecure_channel('localhost:50051')
-# Create a client object (stub)
-stub = user_pb2_grpc.UserServiceStub(channel)
+# The client opens its channel on first use in each worker process and
+# applies default deadlines (see frontend/client.py).
+stub = UserServiceClient()
+
+
+def fetch_profile(jwt_token):
+    metadata = [('authorization', f'Bearer {jwt_token}')]
+    return stub.GetUser(user_pb2.EmptyRequest(), metadata=metadata).user
+
+# Verifies session tokens locally and caches profiles per worker for a few
+# seconds, so repeated page views need no backend call (see frontend/sessions.py).
+profiles = ProfileLoader(fetch_profile)
+
+
+def session_token():
+    """Returns the session's access token, renewed first if it is about to expire.
+
+    Renewing exchanges the refresh token for a new pair, with no password
+    check. Returns None, with the session cleared, if the session is over.
+    """
+    token = session['jwt_token']
+    refresh_token = session.get('refresh_token')
+    if not refresh_token or token_claims(token).get('exp', 0) - time.time() > PROFILE_REFRESH_MARGIN:
+        return token
+    try:
+        response = stub.RefreshToken(user_pb2.RefreshTokenRequest(refresh_token=refresh_token))
+    except grpc.RpcError as e:
+        if e.code() != grpc.StatusCode.UNAUTHENTICATED:
+            # Still valid for a little while; try again on the next page.
+            return token
+        profiles.forget(token)
+        session.clear()
+        return None
+    profiles.forget(token)
+    session['jwt_token'] = response.token
+    session['refresh_token'] = response.refresh_token
+    return response.token
 
 # --- Basic Routes ---
 @app.route('/')
@@ -67,7 +104,8 @@ def login():
             
             # Store user's token (their ID) in the session
             session['jwt_token'] = response.token
-            session['username'] = 'temp_user' # We'll fix this in the next step
+            session['refresh_token'] = response.refresh_token
+            session['username'] = token_claims(response.token)['username']
             
             flash('You were successfully logged in!', 'success')
             return redirect(url_for('profile'))
@@ -85,18 +123,21 @@ def profile():
         flash('Please log in to view this page.', 'error')
         return redirect(url_for('login'))
 
-    jwt_token = session['jwt_token']
+    jwt_token = session_token()
+    if jwt_token is None:
+        flash("Your session has expired. Please log in again.", 'error')
+        return redirect(url_for('login'))
     try:
-        # 1. Create a gRPC request with the user's ID
-        grpc_request = user_pb2.EmptyRequest()
+        # Served from this worker's cache unless it's missing, stale or
+        # the token is about to expire; then GetUser is called.
+        user = profiles.profile(jwt_token)
+        return render_template('profile.html', user=user)
 
-        metadata = [('authorization', f'Bearer {jwt_token}')]
-        
-        # 2. Call the GetUser RPC on the backend
-        response = stub.GetUser(grpc_request, metadata=metadata)
-        
-        # 3. The user data is in response.user. Pass it to the template.
-        return render_template('profile.html', user=response.user)
+    except jwt.InvalidTokenError:
+        # Checked locally, without a call to the backend.
+        flash("Your session is invalid or has expired. Please log in again.", 'error')
+        session.clear()
+        return redirect(url_for('login'))
 
     except grpc.RpcError as e:
         # Handle potential errors, like if the user was deleted from the DB
@@ -105,70 +146,134 @@ def profile():
         # If the user is not found, their session is invalid. Log them out.
         if e.code() == grpc.StatusCode.UNAUTHENTICATED:
             flash(f"Your session is invalid or has expired. Please log in again.", 'error')
+            profiles.forget(jwt_token)
             session.clear()
             
         return redirect(url_for('login'))
 
 @app.route('/profile/edit', methods=('GET', 'POST'))
 def edit_profile():
-    if 'user_id' not in session:
+    if 'jwt_token' not in session:
         flash('Please log in to edit your profile.', 'error')
         return redirect(url_for('login'))
-    
-    user_id = session['user_id']
+
+    # The backend takes the user from the token, so no id is sent.
+    jwt_token = session_token()
+    if jwt_token is None:
+        flash("Your session has expired. Please log in again.", 'error')
+        return redirect(url_for('login'))
+    metadata = [('authorization', f'Bearer {jwt_token}')]
     if request.method == 'POST':
-        # now we'll update the user's profile using the form data
-        # Get the updated data from the form
-        username = request.form['username']
-        email = request.form['email']
+        # Only send the fields that changed since the form was loaded, and
+        # the version they were loaded at, so a concurrent edit isn't lost.
+        changed = [field for field in ('username', 'email')
+                   if request.form[field] != request.form[f'original_{field}']]
+        if not changed:
+            flash('Nothing to update.', 'success')
+            return redirect(url_for('profile'))
 
         try:
-            # Create a gRPC request to update the user
             grpc_request = user_pb2.UpdateUserProfileRequest(
-                user_id=user_id,
-                username=username,
-                email=email
+                username=request.form['username'],
+                email=request.form['email'],
+                version=request.form.get('version', 0, type=int)
             )
-            response = stub.UpdateUserProfile(grpc_request)
+            grpc_request.update_mask.paths.extend(changed)
+            response = stub.UpdateUserProfile(grpc_request, metadata=metadata)
+            profiles.forget(jwt_token)
+            session['username'] = response.user.username
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('profile'))
 
         except grpc.RpcError as e:
-            # Handle errors from the gRPC server
-            flash(f"Error updating profile: {e.details()}", 'error')
+            if e.code() == grpc.StatusCode.ABORTED:
+                flash("Your profile was changed elsewhere. Review it and save again.", 'error')
+            else:
+                flash(f"Error updating profile: {e.details()}", 'error')
             return redirect(url_for('edit_profile'))
-        
-        # Handling initial page load for GET request
+
+    # Always fresh rather than cached, so the form carries the current version.
     try:
-        grpc_request = user_pb2.GetUserRequest(user_id=user_id)
-        response = stub.GetUser(grpc_request)
+        response = stub.GetUser(user_pb2.EmptyRequest(), metadata=metadata)
         return render_template('edit_profile.html', user=response.user)
     except grpc.RpcError as e:
         flash(f"Error fetching profile for edit: {e.details()}", 'error')
         return redirect(url_for('profile'))
-        
+
+def _until_error(users):
+    # Once streaming has started the headers are sent, so a failure can only
+    # end the table early; a last row marks it as incomplete.
+    try:
+        yield from users
+    except grpc.RpcError as e:
+        print(f"User stream ended early: {e.details()}")
+        yield {'truncated': f"{e.code().name}: {e.details()}"}
+
 @app.route('/admin')
 def admin():
     # This is a placeholder for the admin page
     # In a real app, you might check if the user is an admin before showing this page
-    if 'user_id' not in session:
+    if 'jwt_token' not in session:
         flash('Please log in to view this page.', 'error')
         return redirect(url_for('login'))
+
+    jwt_token = session_token()
+    if jwt_token is None:
+        flash("Your session has expired. Please log in again.", 'error')
+        return redirect(url_for('login'))
+    metadata = [('authorization', f'Bearer {jwt_token}')]
     try:
-        # The request message for this RPC is empty beacause it doesn't need any parameters
-        grpc_request = user_pb2.EmptyRequest()
-        # Call the ListAllUsers RPC
-        response = stub.ListAllUsers(grpc_request)
-        # Pass the list of users to the template
-        return render_template('admin.html', user_list=response.users)
-    
+        query = request.args.get('q', '').strip()
+        if query:
+            # Ranked matches from the search index, a page at a time.
+            grpc_request = user_pb2.SearchUsersRequest(
+                query=query,
+                page_size=request.args.get('page_size', 0, type=int),
+                page_token=request.args.get('page_token', '')
+            )
+            response = stub.SearchUsers(grpc_request, metadata=metadata)
+            return render_template('admin.html', user_list=response.users, query=query,
+                                   next_page_token=response.next_page_token,
+                                   page_size=grpc_request.page_size)
+
+        if request.args.get('all'):
+            # Stream every user: rows are rendered as they arrive from the
+            # StreamUsers RPC instead of after the whole list is fetched.
+            users = stub.StreamUsers(user_pb2.ListUsersRequest(), metadata=metadata)
+            # Pull the first row here so auth errors can still redirect.
+            first = next(users, None)
+            user_list = _until_error(itertools.chain([first], users)) if first is not None else []
+            return stream_template('admin.html', user_list=user_list, streamed=True)
+
+        # One page at a time, using the opaque cursor from the previous page.
+        grpc_request = user_pb2.ListUsersRequest(
+            page_size=request.args.get('page_size', 0, type=int),
+            page_token=request.args.get('page_token', '')
+        )
+        response = stub.ListUsers(grpc_request, metadata=metadata)
+        return render_template('admin.html', user_list=response.users,
+                               next_page_token=response.next_page_token,
+                               page_size=grpc_request.page_size)
+
     except grpc.RpcError as e:
         flash(f"An admin error occurred: {e.details()}", 'error')
+        if e.code() == grpc.StatusCode.UNAUTHENTICATED:
+            session.clear()
+            return redirect(url_for('login'))
         return redirect(url_for('profile'))
     
 
 @app.route('/logout')
 def logout():
+    if 'jwt_token' in session:
+        profiles.forget(session['jwt_token'])
+        # Revokes the access token and ends the refresh token's session, so
+        # neither works even if it was copied.
+        try:
+            stub.Logout(user_pb2.LogoutRequest(refresh_token=session.get('refresh_token', '')),
+                        metadata=[('authorization', f"Bearer {session['jwt_token']}")])
+        except grpc.RpcError as e:
+            print(f"Logout was not recorded by the backend: {e.details()}")
     # Clear the session
     session.clear()
     flash('You have been logged out.', 'success')
@@ -0,0 +1,134 @@
+import json
+import os
+import socket
+import threading
+
+import grpc
+
+# Import our generated gRPC classes
+from generated import user_pb2_grpc
+
+
+# Comma-separated backend addresses; more than one enables round_robin.
+USER_SERVICE_TARGETS = os.getenv('USER_SERVICE_TARGETS', 'localhost:50051')
+# Default deadline in seconds for RPCs without an entry in RPC_TIMEOUTS.
+USER_SERVICE_TIMEOUT = float(os.getenv('USER_SERVICE_TIMEOUT', '5'))
+# 'gzip' compresses requests; worth it only when backends are far away.
+USER_SERVICE_COMPRESSION = os.getenv('USER_SERVICE_COMPRESSION', 'none')
+
+# Calls that legitimately run longer than a page view.
+RPC_TIMEOUTS = {
+    'StreamUsers': 60.0,
+    'BulkRegisterUsers': 300.0,
+}
+
+CHANNEL_OPTIONS = [
+    # Keep idle connections warm and notice dead backends quickly.
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_send_message_length', 16 * 1024 * 1024),
+    ('grpc.max_receive_message_length', 16 * 1024 * 1024),
+    ('grpc.enable_retries', 1),
+]
+
+# Transparent retries for read-only calls when a backend is briefly unavailable.
+SERVICE_CONFIG = {
+    'loadBalancingConfig': [{'round_robin': {}}],
+    'methodConfig': [{
+        'name': [{'service': 'user.UserService', 'method': method}
+                 for method in ('GetUser', 'ListUsers', 'ListAllUsers', 'SearchUsers', 'BatchGetUsers')],
+        'retryPolicy': {
+            'maxAttempts': 3,
+            'initialBackoff': '0.1s',
+            'maxBackoff': '1s',
+            'backoffMultiplier': 2,
+            'retryableStatusCodes': ['UNAVAILABLE'],
+        },
+    }],
+}
+
+
+def build_target(addresses):
+    """Turns a list of host:port addresses into one gRPC target string.
+
+    A single address is used as-is. Several are resolved to IPs and joined
+    into a static `ipv4:`/`ipv6:` address list that round_robin spreads
+    calls across.
+    """
+    if len(addresses) == 1:
+        return addresses[0]
+
+    ipv4, ipv6 = [], []
+    for address in addresses:
+        host, _, port = address.rpartition(':')
+        for family, _, _, _, sockaddr in socket.getaddrinfo(
+                host.strip('[]'), int(port), type=socket.SOCK_STREAM):
+            if family == socket.AF_INET:
+                ipv4.append(f"{sockaddr[0]}:{port}")
+            elif family == socket.AF_INET6:
+                ipv6.append(f"[{sockaddr[0]}]:{port}")
+    # A target list can only use one address family; prefer IPv4.
+    if ipv4:
+        return 'ipv4:' + ','.join(dict.fromkeys(ipv4))
+    return 'ipv6:' + ','.join(dict.fromkeys(ipv6))
+
+
+class UserServiceClient:
+    """A per-process UserService stub with tuned channel settings and default deadlines.
+
+    The channel is created lazily and re-created after a fork, so gunicorn
+    workers each get their own instead of sharing the parent's. Calls such
+    as `client.GetUser(request, metadata=...)` behave like the generated stub
+    but get a deadline from RPC_TIMEOUTS unless `timeout=` is passed.
+    """
+
+    def __init__(self, targets=USER_SERVICE_TARGETS, default_timeout=USER_SERVICE_TIMEOUT,
+                 compression=USER_SERVICE_COMPRESSION):
+        self.addresses = [t.strip() for t in targets.split(',') if t.strip()]
+        self.default_timeout = default_timeout
+        self.compression = grpc.Compression.Gzip if compression == 'gzip' else grpc.Compression.NoCompression
+        self._lock = threading.Lock()
+        self._pid = None
+        self._channel = None
+        self._stub = None
+        if hasattr(os, 'register_at_fork'):
+            # The parent may have held the lock mid-call when it forked.
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _get_stub(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # After a fork the inherited channel belongs to the parent;
+                    # drop it without closing and start a fresh one.
+                    self._channel = grpc.insecure_channel(
+                        build_target(self.addresses),
+                        options=CHANNEL_OPTIONS + [('grpc.service_config', json.dumps(SERVICE_CONFIG))],
+                        compression=self.compression
+                    )
+                    self._stub = user_pb2_grpc.UserServiceStub(self._channel)
+                    self._pid = pid
+        return self._stub
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self._get_stub(), name)
+        timeout = RPC_TIMEOUTS.get(name, self.default_timeout)
+
+        def call(request, **kwargs):
+            kwargs.setdefault('timeout', timeout)
+            return method(request, **kwargs)
+        return call
+
+    def close(self):
+        with self._lock:
+            if self._channel is not None and self._pid == os.getpid():
+                self._channel.close()
+            self._channel = self._stub = self._pid = None
@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+import jwt
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+JWT_ALGORITHM = 'HS256'
+# 'local' verifies tokens with the key shared with the backend and serves
+# profiles from a per-worker cache; 'backend' calls GetUser on every page view.
+FRONTEND_SESSION_MODE = os.getenv('FRONTEND_SESSION_MODE', 'local')
+# The backend's JWKS (http://, or file:// for JWT_JWKS_FILE), for verifying
+# RS256/EdDSA tokens without any secret.
+JWT_JWKS_URL = os.getenv('JWT_JWKS_URL')
+# Seconds the key set is kept before it is fetched again; a token with an
+# unknown kid fetches it at once.
+JWKS_CACHE_TTL = float(os.getenv('JWKS_CACHE_TTL', '300'))
+# Least seconds between fetches, however many unknown kids turn up.
+JWKS_MIN_REFRESH_INTERVAL = 10.0
+JWKS_FETCH_TIMEOUT = 5.0
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1024'))
+# Seconds a cached profile is shown before it is fetched again.
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '5'))
+# The backend's setting of the same name: logouts reach every backend process
+# within this many seconds. Cached profiles never outlive it, so a token
+# logged out through another frontend worker stops working about as soon.
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', '5'))
+# Within this many seconds of the token's expiry the backend is asked again,
+# and the frontend renews the token with the session's refresh token.
+PROFILE_REFRESH_MARGIN = float(os.getenv('PROFILE_REFRESH_MARGIN', '300'))
+
+
+def token_claims(token):
+    """Reads a token's claims without verifying it.
+
+    Only for a token that just came back from LoginUser, e.g. to show the
+    username; anything taken from a cookie must go through verify().
+    """
+    return jwt.decode(token, options={'verify_signature': False})
+
+
+class ProfileCache:
+    """A bounded LRU map of token -> profile, each entry with its own expiry."""
+
+    def __init__(self, max_size=PROFILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or now >= entry[1]:
+                self._entries.pop(token, None)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, token, profile, expires_at):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (profile, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+class KeySet:
+    """The public keys published at `url`, by kid, fetched when stale or missing a key."""
+
+    def __init__(self, url, ttl=JWKS_CACHE_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._keys = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=JWKS_FETCH_TIMEOUT) as response:
+                jwks = jwt.PyJWKSet.from_dict(json.load(response))
+        except (OSError, ValueError, jwt.PyJWKSetError) as e:
+            raise jwt.PyJWKClientConnectionError(f"Fetching the JWKS from {self.url} failed: {e}")
+        self._keys = {key.key_id: key for key in jwks.keys}
+        self._fetched_at = time.monotonic()
+
+    def get(self, kid):
+        """Returns the PyJWK for `kid`. Raises jwt.InvalidSignatureError if there's none."""
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            if (self._keys is None or age > self.ttl
+                    or (kid not in self._keys and age > JWKS_MIN_REFRESH_INTERVAL)):
+                self._fetch()
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidSignatureError("Token signed with an unknown key.")
+        return key
+
+
+class ProfileLoader:
+    """Returns the profile behind a session's token, calling the backend only when needed.
+
+    `fetch(token)` is the GetUser call. In 'local' mode the token's
+    signature and expiry are checked here first, so a page view for a
+    cached profile never leaves the worker. The backend is still asked on
+    a miss, once the cached copy is PROFILE_CACHE_TTL old (at most
+    REVOCATION_SYNC_INTERVAL, as only the backend sees logouts), and when
+    the token is about to expire. HS256 tokens are checked with JWT_SECRET_KEY,
+    others against the public keys at JWT_JWKS_URL; without either every
+    call goes to the backend, as in 'backend' mode.
+    """
+
+    def __init__(self, fetch, mode=FRONTEND_SESSION_MODE, cache=None,
+                 ttl=PROFILE_CACHE_TTL, refresh_margin=PROFILE_REFRESH_MARGIN,
+                 revocation_interval=REVOCATION_SYNC_INTERVAL):
+        self.fetch = fetch
+        self.mode = mode
+        self.cache = cache or ProfileCache()
+        self.ttl = min(ttl, revocation_interval)
+        self.refresh_margin = refresh_margin
+        self._keys = tuple(k for k in (os.getenv('JWT_SECRET_KEY'),
+                                       os.getenv('JWT_PREVIOUS_SECRET_KEY')) if k)
+        self._jwks = KeySet(JWT_JWKS_URL) if JWT_JWKS_URL else None
+
+    def verify(self, token):
+        """Returns the token's claims.
+
+        Raises jwt.InvalidTokenError (or a subclass), or jwt.PyJWKClientError
+        when the key set can't be fetched.
+        """
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') != JWT_ALGORITHM:
+            if self._jwks is None:
+                raise jwt.InvalidSignatureError("No JWKS to verify this token with.")
+            signing_key = self._jwks.get(header.get('kid'))
+            # The algorithm the key was published for, not the one the token claims.
+            return jwt.decode(token, signing_key.key, algorithms=[signing_key.algorithm_name])
+        if not self._keys:
+            raise jwt.InvalidSignatureError("No key to verify HS256 tokens with.")
+        for key in self._keys[:-1]:
+            try:
+                return jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+            except jwt.InvalidSignatureError:
+                continue
+        return jwt.decode(token, self._keys[-1], algorithms=[JWT_ALGORITHM])
+
+    def profile(self, token):
+        """Returns the user for `token`.
+
+        Raises jwt.InvalidTokenError if the token is expired or malformed,
+        and whatever `fetch` raises when the backend has to be asked.
+        """
+        if self.mode != 'local' or not (self._keys or self._jwks):
+            return self.fetch(token)
+        try:
+            claims = self.verify(token)
+        except (jwt.InvalidSignatureError, jwt.PyJWKClientError):
+            # Signed with a key this worker hasn't been given (or can't fetch); the backend decides.
+            return self.fetch(token)
+
+        now = time.time()
+        exp = claims.get('exp', now)
+        if exp - now > self.refresh_margin:
+            profile = self.cache.get(token)
+            if profile is not None:
+                return profile
+        profile = self.fetch(token)
+        expires_at = min(now + self.ttl, exp - self.refresh_margin)
+        if expires_at > now:
+            self.cache.put(token, profile, expires_at)
+        return profile
+
+    def forget(self, token):
+        """Drops the cached profile, e.g. at logout or after an edit."""
+        self.cache.pop(token)
+
+    def stats(self):
+        return self.cache.stats()
@@ -22,31 +22,60 @@ _runtime_version.ValidateProtobufRuntimeVersion(
 _sym_db = _symbol_database.Default()
 
 
+from google.protobuf import field_mask_pb2 as google_dot_protobuf_dot_field__mask__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nuser.proto\x12\x04user\"3\n\x04User\x12\n\n\x02id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"H\n\x13RegisterUserRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05\x65mail\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\"3\n\x10LoginUserRequest\x12\r\n\x05\x65mail\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"\"\n\x11LoginUserResponse\x12\r\n\x05token\x18\x01 \x01(\t\"L\n\x18UpdateUserProfileRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"(\n\x0cUserResponse\x12\x18\n\x04user\x18\x01 \x01(\x0b\x32\n.user.User\"\x0e\n\x0c\x45mptyRequest\".\n\x11ListUsersResponse\x12\x19\n\x05users\x18\x01 \x03(\x0b\x32\n.user.User2\xc3\x02\n\x0bUserService\x12=\n\x0cRegisterUser\x12\x19.user.RegisterUserRequest\x1a\x12.user.UserResponse\x12<\n\tLoginUser\x12\x16.user.LoginUserRequest\x1a\x17.user.LoginUserResponse\x12\x31\n\x07GetUser\x12\x12.user.EmptyRequest\x1a\x12.user.UserResponse\x12G\n\x11UpdateUserProfile\x12\x1e.user.UpdateUserProfileRequest\x1a\x12.user.UserResponse\x12;\n\x0cListAllUsers\x12\x12.user.EmptyRequest\x1a\x17.user.ListUsersResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nuser.proto\x12\x04user\x1a google/protobuf/field_mask.proto\"D\n\x04User\x12\n\n\x02id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\x12\x0f\n\x07version\x18\x04 \x01(\x03\"H\n\x13RegisterUserRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05\x65mail\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\"3\n\x10LoginUserRequest\x12\r\n\x05\x65mail\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"M\n\x11LoginUserResponse\x12\r\n\x05token\x18\x01 \x01(\t\x12\x15\n\rrefresh_token\x18\x02 \x01(\t\x12\x12\n\nexpires_in\x18\x03 \x01(\x03\",\n\x13RefreshTokenRequest\x12\x15\n\rrefresh_token\x18\x01 \x01(\t\"&\n\rLogoutRequest\x12\x15\n\rrefresh_token\x18\x01 \x01(\t\"\x10\n\x0eLogoutResponse\"\x8e\x01\n\x18UpdateUserProfileRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\x12/\n\x0bupdate_mask\x18\x04 \x01(\x0b\x32\x1a.google.protobuf.FieldMask\x12\x0f\n\x07version\x18\x05 \x01(\x03\"(\n\x0cUserResponse\x12\x18\n\x04user\x18\x01 \x01(\x0b\x32\n.user.User\"\x0e\n\x0c\x45mptyRequest\"9\n\x10ListUsersRequest\x12\x11\n\tpage_size\x18\x01 \x01(\x05\x12\x12\n\npage_token\x18\x02 \x01(\t\"J\n\x12SearchUsersRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\x11\n\tpage_size\x18\x02 \x01(\x05\x12\x12\n\npage_token\x18\x03 \x01(\t\"G\n\x11ListUsersResponse\x12\x19\n\x05users\x18\x01 \x03(\x0b\x32\n.user.User\x12\x17\n\x0fnext_page_token\x18\x02 \x01(\t\"\xac\x01\n\x12\x42ulkRegisterResult\x12\r\n\x05index\x18\x01 \x01(\x05\x12/\n\x06status\x18\x02 \x01(\x0e\x32\x1f.user.BulkRegisterResult.Status\x12\x0f\n\x07user_id\x18\x03 \x01(\t\x12\r\n\x05\x65rror\x18\x04 \x01(\t\"6\n\x06Status\x12\x0b\n\x07\x43REATED\x10\x00\x12\x12\n\x0e\x41LREADY_EXISTS\x10\x01\x12\x0b\n\x07INVALID\x10\x02\"W\n\x19\x42ulkRegisterUsersResponse\x12)\n\x07results\x18\x01 \x03(\x0b\x32\x18.user.BulkRegisterResult\x12\x0f\n\x07\x63reated\x18\x02 \x01(\x05\"(\n\x14\x42\x61tchGetUsersRequest\x12\x10\n\x08user_ids\x18\x01 \x03(\t\"F\n\nUserLookup\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\r\n\x05\x66ound\x18\x02 \x01(\x08\x12\x18\n\x04user\x18\x03 \x01(\x0b\x32\n.user.User\":\n\x15\x42\x61tchGetUsersResponse\x12!\n\x07results\x18\x01 \x03(\x0b\x32\x10.user.UserLookup\"Y\n\x16WatchUserEventsRequest\x12\x16\n\x0e\x61\x66ter_sequence\x18\x01 \x01(\x03\x12\x13\n\x0b\x66rom_latest\x18\x02 \x01(\x08\x12\x12\n\nbatch_size\x18\x03 \x01(\x05\"\x92\x01\n\tUserEvent\x12\x10\n\x08sequence\x18\x01 \x01(\x03\x12\"\n\x04type\x18\x02 \x01(\x0e\x32\x14.user.UserEvent.Type\x12\x18\n\x04user\x18\x03 \x01(\x0b\x32\n.user.User\x12\x13\n\x0boccurred_at\x18\x04 \x01(\x03\" \n\x04Type\x12\x0b\n\x07\x43REATED\x10\x00\x12\x0b\n\x07UPDATED\x10\x01\x32\xd2\x06\n\x0bUserService\x12=\n\x0cRegisterUser\x12\x19.user.RegisterUserRequest\x1a\x12.user.UserResponse\x12<\n\tLoginUser\x12\x16.user.LoginUserRequest\x1a\x17.user.LoginUserResponse\x12\x42\n\x0cRefreshToken\x12\x19.user.RefreshTokenRequest\x1a\x17.user.LoginUserResponse\x12\x33\n\x06Logout\x12\x13.user.LogoutRequest\x1a\x14.user.LogoutResponse\x12\x31\n\x07GetUser\x12\x12.user.EmptyRequest\x1a\x12.user.UserResponse\x12G\n\x11UpdateUserProfile\x12\x1e.user.UpdateUserProfileRequest\x1a\x12.user.UserResponse\x12;\n\x0cListAllUsers\x12\x12.user.EmptyRequest\x1a\x17.user.ListUsersResponse\x12<\n\tListUsers\x12\x16.user.ListUsersRequest\x1a\x17.user.ListUsersResponse\x12@\n\x0bSearchUsers\x12\x18.user.SearchUsersRequest\x1a\x17.user.ListUsersResponse\x12\x33\n\x0bStreamUsers\x12\x16.user.ListUsersRequest\x1a\n.user.User0\x01\x12Q\n\x11\x42ulkRegisterUsers\x12\x19.user.RegisterUserRequest\x1a\x1f.user.BulkRegisterUsersResponse(\x01\x12H\n\rBatchGetUsers\x12\x1a.user.BatchGetUsersRequest\x1a\x1b.user.BatchGetUsersResponse\x12\x42\n\x0fWatchUserEvents\x12\x1c.user.WatchUserEventsRequest\x1a\x0f.user.UserEvent0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'user_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_USER']._serialized_start=20
-  _globals['_USER']._serialized_end=71
-  _globals['_REGISTERUSERREQUEST']._serialized_start=73
-  _globals['_REGISTERUSERREQUEST']._serialized_end=145
-  _globals['_LOGINUSERREQUEST']._serialized_start=147
-  _globals['_LOGINUSERREQUEST']._serialized_end=198
-  _globals['_LOGINUSERRESPONSE']._serialized_start=200
-  _globals['_LOGINUSERRESPONSE']._serialized_end=234
-  _globals['_UPDATEUSERPROFILEREQUEST']._serialized_start=236
-  _globals['_UPDATEUSERPROFILEREQUEST']._serialized_end=312
-  _globals['_USERRESPONSE']._serialized_start=314
-  _globals['_USERRESPONSE']._serialized_end=354
-  _globals['_EMPTYREQUEST']._serialized_start=356
-  _globals['_EMPTYREQUEST']._serialized_end=370
-  _globals['_LISTUSERSRESPONSE']._serialized_start=372
-  _globals['_LISTUSERSRESPONSE']._serialized_end=418
-  _globals['_USERSERVICE']._serialized_start=421
-  _globals['_USERSERVICE']._serialized_end=744
+  _globals['_USER']._serialized_start=54
+  _globals['_USER']._serialized_end=122
+  _globals['_REGISTERUSERREQUEST']._serialized_start=124
+  _globals['_REGISTERUSERREQUEST']._serialized_end=196
+  _globals['_LOGINUSERREQUEST']._serialized_start=198
+  _globals['_LOGINUSERREQUEST']._serialized_end=249
+  _globals['_LOGINUSERRESPONSE']._serialized_start=251
+  _globals['_LOGINUSERRESPONSE']._serialized_end=328
+  _globals['_REFRESHTOKENREQUEST']._serialized_start=330
+  _globals['_REFRESHTOKENREQUEST']._serialized_end=374
+  _globals['_LOGOUTREQUEST']._serialized_start=376
+  _globals['_LOGOUTREQUEST']._serialized_end=414
+  _globals['_LOGOUTRESPONSE']._serialized_start=416
+  _globals['_LOGOUTRESPONSE']._serialized_end=432
+  _globals['_UPDATEUSERPROFILEREQUEST']._serialized_start=435
+  _globals['_UPDATEUSERPROFILEREQUEST']._serialized_end=577
+  _globals['_USERRESPONSE']._serialized_start=579
+  _globals['_USERRESPONSE']._serialized_end=619
+  _globals['_EMPTYREQUEST']._serialized_start=621
+  _globals['_EMPTYREQUEST']._serialized_end=635
+  _globals['_LISTUSERSREQUEST']._serialized_start=637
+  _globals['_LISTUSERSREQUEST']._serialized_end=694
+  _globals['_SEARCHUSERSREQUEST']._serialized_start=696
+  _globals['_SEARCHUSERSREQUEST']._serialized_end=770
+  _globals['_LISTUSERSRESPONSE']._serialized_start=772
+  _globals['_LISTUSERSRESPONSE']._serialized_end=843
+  _globals['_BULKREGISTERRESULT']._serialized_start=846
+  _globals['_BULKREGISTERRESULT']._serialized_end=1018
+  _globals['_BULKREGISTERRESULT_STATUS']._serialized_start=964
+  _globals['_BULKREGISTERRESULT_STATUS']._serialized_end=1018
+  _globals['_BULKREGISTERUSERSRESPONSE']._serialized_start=1020
+  _globals['_BULKREGISTERUSERSRESPONSE']._serialized_end=1107
+  _globals['_BATCHGETUSERSREQUEST']._serialized_start=1109
+  _globals['_BATCHGETUSERSREQUEST']._serialized_end=1149
+  _globals['_USERLOOKUP']._serialized_start=1151
+  _globals['_USERLOOKUP']._serialized_end=1221
+  _globals['_BATCHGETUSERSRESPONSE']._serialized_start=1223
+  _globals['_BATCHGETUSERSRESPONSE']._serialized_end=1281
+  _globals['_WATCHUSEREVENTSREQUEST']._serialized_start=1283
+  _globals['_WATCHUSEREVENTSREQUEST']._serialized_end=1372
+  _globals['_USEREVENT']._serialized_start=1375
+  _globals['_USEREVENT']._serialized_end=1521
+  _globals['_USEREVENT_TYPE']._serialized_start=1489
+  _globals['_USEREVENT_TYPE']._serialized_end=1521
+  _globals['_USERSERVICE']._serialized_start=1524
+  _globals['_USERSERVICE']._serialized_end=2374
 # @@protoc_insertion_point(module_scope)
@@ -45,6 +45,16 @@ class UserServiceStub(object):
                 request_serializer=user__pb2.LoginUserRequest.SerializeToString,
                 response_deserializer=user__pb2.LoginUserResponse.FromString,
                 _registered_method=True)
+        self.RefreshToken = channel.unary_unary(
+                '/user.UserService/RefreshToken',
+                request_serializer=user__pb2.RefreshTokenRequest.SerializeToString,
+                response_deserializer=user__pb2.LoginUserResponse.FromString,
+                _registered_method=True)
+        self.Logout = channel.unary_unary(
+                '/user.UserService/Logout',
+                request_serializer=user__pb2.LogoutRequest.SerializeToString,
+                response_deserializer=user__pb2.LogoutResponse.FromString,
+                _registered_method=True)
         self.GetUser = channel.unary_unary(
                 '/user.UserService/GetUser',
                 request_serializer=user__pb2.EmptyRequest.SerializeToString,
@@ -60,6 +70,36 @@ class UserServiceStub(object):
                 request_serializer=user__pb2.EmptyRequest.SerializeToString,
                 response_deserializer=user__pb2.ListUsersResponse.FromString,
                 _registered_method=True)
+        self.ListUsers = channel.unary_unary(
+                '/user.UserService/ListUsers',
+                request_serializer=user__pb2.ListUsersRequest.SerializeToString,
+                response_deserializer=user__pb2.ListUsersResponse.FromString,
+                _registered_method=True)
+        self.SearchUsers = channel.unary_unary(
+                '/user.UserService/SearchUsers',
+                request_serializer=user__pb2.SearchUsersRequest.SerializeToString,
+                response_deserializer=user__pb2.ListUsersResponse.FromString,
+                _registered_method=True)
+        self.StreamUsers = channel.unary_stream(
+                '/user.UserService/StreamUsers',
+                request_serializer=user__pb2.ListUsersRequest.SerializeToString,
+                response_deserializer=user__pb2.User.FromString,
+                _registered_method=True)
+        self.BulkRegisterUsers = channel.stream_unary(
+                '/user.UserService/BulkRegisterUsers',
+                request_serializer=user__pb2.RegisterUserRequest.SerializeToString,
+                response_deserializer=user__pb2.BulkRegisterUsersResponse.FromString,
+                _registered_method=True)
+        self.BatchGetUsers = channel.unary_unary(
+                '/user.UserService/BatchGetUsers',
+                request_serializer=user__pb2.BatchGetUsersRequest.SerializeToString,
+                response_deserializer=user__pb2.BatchGetUsersResponse.FromString,
+                _registered_method=True)
+        self.WatchUserEvents = channel.unary_stream(
+                '/user.UserService/WatchUserEvents',
+                request_serializer=user__pb2.WatchUserEventsRequest.SerializeToString,
+                response_deserializer=user__pb2.UserEvent.FromString,
+                _registered_method=True)
 
 
 class UserServiceServicer(object):
@@ -80,6 +120,22 @@ class UserServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RefreshToken(self, request, context):
+        """RPC method for exchanging a refresh token for a new access token and
+        the next refresh token, without the password.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Logout(self, request, context):
+        """RPC method for logging out: revokes the access token in the metadata
+        and every refresh token of the session.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetUser(self, request, context):
         """RPC method for getting a user's profile information.
         rpc GetUser (GetUserRequest) returns (UserResponse);
@@ -89,7 +145,8 @@ class UserServiceServicer(object):
         raise NotImplementedError('Method not implemented!')
 
     def UpdateUserProfile(self, request, context):
-        """RPC method for updating a user's profile.
+        """RPC method for updating the caller's own profile. Fails with ABORTED if
+        the profile changed since the version the client read.
         """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
@@ -97,6 +154,53 @@ class UserServiceServicer(object):
 
     def ListAllUsers(self, request, context):
         """RPC method for the admin to list all users.
+        Deprecated: returns only the first page; use ListUsers or StreamUsers.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListUsers(self, request, context):
+        """RPC method for the admin to list users one page at a time.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchUsers(self, request, context):
+        """RPC method for the admin to find users by part of their username or
+        email, best matches first.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StreamUsers(self, request, context):
+        """RPC method for the admin to stream every user, ordered by username.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BulkRegisterUsers(self, request_iterator, context):
+        """RPC method for importing many users in one call. Each streamed request
+        gets its own result, in the order they were sent.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BatchGetUsers(self, request, context):
+        """RPC method for looking up many users by id in one round trip.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def WatchUserEvents(self, request, context):
+        """RPC method for following registrations and profile changes as they are
+        committed. The stream stays open; reconnect with the last sequence
+        received to resume. Fails with OUT_OF_RANGE if that was purged.
         """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
@@ -115,6 +219,16 @@ def add_UserServiceServicer_to_server(servicer, server):
                     request_deserializer=user__pb2.LoginUserRequest.FromString,
                     response_serializer=user__pb2.LoginUserResponse.SerializeToString,
             ),
+            'RefreshToken': grpc.unary_unary_rpc_method_handler(
+                    servicer.RefreshToken,
+                    request_deserializer=user__pb2.RefreshTokenRequest.FromString,
+                    response_serializer=user__pb2.LoginUserResponse.SerializeToString,
+            ),
+            'Logout': grpc.unary_unary_rpc_method_handler(
+                    servicer.Logout,
+                    request_deserializer=user__pb2.LogoutRequest.FromString,
+                    response_serializer=user__pb2.LogoutResponse.SerializeToString,
+            ),
             'GetUser': grpc.unary_unary_rpc_method_handler(
                     servicer.GetUser,
                     request_deserializer=user__pb2.EmptyRequest.FromString,
@@ -130,6 +244,36 @@ def add_UserServiceServicer_to_server(servicer, server):
                     request_deserializer=user__pb2.EmptyRequest.FromString,
                     response_serializer=user__pb2.ListUsersResponse.SerializeToString,
             ),
+            'ListUsers': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListUsers,
+                    request_deserializer=user__pb2.ListUsersRequest.FromString,
+                    response_serializer=user__pb2.ListUsersResponse.SerializeToString,
+            ),
+            'SearchUsers': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchUsers,
+                    request_deserializer=user__pb2.SearchUsersRequest.FromString,
+                    response_serializer=user__pb2.ListUsersResponse.SerializeToString,
+            ),
+            'StreamUsers': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamUsers,
+                    request_deserializer=user__pb2.ListUsersRequest.FromString,
+                    response_serializer=user__pb2.User.SerializeToString,
+            ),
+            'BulkRegisterUsers': grpc.stream_unary_rpc_method_handler(
+                    servicer.BulkRegisterUsers,
+                    request_deserializer=user__pb2.RegisterUserRequest.FromString,
+                    response_serializer=user__pb2.BulkRegisterUsersResponse.SerializeToString,
+            ),
+            'BatchGetUsers': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchGetUsers,
+                    request_deserializer=user__pb2.BatchGetUsersRequest.FromString,
+                    response_serializer=user__pb2.BatchGetUsersResponse.SerializeToString,
+            ),
+            'WatchUserEvents': grpc.unary_stream_rpc_method_handler(
+                    servicer.WatchUserEvents,
+                    request_deserializer=user__pb2.WatchUserEventsRequest.FromString,
+                    response_serializer=user__pb2.UserEvent.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'user.UserService', rpc_method_handlers)
@@ -196,6 +340,60 @@ class UserService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def RefreshToken(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user.UserService/RefreshToken',
+            user__pb2.RefreshTokenRequest.SerializeToString,
+            user__pb2.LoginUserResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Logout(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user.UserService/Logout',
+            user__pb2.LogoutRequest.SerializeToString,
+            user__pb2.LogoutResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def GetUser(request,
             target,
@@ -276,3 +474,165 @@ class UserService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def ListUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user.UserService/ListUsers',
+            user__pb2.ListUsersRequest.SerializeToString,
+            user__pb2.ListUsersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SearchUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user.UserService/SearchUsers',
+            user__pb2.SearchUsersRequest.SerializeToString,
+            user__pb2.ListUsersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def StreamUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/user.UserService/StreamUsers',
+            user__pb2.ListUsersRequest.SerializeToString,
+            user__pb2.User.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def BulkRegisterUsers(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/user.UserService/BulkRegisterUsers',
+            user__pb2.RegisterUserRequest.SerializeToString,
+            user__pb2.BulkRegisterUsersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def BatchGetUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user.UserService/BatchGetUsers',
+            user__pb2.BatchGetUsersRequest.SerializeToString,
+            user__pb2.BatchGetUsersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def WatchUserEvents(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/user.UserService/WatchUserEvents',
+            user__pb2.WatchUserEventsRequest.SerializeToString,
+            user__pb2.UserEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,101 @@
+import sqlite3
+import uuid
+
+import bcrypt
+import pytest
+
+from backend.database import SQLiteUserRepository
+from backend.hashing import HashingExecutor
+from backend.ids import user_id_bytes
+from backend.pool import ConnectionPool
+
+
+# The table as the original init_db created it, before schema migrations.
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL
+);
+"""
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database written by the original server: uuid4 ids and hashes in a TEXT column."""
+    path = str(tmp_path / 'users.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    users = []
+    for i in range(50):
+        user_id = str(uuid.uuid4())
+        hashed_password = bcrypt.hashpw(f'password{i}'.encode('utf-8'), bcrypt.gensalt(4))
+        # The original server stored bcrypt's bytes; other writers stored text.
+        if i % 2:
+            hashed_password = hashed_password.decode('ascii')
+        users.append((user_id, f'user{i:02d}', f'user{i:02d}@example.com', hashed_password))
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", users)
+    conn.commit()
+    conn.close()
+    return path, users
+
+
+@pytest.fixture(scope='module')
+def hasher():
+    hasher = HashingExecutor(kind='thread', workers=2, rounds=4)
+    yield hasher
+    hasher.shutdown()
+
+
+def check_users(repository, hasher, users):
+    for i, (user_id, username, email, hashed_password) in enumerate(users):
+        record = repository.get_user_by_id(user_id)
+        assert record['id'] == user_id
+        assert (record['username'], record['email']) == (username, email)
+        assert record['hashed_password'] == hashed_password
+        # The check LoginUser makes, whichever way the hash was stored.
+        assert hasher.submit_check(f'password{i}'.encode('utf-8'), record['hashed_password']).result()
+        assert repository.get_user_by_email(email)['id'] == user_id
+
+
+def test_upgrade_then_compact_keeps_every_user(baseline_db, hasher):
+    path, users = baseline_db
+    repository = SQLiteUserRepository(ConnectionPool(path, size=2))
+    repository.migrate()
+    repository.build_indexes()
+    assert not repository.compact_ids
+    check_users(repository, hasher, users)
+
+    assert repository.compact() is True
+    assert repository.compact_ids
+    check_users(repository, hasher, users)
+    with repository.pool.connection() as conn:
+        raw_ids = {row[0] for row in conn.execute("SELECT id FROM users")}
+        assert raw_ids == {user_id_bytes(user_id) for user_id, _, _, _ in users}
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    # Already compact: nothing to do.
+    assert repository.compact() is False
+    repository.close()
+
+
+def test_compact_layout_keeps_working(baseline_db):
+    path, users = baseline_db
+    repository = SQLiteUserRepository(ConnectionPool(path, size=2))
+    repository.migrate()
+    repository.compact()
+    user_id, username, _, _ = users[0]
+
+    updated = repository.update_user(user_id, {'email': 'renamed@example.com'}, expected_version=1)
+    assert (updated['id'], updated['email'], updated['version']) == (user_id, 'renamed@example.com', 2)
+    found = repository.get_users_by_ids([user_id, users[1][0], str(uuid.uuid4())])
+    assert set(found) == {user_id, users[1][0]}
+    assert [u['id'] for u in repository.search_users(username, 5)] == [user_id]
+    assert [u['username'] for u in repository.list_users(limit=3)] == ['user00', 'user01', 'user02']
+    events = repository.list_user_events(0, 10)
+    assert [(e['user_id'], e['email']) for e in events] == [(user_id, 'renamed@example.com')]
+
+    new_id = str(uuid.uuid4())
+    repository.insert_user(new_id, 'newcomer', 'newcomer@example.com', b'hash')
+    assert repository.get_user_by_id(new_id)['username'] == 'newcomer'
+    repository.close()
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from backend import sessions
+from backend.auth import RevocationList, TokenRevoked, TokenService
+from backend.database import SQLiteUserRepository
+from backend.pool import ConnectionPool
+from backend.sessions import SessionStore
+
+
+USER_ID = '0192d6a4-5b7e-7c3a-9f1e-2b4c6d8e0a1f'
+REUSE_INTERVAL = 10
+
+
+class Clock:
+    """Stands in for the time module in backend.sessions."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def users(tmp_path):
+    repository = SQLiteUserRepository(ConnectionPool(str(tmp_path / 'users.db'), size=2))
+    repository.migrate()
+    repository.insert_user(USER_ID, 'alice', 'alice@example.com', b'not-a-real-hash')
+    yield repository
+    repository.close()
+
+
+@pytest.fixture
+def store(users, clock):
+    return SessionStore(users, RevocationList(), ttl=3600, reuse_interval=REUSE_INTERVAL)
+
+
+def test_rotate_exchanges_a_token_for_the_next(store):
+    first = store.issue(USER_ID)
+
+    user_id, second = store.rotate(first)
+    assert user_id == USER_ID
+    assert second != first
+    # The new token carries the session on.
+    user_id, third = store.rotate(second)
+    assert user_id == USER_ID
+    assert third not in (first, second)
+
+
+def test_rotate_rejects_unknown_and_expired_tokens(store, clock):
+    assert store.rotate('not-a-token') is None
+
+    token = store.issue(USER_ID)
+    clock.now += 3600 + 1
+    assert store.rotate(token) is None
+    assert store.stats()['refresh_tokens_rejected'] == 2
+
+
+def test_reexchange_within_reuse_interval_keeps_the_session(store, clock):
+    first = store.issue(USER_ID)
+    _, second = store.rotate(first)
+
+    # Two requests that refreshed at once: the late one still gets a token.
+    clock.now += REUSE_INTERVAL - 1
+    user_id, third = store.rotate(first)
+    assert user_id == USER_ID
+    assert third != second
+    assert store.rotate(second) is not None
+    assert store.rotate(third) is not None
+    assert store.stats()['refresh_token_replays'] == 0
+
+
+def test_reexchange_after_reuse_interval_ends_the_family(store, clock):
+    first = store.issue(USER_ID)
+    _, second = store.rotate(first)
+    other_session = store.issue(USER_ID)
+
+    clock.now += REUSE_INTERVAL + 1
+    assert store.rotate(first) is None
+    # The copy and the legitimate holder are both logged out...
+    assert store.rotate(second) is None
+    # ...but not the user's other logins.
+    assert store.rotate(other_session) is not None
+    assert store.stats()['refresh_token_replays'] == 1
+
+
+def test_logout_then_refresh(users, monkeypatch):
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-secret-key-of-at-least-32-bytes')
+    monkeypatch.delenv('JWT_ALGORITHM', raising=False)
+    tokens = TokenService()
+    store = SessionStore(users, tokens.revoked)
+    refresh_token = store.issue(USER_ID)
+    access_token = tokens.create_token(USER_ID, 'alice')
+    claims = tokens.decode_token(access_token)
+
+    store.logout(claims, refresh_token)
+
+    assert store.rotate(refresh_token) is None
+    with pytest.raises(TokenRevoked):
+        tokens.decode_token(access_token)
+    # Another process learns of the logout at its next sync.
+    elsewhere = SessionStore(users, RevocationList())
+    elsewhere.sync()
+    assert claims['jti'] in elsewhere.revoked